@@ -0,0 +1,426 @@
+#!/usr/bin/python
+
+""" Simulate a fleet of datalogger machines driving the path files of this folder, from one asyncio scheduler.
+
+It reads the machine definition files pathinator.sh runs (trucks.json,
+excavator.json) and the path files they name, and posts what the machines do
+to a site through the RDM client of site-tool.py:
+
+    sl::sim::position    where a machine is, every `grain` simulated seconds
+    sl::sim::event       a path point with an action, delay, region, material, ...
+    sl::sim::state       the `state` of a path point, one namespace per object
+
+Every machine of a definition file follows the same route, so each route is
+interpolated once, in one batch over all of its sample times, and a machine
+only looks its positions up. Simulated time runs `speed_factor` times faster
+than the wall clock. The throughput, the scheduling lag and the simulated to
+wall clock ratio actually reached are reported every --report-seconds.
+"""
+
+import argparse
+import asyncio
+import heapq
+import importlib.util
+import json
+import logging
+import math
+import os
+import signal
+import sys
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+SITE_TOOL_DIR = os.path.join(SCRIPT_DIR, "..", "..", "sites", "site-tool")
+
+DEFAULT_FLEET_FILES = ["trucks.json", "excavator.json"]
+DEFAULT_SPEED_FACTOR = 1.0
+DEFAULT_SIM_QUEUE = 2000
+DEFAULT_SIM_BATCH = 500
+DEFAULT_REPORT_SECONDS = 10
+EARTH_RADIUS = 6371008.8
+# the keys of a path point that describe the move itself rather than something that happens there
+MOVE_KEYS = ("point", "speed", "state")
+
+def load_site_tool():
+    """ site-tool.py as a module; its name is not an identifier, so it is loaded from its path """
+    if SITE_TOOL_DIR not in sys.path: sys.path.insert(0, SITE_TOOL_DIR)
+    spec = importlib.util.spec_from_file_location("site_tool", os.path.join(SITE_TOOL_DIR, "site-tool.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+site_tool = load_site_tool()
+
+def distance(a, b):
+    """ metres between two [lat, lon, height] points, close enough over the length of a haul road segment """
+    lat = math.radians((a[0] + b[0]) / 2)
+    dy = math.radians(b[0] - a[0]) * EARTH_RADIUS
+    dx = math.radians(b[1] - a[1]) * EARTH_RADIUS * math.cos(lat)
+    dz = (b[2] - a[2]) if len(a) > 2 and len(b) > 2 else 0.0
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+def interpolate(times, points, samples):
+    """ the points at each of the sorted sample times along the polyline through points at the increasing times,
+    held at the ends; one numpy call per coordinate when numpy is installed, one pass over the knots otherwise """
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        columns = numpy.asarray(points, dtype=float).T
+        return numpy.stack([numpy.interp(samples, times, column) for column in columns], axis=1).tolist()
+    result, k = [], 0
+    for t in samples:
+        while k + 2 < len(times) and times[k + 1] <= t:
+            k += 1
+        if len(times) == 1 or t <= times[0]:
+            result.append(list(points[0]))
+        elif t >= times[-1]:
+            result.append(list(points[-1]))
+        else:
+            f = (t - times[k]) / (times[k + 1] - times[k])
+            result.append([a + (b - a) * f for a, b in zip(points[k], points[k + 1])])
+    return result
+
+class Route(object):
+    """ A path file driven at the speeds it gives, starting at `speed` m/s.
+
+    A machine moves to each point in turn and waits there for the point's
+    `delay`; a `speed` applies from that point on. `arrivals` holds when a haul
+    reaches each point, `duration` how long the haul takes, and `positions`
+    where the machine is every `grain` seconds of one cycle, the haul followed
+    by `interval` seconds waiting at its last point.
+    """
+    def __init__(self, steps, speed, grain, interval):
+        if not steps: raise ValueError("a path needs at least one point")
+        self.steps = steps
+        self.grain = grain
+        times, points, self.arrivals = [], [], []
+        t, previous = 0.0, None
+        for step in steps:
+            point = [float(x) for x in step["point"]]
+            if previous is not None:
+                t += distance(previous, point) / max(speed, 1e-3)
+            self.knot(times, points, t, point)
+            self.arrivals.append(t)
+            if step.get("delay"):
+                t += float(step["delay"])
+                self.knot(times, points, t, point)
+            speed = float(step.get("speed", speed))
+            previous = point
+        self.duration = t
+        self.cycle = t + interval
+        self.sample_times = [j * grain for j in range(int(math.ceil(self.cycle / grain)) or 1)]
+        self.positions = interpolate(times, points, self.sample_times)
+
+    @staticmethod
+    def knot(times, points, t, point):
+        # two points reached at the same moment (a move of no length) leave the later one
+        if times and t <= times[-1]:
+            points[-1] = point
+        else:
+            times.append(t)
+            points.append(point)
+
+class Fleet(object):
+    """ a machine definition file and the route its machines follow """
+    def __init__(self, path, hauls=None):
+        with open(path) as f:
+            self.config = json.load(f)
+        self.path = path
+        self.folder = os.path.dirname(os.path.realpath(path))
+        self.grain = float(self.config.get("grain", 2.0))
+        self.interval = float(self.config.get("interval", 0))
+        self.hauls = hauls if hauls is not None else int(self.config.get("num_hauls", 1))
+        with open(self.resolve(self.config["path_file"])) as f:
+            steps = json.load(f)
+        self.route = Route(steps, float(self.config.get("speed", 1.0)), self.grain, self.interval)
+
+    def resolve(self, name):
+        return name if os.path.isabs(name) else os.path.join(self.folder, name)
+
+    def fixture_files(self):
+        return [self.resolve(name) for name in self.config.get("fixture_files", [])]
+
+    def machines(self, replicas=1, stagger=0.0):
+        """ the machine definitions, each repeated `replicas` times under numbered names with staggered starts """
+        for n in range(replicas):
+            for definition in self.config.get("machines", []):
+                definition = dict(definition)
+                if n:
+                    definition["device"] = "%s-%d" % (definition.get("device", definition["machine"]), n)
+                    definition["machine"] = "%s-%d" % (definition["machine"], n)
+                definition["delay_seconds"] = float(definition.get("delay_seconds", 0)) + n * stagger
+                yield definition
+
+class Machine(object):
+    """ one simulated machine: where it is in its hauls and the packets it owes up to a simulated time """
+    def __init__(self, fleet, definition, epoch):
+        self.fleet = fleet
+        self.route = fleet.route
+        self.definition = definition
+        self.operator = definition.get("operator")
+        self.epoch = epoch
+        self.haul = 0
+        self.haul_start = float(definition.get("delay_seconds", 0))
+        self.sample = 0
+        self.arrival = 0
+
+    def due(self):
+        """ the simulated time of the next packet, None once every haul is done """
+        if self.haul >= self.fleet.hauls: return None
+        if self.arrival < len(self.route.arrivals):
+            return self.haul_start + min(self.route.sample_times[self.sample] if self.sample < len(self.route.sample_times) else self.route.cycle, self.route.arrivals[self.arrival])
+        if self.sample < len(self.route.sample_times):
+            return self.haul_start + self.route.sample_times[self.sample]
+        return self.haul_start + self.route.cycle
+
+    def packet(self, _type, t, point, **fields):
+        packet = {"_id" : str(uuid.uuid4()), "_type" : _type, "machine" : self.definition["machine"], "device" : self.definition.get("device"), "operator" : self.operator, "haul" : self.haul, "at" : int(round((self.epoch + t) * 1000)), "point" : point}
+        packet.update(fields)
+        return packet
+
+    def advance(self, until):
+        """ the packets due up to simulated time until, in time order """
+        packets = []
+        route = self.route
+        while True:
+            due = self.due()
+            if due is None or due > until: return packets
+            if self.arrival < len(route.arrivals) and self.haul_start + route.arrivals[self.arrival] <= due:
+                step = route.steps[self.arrival]
+                self.arrival += 1
+                packets.extend(self.arrive(step, due))
+            elif self.sample < len(route.sample_times):
+                packets.append(self.packet("sl::sim::position", due, route.positions[self.sample]))
+                self.sample += 1
+            else:
+                self.haul += 1
+                self.haul_start += route.cycle
+                self.sample = self.arrival = 0
+
+    def arrive(self, step, t):
+        point = [float(x) for x in step["point"]]
+        if "operator" in step: self.operator = step["operator"]
+        packets = []
+        fields = dict((k, v) for k, v in step.items() if k not in MOVE_KEYS and k != "operator")
+        if fields:
+            if "quantity" not in fields and "quantity" in self.definition: fields["quantity"] = self.definition["quantity"]
+            packets.append(self.packet("sl::sim::event", t, point, **fields))
+        for ns, state in sorted(step.get("state", {}).items()):
+            packets.append(self.packet("sl::sim::state", t, point, ns=ns, state=state))
+        return packets
+
+class SimulationStats(object):
+    """ what the simulation produced and sent, and how far its scheduling fell behind the wall clock """
+    def __init__(self, speed_factor):
+        self.speed_factor = speed_factor
+        self.started = time.time()
+        self.simulated = 0.0
+        self.generated = 0
+        self.sent = 0
+        self.failed = 0
+        self.lags = []
+        self.last_sent, self.last_time = 0, self.started
+
+    def record_lag(self, lag):
+        self.lags.append(max(0.0, lag))
+
+    def report(self, machines, queued):
+        now = time.time()
+        wall = max(now - self.started, 1e-6)
+        rate = (self.sent - self.last_sent) / max(now - self.last_time, 1e-6)
+        self.last_sent, self.last_time = self.sent, now
+        lags, self.lags = sorted(self.lags), []
+        p50 = lags[len(lags) // 2] if lags else 0.0
+        p99 = lags[min(len(lags) - 1, int(0.99 * len(lags)))] if lags else 0.0
+        return "%d machine(s), %d packet(s) generated, %d sent, %d failed, %d queued: %.1f events/s; scheduling lag p50 %.3fs p99 %.3fs max %.3fs; simulated %.1fs in %.1fs: %.2fx (target %.2fx)" % (machines, self.generated, self.sent, self.failed, queued, rate, p50, p99, lags[-1] if lags else 0.0, self.simulated, wall, self.simulated / wall, self.speed_factor)
+
+class RdmSink(object):
+    """ posts packets to a site through a pipelined RdmEventWriter; a failed post is counted and the rest go on """
+    def __init__(self, accessor, stats, window, retries):
+        self.stats = stats
+        self.writer = site_tool.RdmEventWriter(accessor, window=window, retries=retries, keep_going=True)
+
+    def acknowledged(self, result, error):
+        if error is None:
+            self.stats.sent += 1
+            return
+        self.stats.failed += 1
+        if self.stats.failed <= 10: logger.warning("post failed: %s", error)
+
+    def send(self, packets):
+        for packet in packets:
+            site_tool.post_rdm_payload(packet, self.writer, a_on_ack=self.acknowledged)
+
+    def close(self):
+        try:
+            self.writer.flush()
+        finally:
+            self.writer.close()
+
+class JsonlSink(object):
+    """ writes packets to a JSONL file instead of posting them """
+    def __init__(self, path, stats):
+        self.stats = stats
+        self.file = sys.stdout if path == "-" else open(path, "w")
+
+    def send(self, packets):
+        for packet in packets:
+            self.file.write(json.dumps(packet, sort_keys=True) + "\n")
+        self.stats.sent += len(packets)
+
+    def close(self):
+        if self.file is not sys.stdout: self.file.close()
+
+class Simulation(object):
+    """ Runs every machine from one asyncio scheduler.
+
+    Machines wait in a heap ordered by the simulated time of their next packet.
+    The scheduler sleeps until the earliest one is due, advances every machine
+    due by then and queues their packets; a sender hands the queue to the sink
+    in batches on a worker thread. A sink that cannot keep up fills the queue,
+    which holds up the scheduler, and shows as scheduling lag.
+    """
+    def __init__(self, machines, sink, stats, speed_factor=DEFAULT_SPEED_FACTOR, duration=None, queue_size=DEFAULT_SIM_QUEUE, batch=DEFAULT_SIM_BATCH, report_seconds=DEFAULT_REPORT_SECONDS):
+        self.machines = machines
+        self.sink = sink
+        self.stats = stats
+        self.speed_factor = speed_factor
+        self.duration = duration
+        self.queue_size = queue_size
+        self.batch = batch
+        self.report_seconds = report_seconds
+
+    def stopped(self, stopping):
+        return stopping.is_set() or (self.duration is not None and time.time() - self.stats.started >= self.duration)
+
+    async def schedule(self, queue, stopping):
+        heap = [(machine.due(), n, machine) for n, machine in enumerate(self.machines) if machine.due() is not None]
+        heapq.heapify(heap)
+        started = self.stats.started
+        while heap and not self.stopped(stopping):
+            wait = started + heap[0][0] / self.speed_factor - time.time()
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(stopping.wait(), timeout=min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            now = (time.time() - started) * self.speed_factor
+            while heap and heap[0][0] <= now and not self.stopped(stopping):
+                due, n, machine = heapq.heappop(heap)
+                self.stats.record_lag(time.time() - started - due / self.speed_factor)
+                self.stats.simulated = max(self.stats.simulated, due)
+                for packet in machine.advance(now):
+                    self.stats.generated += 1
+                    await queue.put(packet)
+                after = machine.due()
+                if after is not None: heapq.heappush(heap, (after, n, machine))
+            if not heap or heap[0][0] > now: self.stats.simulated = now
+        await queue.put(None)
+
+    async def send(self, queue):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            packets = [await queue.get()]
+            while len(packets) < self.batch and not queue.empty():
+                packets.append(queue.get_nowait())
+            if packets[-1] is None:
+                packets.pop()
+                done = True
+            if packets: await loop.run_in_executor(None, self.sink.send, packets)
+
+    async def report(self, queue):
+        while True:
+            await asyncio.sleep(self.report_seconds)
+            logger.info("simulation: %s", self.stats.report(len(self.machines), queue.qsize()))
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        reporter = asyncio.ensure_future(self.report(queue))
+        try:
+            await asyncio.gather(self.schedule(queue, stopping), self.send(queue))
+        finally:
+            reporter.cancel()
+            await loop.run_in_executor(None, self.sink.close)
+        logger.info("simulation: %s", self.stats.report(len(self.machines), queue.qsize()))
+
+def load_fixtures(accessor, fleets, window, retries):
+    """ post the RDM objects of the fixture files of every fleet once, in file order """
+    writer = site_tool.RdmEventWriter(accessor, window=window, retries=retries)
+    try:
+        for path in sorted(set(name for fleet in fleets for name in fleet.fixture_files())):
+            with open(path, "rb") as f:
+                for number, obj, error in site_tool.iter_json_lines(f):
+                    if error is not None: raise ValueError("%s line %d: %s" % (path, number, error[0]))
+                    writer.post(obj)
+            logger.info("posted fixtures from %s", path)
+        writer.flush()
+    finally:
+        writer.close()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Simulate datalogger machines driving path files, posting what they do to RDM")
+    site_tool.add_default_arguments(arg_parser)
+    rdm_url = "%s://%s:%s" % (os.environ.get("SITELINK_RDM_SCHEME", "https"), os.environ["SITELINK_RDM_HOST"], os.environ.get("SITELINK_RDM_PORT", "443")) if os.environ.get("SITELINK_RDM_HOST") else None
+    arg_parser.add_argument("--url", default=rdm_url, help="RDM URL (dflt: $SITELINK_RDM_SCHEME://$SITELINK_RDM_HOST:$SITELINK_RDM_PORT)")
+    arg_parser.add_argument("--site", default=os.environ.get("SITE") or None, help="Site identifier (dflt: $SITE)")
+    arg_parser.add_argument("--domain", help="RDM domain the packets are posted to")
+    arg_parser.add_argument("--output", default="", help="write the packets to this JSONL file ('-' for stdout) instead of posting them")
+    arg_parser.add_argument("--replicas", type=int, default=1, help="copies of every machine to simulate, under numbered names")
+    arg_parser.add_argument("--stagger", type=float, default=5.0, help="simulated seconds between the starts of the copies of a machine")
+    arg_parser.add_argument("--speed-factor", type=float, default=None, help="simulated seconds per wall clock second (dflt: each file's speed_factor, or 1)")
+    arg_parser.add_argument("--hauls", type=int, default=None, help="hauls each machine runs (dflt: each file's num_hauls)")
+    arg_parser.add_argument("--duration", type=float, default=None, help="stop after this many wall clock seconds")
+    arg_parser.add_argument("--fixtures", choices=["auto", "always", "never"], default="auto", help="post the fixture files first; auto does unless a file says ready_already")
+    arg_parser.add_argument("--post-window", type=int, default=site_tool.RDM_POST_WINDOW, help="RDM posts kept in flight")
+    arg_parser.add_argument("--post-retries", type=int, default=site_tool.RDM_POST_RETRIES, help="times a post that failed with a connection error, 429 or 5xx is retried")
+    arg_parser.add_argument("--queue", type=int, default=DEFAULT_SIM_QUEUE, help="packets the scheduler may run ahead of the posts")
+    arg_parser.add_argument("--report-seconds", type=float, default=DEFAULT_REPORT_SECONDS, help="how often the event rate, scheduling lag and simulated time are reported")
+    arg_parser.add_argument("files", nargs="*", default=[os.path.join(SCRIPT_DIR, name) for name in DEFAULT_FLEET_FILES], help="machine definition files (dflt: %s)" % " ".join(DEFAULT_FLEET_FILES))
+    args = arg_parser.parse_args()
+    args.token = args.token or os.environ.get("AUTH_TOKEN") or None
+    if not args.output and not (args.url and args.site and args.token):
+        arg_parser.error("--url, --site and --token are needed to post, or --output to write the packets to a file")
+
+    logging.basicConfig(format=args.log_fmt, level=logging.INFO)
+
+    fleets = [Fleet(path, hauls=args.hauls) for path in args.files]
+    speed_factor = args.speed_factor or float(fleets[0].config.get("speed_factor", DEFAULT_SPEED_FACTOR))
+    epoch = time.time()
+    machines = [Machine(fleet, definition, epoch) for fleet in fleets for definition in fleet.machines(args.replicas, args.stagger)]
+    for fleet in fleets:
+        logger.info("%s: %d machine(s) on a %.0fs haul of %d point(s), a position every %.1fs", os.path.basename(fleet.path), len([m for m in machines if m.fleet is fleet]), fleet.route.duration, len(fleet.route.steps), fleet.grain)
+
+    stats = SimulationStats(speed_factor)
+    site_tool.configure_body_sampling(every=args.log_body_sample, limit=args.log_body_limit)
+    if args.output:
+        sink = JsonlSink(args.output, stats)
+    else:
+        transport = site_tool.configure_transport(pool_connections=args.pool_connections, pool_maxsize=max(args.pool_maxsize, args.post_window), max_concurrency=args.max_concurrency, retry_budget=args.retry_budget, target_latency=args.target_latency)
+        accessor = site_tool.RdmAccessor(site_tool.RdmItf(api_url=args.url, verify=not args.unverified, transport=transport), site=args.site, domain=args.domain, token=args.token, read_back=False)
+        if args.fixtures == "always" or (args.fixtures == "auto" and not all(fleet.config.get("ready_already") for fleet in fleets)):
+            load_fixtures(accessor, fleets, args.post_window, args.post_retries)
+        sink = RdmSink(accessor, stats, args.post_window, args.post_retries)
+
+    simulation = Simulation(machines, sink, stats, speed_factor=speed_factor, duration=args.duration, queue_size=args.queue, report_seconds=args.report_seconds)
+    try:
+        asyncio.run(simulation.run())
+    finally:
+        if not args.output:
+            transport.log_stats()
+            if args.profile: site_tool.get_metrics().write_report(args.profile)
+    if stats.failed: raise SystemExit(1)
+""" done """
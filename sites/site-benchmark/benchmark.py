@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+""" Benchmark site-tool.py verbs against a local stand-in server.
+
+Every scenario runs site-tool.py as a child process against a freshly
+populated stand-in and reports wall time, throughput, the p50/p99 latency of
+the requests the stand-in served, the connections it accepted and the peak
+RSS of the child.
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from standin import *
+
+logger = logging.getLogger(__name__)
+
+SITE_TOOL = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "site-tool", "site-tool.py")
+
+SCENARIOS = ["copy", "view", "load", "lines", "regions", "regions-columnar"]
+
+def percentile(values, fraction):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def high_water_mark(pid):
+    """ peak resident set size of a running process in bytes, 0 where /proc is not available """
+    try:
+        with open("/proc/%d/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return 0
+
+def run_tool(url, site, tool_args, verb_args, work_dir):
+    """ run site-tool.py to completion; returns the seconds it took and its peak RSS in bytes """
+    command = [sys.executable, SITE_TOOL, "--token", "benchmark", "--url", url] + tool_args + [site] + verb_args
+    start = time.time()
+    peak_rss = 0
+    with open(os.path.join(work_dir, "output.log"), "wb") as output:
+        process = subprocess.Popen(command, cwd=work_dir, stdout=output, stderr=subprocess.STDOUT)
+        # ru_maxrss of a child includes the memory of this process it was forked from, so sample its high water mark instead
+        while process.poll() is None:
+            peak_rss = max(peak_rss, high_water_mark(process.pid))
+            time.sleep(0.02)
+    seconds = time.time() - start
+    if process.returncode != 0:
+        with open(os.path.join(work_dir, "output.log"), "rb") as output:
+            tail = output.read()[-2000:].decode("utf-8", "replace")
+        raise RuntimeError("site-tool.py %s failed with %d:\n%s" % (" ".join(verb_args), process.returncode, tail))
+    return seconds, peak_rss
+
+def sample_objects(count):
+    with open(os.path.join(SIMULATOR_DIR, "state.jsonl")) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    for i in range(count):
+        obj = dict(samples[i % len(samples)])
+        obj["_id"] = "benchmark-%08d" % i
+        obj.pop("_rev", None)
+        yield obj
+
+def run_scenario(scenario, standin, url, args, work_dir):
+    """ populate a site for the scenario, run it once and return its measurements """
+    site = "bench-%s-%d" % (scenario, int(time.time() * 1000))
+    source = populate_from_spec(standin, "%s:%d:%d:%d:%d:%d:%d" % (site, args.objects, args.files, args.file_size, args.design_files, args.revisions, args.regions))
+    source_events = sum(len(d.events) for d in source.domains.values())
+    source_bytes = sum(len(x) for x in source.files.values()) + sum(len(x) for x in source.design_files.values())
+    standin.take_timings()
+    standin.take_connections()
+    if scenario == "copy":
+        verb_args = ["copy", url, site + "-copy", "benchmark"]
+        items, moved = source_events, source_bytes
+    elif scenario == "view":
+        verb_args = ["view", "_head"]
+        items, moved = len(source.domain("sitelink").heads), 0
+    elif scenario in ("load", "lines"):
+        file_name = os.path.join(work_dir, "objects.json")
+        objects = list(sample_objects(args.objects))
+        with open(file_name, "w") as f:
+            if scenario == "load": json.dump(objects, f)
+            else: f.write("".join(json.dumps(o) + "\n" for o in objects))
+        verb_args = [scenario, file_name]
+        items, moved = len(objects), os.path.getsize(file_name)
+    elif scenario in ("regions", "regions-columnar"):
+        verb_args = ["regions"]
+        items, moved = args.regions, 0
+    tool_args = ["--jsonl"] + (["--journal", ""] if scenario == "copy" else []) + (["--regions-format", "columnar"] if scenario == "regions-columnar" else []) + args.tool_args
+    seconds, peak_rss = run_tool(url, site, tool_args, verb_args, work_dir)
+    timings = standin.take_timings()
+    connections = standin.take_connections()
+    latencies = [x for values in timings.values() for x in values]
+    return {
+        "scenario" : scenario,
+        "seconds" : round(seconds, 3),
+        "items" : items,
+        "items_per_second" : round(items / seconds, 1) if seconds else 0.0,
+        "mib_per_second" : round(moved / seconds / 1048576.0, 2) if seconds else 0.0,
+        "requests" : len(latencies),
+        "connections" : connections,
+        "p50_ms" : round(1000 * percentile(latencies, 0.50), 2),
+        "p99_ms" : round(1000 * percentile(latencies, 0.99), 2),
+        "peak_rss_mib" : round(peak_rss / 1048576.0, 1),
+    }
+
+def print_results(results):
+    columns = ["scenario", "seconds", "items", "items_per_second", "mib_per_second", "requests", "connections", "p50_ms", "p99_ms", "peak_rss_mib"]
+    widths = [max(len(c), max([len(str(r[c])) for r in results] or [0])) for c in columns]
+    print("  ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).rjust(w) for c, w in zip(columns, widths)))
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark site-tool.py verbs against a local Sitelink3D v2 stand-in")
+    arg_parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run, may be repeated (default: all)")
+    arg_parser.add_argument("--repeat", type=int, default=1, help="runs per scenario")
+    arg_parser.add_argument("--objects", type=int, default=2000, help="RDM objects per synthetic site, and objects loaded by load/lines")
+    arg_parser.add_argument("--revisions", type=int, default=1, help="revisions logged per object")
+    arg_parser.add_argument("--files", type=int, default=20, help="files per synthetic site")
+    arg_parser.add_argument("--file-size", type=int, default=1048576, help="bytes per file and design file")
+    arg_parser.add_argument("--design-files", type=int, default=5, help="design files per synthetic site")
+    arg_parser.add_argument("--regions", type=int, default=200, help="regions per synthetic site")
+    arg_parser.add_argument("--latency-ms", type=float, default=0, help="delay the stand-in adds to every request")
+    arg_parser.add_argument("--jitter-ms", type=float, default=0, help="random extra delay of up to this much per request")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of view, stats and file url requests answered with a 503")
+    arg_parser.add_argument("--json", action="store_true", default=False, help="print the results as json lines")
+    arg_parser.add_argument("tool_args", nargs=argparse.REMAINDER, help="extra site-tool.py arguments, after --")
+    args = arg_parser.parse_args()
+    args.tool_args = [a for a in args.tool_args if a != "--"]
+    logging.basicConfig(level=logging.WARNING)
+
+    standin = Standin(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+    server = serve(standin)
+    url = "http://127.0.0.1:%d" % server.server_address[1]
+    results = []
+    for scenario in args.scenario or SCENARIOS:
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory(prefix="site-benchmark-") as work_dir:
+                results.append(run_scenario(scenario, standin, url, args, work_dir))
+            if args.json: print(json.dumps(results[-1], sort_keys=True))
+    server.shutdown()
+    if not args.json: print_results(results)
@@ -0,0 +1,18 @@
+#!/usr/bin/env bash
+
+# Size of the synthetic sites the local stand-in serves to each scenario.
+objects=2000
+files=20
+file_size=1048576
+design_files=5
+regions=200
+
+# Delay the stand-in adds to every request, and the fraction of view, stats and file url requests it answers with a 503.
+latency_ms=20
+error_rate=0
+
+echo "Benchmarking site-tool.py against a local stand-in"
+
+python benchmark.py --objects $objects --files $files --file-size $file_size --design-files $design_files --regions $regions --latency-ms $latency_ms --error-rate $error_rate "$@"
+
+echo;echo "Done."
@@ -0,0 +1,386 @@
+#!/usr/bin/python
+
+""" A local stand-in for the parts of the Sitelink3D v2 API that site-tool.py talks to.
+
+It serves rdm/v1 views and stats, rdm_log/v1 events (including long polls),
+file/v1 urls, downloads (with Range) and uploads, and designfile/v1 downloads
+and fineupload, from memory. Sites are filled with synthetic objects cloned
+from the samples in datalogger-machine-simulator/state.jsonl.
+"""
+
+import argparse
+import base64
+import bisect
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from requests_toolbelt.multipart.decoder import MultipartDecoder
+
+logger = logging.getLogger(__name__)
+
+SIMULATOR_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "datalogger", "datalogger-machine-simulator")
+
+DESIGN_TYPES = ["Lines", "Points", "Surfaces", "Roads", "Planes"]
+
+def collate_key(x):
+    """ sort key for RDM view keys: null sorts last so that [id, null] closes every [id, ...] range """
+    if x is None: return (5,)
+    if isinstance(x, bool): return (1, x)
+    if isinstance(x, (int, float)): return (2, x)
+    if isinstance(x, str): return (3, x)
+    if isinstance(x, list): return (4, tuple(collate_key(y) for y in x) + ((0,),))
+    return (4, (collate_key(json.dumps(x, sort_keys=True)),))
+
+def decode_key(s):
+    if not s: return None
+    s = s + "=" * (-len(s) % 4)
+    key = json.loads(base64.urlsafe_b64decode(s.encode("utf-8")).decode("utf-8"))
+    if isinstance(key, str):
+        try: key = json.loads(key)
+        except ValueError: pass
+    return key
+
+class StandinDomain(object):
+    """ the log, head and history of one RDM domain of one site """
+    def __init__(self):
+        self.events = []
+        self.heads = {}
+        self.hist = {}
+        self.views = None
+        self.changed = threading.Condition()
+
+    def append(self, obj):
+        with self.changed:
+            seq = len(self.events) + 1
+            data_b64 = base64.b64encode(json.dumps(obj).encode("utf-8")).decode("utf-8")
+            self.events.append({"log_id" : "standin", "seq" : seq, "cursor" : seq, "data_b64" : data_b64})
+            _id = obj.get("_id")
+            previous = self.heads.get(_id)
+            self.hist.setdefault(_id, []).append((seq, obj))
+            if obj.get("_deleted"):
+                self.heads.pop(_id, None)
+            else:
+                self.heads[_id] = obj
+            # views that have been built are kept sorted as objects arrive
+            for name, (keys, rows) in (self.views or {}).items():
+                if previous is not None and name != "_hist":
+                    for key, _, _ in self.view_rows(name, _id, None, previous):
+                        i = bisect.bisect_left(keys, collate_key(key))
+                        if i < len(rows) and rows[i][0] == key:
+                            del keys[i], rows[i]
+                if obj.get("_deleted") and name != "_hist": continue
+                for row in self.view_rows(name, _id, seq, obj):
+                    i = bisect.bisect_right(keys, collate_key(row[0]))
+                    keys.insert(i, collate_key(row[0]))
+                    rows.insert(i, row)
+            self.changed.notify_all()
+        return seq
+
+    @staticmethod
+    def view_rows(name, _id, seq, obj):
+        if name == "_head": return [([_id], _id, obj)]
+        if name == "_hist": return [([_id, seq], _id, obj)]
+        if name == "v_sl_region_by_name" and obj.get("_type") == "sl::region": return [([obj.get("name"), _id], _id, obj)]
+        return []
+
+    def view(self, name):
+        with self.changed:
+            if self.views is None: self.views = {}
+            if name in self.views: return self.views[name]
+            if name == "_hist":
+                rows = [row for _id, revs in self.hist.items() for seq, obj in revs for row in self.view_rows(name, _id, seq, obj)]
+            else:
+                rows = [row for _id, obj in self.heads.items() for row in self.view_rows(name, _id, None, obj)]
+            rows.sort(key=lambda row: collate_key(row[0]))
+            view = ([collate_key(row[0]) for row in rows], rows)
+            self.views[name] = view
+            return view
+
+class StandinSite(object):
+    """ the RDM domains, files and design files of one site """
+    def __init__(self):
+        self.domains = {}
+        self.files = {}
+        self.design_files = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def domain(self, name):
+        with self.lock:
+            return self.domains.setdefault(name, StandinDomain())
+
+class Standin(object):
+    """ in-memory state plus the knobs that make the stand-in behave like a loaded server """
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=0):
+        self.sites = {}
+        self.lock = threading.Lock()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.timings = {}
+        self.connections = 0
+
+    def record(self, route, seconds):
+        with self.lock:
+            self.timings.setdefault(route, []).append(seconds)
+
+    def connected(self):
+        with self.lock:
+            self.connections += 1
+
+    def take_connections(self):
+        """ the connections accepted since the previous call """
+        with self.lock:
+            connections, self.connections = self.connections, 0
+        return connections
+
+    def take_timings(self):
+        """ the request durations recorded per route since the previous call """
+        with self.lock:
+            timings, self.timings = self.timings, {}
+        return timings
+
+    def site(self, identifier):
+        with self.lock:
+            return self.sites.setdefault(identifier, StandinSite())
+
+    def delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep((self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000.0)
+
+    def unavailable(self):
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def populate(self, identifier, objects=0, files=0, file_size=1024, design_files=0, revisions=1, regions=0):
+        """ fill a site with synthetic content seeded from the simulator sample objects """
+        site = self.site(identifier)
+        rnd = random.Random(identifier)
+        samples = []
+        state_file = os.path.join(SIMULATOR_DIR, "state.jsonl")
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                samples = [json.loads(line) for line in f if line.strip()]
+        types = sorted(set(s["_type"] for s in samples)) or ["sl::operator"]
+        sitelink = site.domain("sitelink")
+        file_system = site.domain("file_system")
+        for t in types:
+            sitelink.append({"_id" : t, "_type" : "_type", "_v" : 1, "_rev" : str(uuid.UUID(int=rnd.getrandbits(128))), "_at" : 1583244000000})
+        for i in range(objects):
+            base = dict(samples[i % len(samples)]) if samples else {"_type" : "sl::operator"}
+            base["_id"] = str(uuid.UUID(int=rnd.getrandbits(128)))
+            if base.get("_type") == "sl::designObject" and "doFileUUID" in base:
+                # cloned design objects need content of their own to be copyable
+                base["doFileUUID"] = str(uuid.UUID(int=rnd.getrandbits(128)))
+                site.design_files[base["doFileUUID"]] = rnd.getrandbits(8 * file_size).to_bytes(file_size, "little") if file_size else b""
+            for r in range(revisions):
+                obj = dict(base)
+                obj["_rev"] = str(uuid.UUID(int=rnd.getrandbits(128)))
+                obj["_at"] = 1583244000000 + i * 1000 + r
+                sitelink.append(obj)
+        for i in range(regions):
+            vertices = [[37.3 + rnd.random() * 0.1, -95.5 + rnd.random() * 0.1, 230.0] for _ in range(16)]
+            sitelink.append({"_id" : str(uuid.UUID(int=rnd.getrandbits(128))), "_type" : "sl::region", "_rev" : str(uuid.uuid4()), "_at" : 1583244000000 + i, "name" : "Region %d" % i, "vertices" : {"data" : vertices}})
+        folder = str(uuid.UUID(int=rnd.getrandbits(128)))
+        file_system.append({"_id" : folder, "_type" : "fs::folder", "name" : "standin", "_rev" : str(uuid.uuid4()), "_at" : 1583244000000})
+        for i in range(files):
+            file_uuid = str(uuid.UUID(int=rnd.getrandbits(128)))
+            content = rnd.getrandbits(8 * file_size).to_bytes(file_size, "little") if file_size else b""
+            site.files[file_uuid] = content
+            file_system.append({"_id" : str(uuid.UUID(int=rnd.getrandbits(128))), "_type" : "fs::file", "uuid" : file_uuid, "name" : "file-%d.bin" % i, "parent" : folder, "size" : file_size, "hash" : hashlib.sha1(content).hexdigest(), "_rev" : str(uuid.uuid4()), "_at" : 1583244000000 + i})
+        for i in range(design_files):
+            design_type = DESIGN_TYPES[i % len(DESIGN_TYPES)]
+            do_file = str(uuid.UUID(int=rnd.getrandbits(128)))
+            site.design_files[do_file] = rnd.getrandbits(8 * file_size).to_bytes(file_size, "little") if file_size else b""
+            sitelink.append({"_id" : str(uuid.UUID(int=rnd.getrandbits(128))), "_type" : "sl::designObject", "name" : "design-%d" % i, "designType" : design_type, "doFileUUID" : do_file, "_rev" : str(uuid.uuid4()), "_at" : 1583244000000 + i})
+        return site
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    routes = [
+        ("GET",  re.compile(r"^/rdm/v1/site/([^/]+)/domain/([^/]+)/view/([^/]+)$"), "view"),
+        ("GET",  re.compile(r"^/rdm/v1/site/([^/]+)/domain/([^/]+)/stats$"), "stats"),
+        ("GET",  re.compile(r"^/rdm_log/v1/site/([^/]+)/domain/([^/]+)/events$"), "log_events"),
+        ("POST", re.compile(r"^/rdm_log/v1/site/([^/]+)/domain/([^/]+)/events$"), "post_event"),
+        ("GET",  re.compile(r"^/file/v1/sites/([^/]+)/files/([^/]+)/url$"), "file_url"),
+        ("GET",  re.compile(r"^/file/v1/sites/([^/]+)/files/([^/]+)/content$"), "file_content"),
+        ("POST", re.compile(r"^/file/v1/sites/([^/]+)/upload$"), "file_upload"),
+        ("GET",  re.compile(r"^/designfile/v1/sites/([^/]+)/design_files/([^/]+)$"), "design_file"),
+        ("POST", re.compile(r"^/designfile/v1/sites/([^/]+)/design_files/([^/]+)/fineupload$"), "design_file_upload"),
+    ]
+    retryable = ["view", "stats", "file_url"]
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.standin.connected()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self): self.dispatch("GET")
+    def do_POST(self): self.dispatch("POST")
+
+    def dispatch(self, method):
+        standin = self.server.standin
+        parsed = urlparse(self.path)
+        self.query = parse_qs(parsed.query, keep_blank_values=True)
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        for m, pattern, name in self.routes:
+            match = pattern.match(parsed.path)
+            if m != method or match is None: continue
+            start = time.time()
+            try:
+                standin.delay()
+                if name in self.retryable and standin.unavailable():
+                    return self.reply(503, b"unavailable", headers={"Retry-After" : "0"})
+                return getattr(self, name)(*match.groups())
+            finally:
+                standin.record(name, time.time() - start)
+        self.reply(404, b"not found")
+
+    def param(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+    def reply(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)): body = json.dumps(body).encode("utf-8")
+        elif isinstance(body, str): body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD": self.wfile.write(body)
+
+    def site(self, identifier):
+        return self.server.standin.site(identifier)
+
+    def view(self, site, domain, name):
+        keys, rows = self.site(site).domain(domain).view(name)
+        limit = int(self.param("limit", 500))
+        start, end = decode_key(self.param("start")), decode_key(self.param("end"))
+        lo = bisect.bisect_left(keys, collate_key(start)) if start is not None else 0
+        hi = bisect.bisect_left(keys, collate_key(end)) if end is not None else len(rows)
+        page = rows[lo:min(hi, lo + limit)]
+        last_excl = rows[lo + limit][0] if lo + limit < hi else None
+        self.reply(200, {"items" : [{"id" : _id, "key" : key, "value" : value} for key, _id, value in page], "last_excl" : last_excl})
+
+    def stats(self, site, domain):
+        d = self.site(site).domain(domain)
+        self.reply(200, {"count" : len(d.heads), "events" : len(d.events)})
+
+    def log_events(self, site, domain):
+        d = self.site(site).domain(domain)
+        cursor = int(self.param("from_cursor_excl", 0) or 0)
+        limit = int(self.param("limit", 400))
+        timeout = int(self.param("timeout_ms", 0) or 0) / 1000.0
+        with d.changed:
+            if len(d.events) <= cursor and timeout > 0:
+                d.changed.wait_for(lambda: len(d.events) > cursor, timeout)
+            events = d.events[cursor:cursor + limit]
+        if not events: return self.reply(204)
+        self.reply(200, {"events" : events, "cursor_incl" : events[-1]["cursor"]})
+
+    def post_event(self, site, domain):
+        data = json.loads(self.body.decode("utf-8"))
+        obj = json.loads(base64.b64decode(data["data_b64"]).decode("utf-8"))
+        if "_id" not in obj or "_type" not in obj: return self.reply(400, {"error" : "object needs _id and _type"})
+        seq = self.site(site).domain(domain).append(obj)
+        self.reply(200, {"seq" : seq})
+
+    def file_url(self, site, file_uuid):
+        if file_uuid not in self.site(site).files: return self.reply(404, b"no such file")
+        self.reply(200, "/file/v1/sites/%s/files/%s/content" % (site, file_uuid), content_type="text/plain")
+
+    def send_content(self, content):
+        if content is None: return self.reply(404, b"no such file")
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range") or "")
+        if match is None:
+            return self.reply(200, content, content_type="application/octet-stream", headers={"Accept-Ranges" : "bytes"})
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else len(content) - 1
+        if first >= len(content):
+            return self.reply(416, b"", headers={"Content-Range" : "bytes */%d" % len(content)})
+        last = min(last, len(content) - 1)
+        self.reply(206, content[first:last + 1], content_type="application/octet-stream", headers={"Accept-Ranges" : "bytes", "Content-Range" : "bytes %d-%d/%d" % (first, last, len(content))})
+
+    def file_content(self, site, file_uuid):
+        self.send_content(self.site(site).files.get(file_uuid))
+
+    def design_file(self, site, do_file):
+        self.send_content(self.site(site).design_files.get(do_file))
+
+    def receive_part(self, site, store):
+        decoder = MultipartDecoder(self.body, self.headers.get("Content-Type"))
+        fields = {}
+        for part in decoder.parts:
+            disposition = part.headers.get(b"Content-Disposition", b"").decode("utf-8")
+            name = re.search(r'name="([^"]*)"', disposition).group(1)
+            fields[name] = part.content
+        upload = fields["upload-uuid"].decode("utf-8")
+        total = int(fields["upload-total-parts"])
+        with site.lock:
+            parts = site.uploads.setdefault(upload, {})
+            parts[int(fields["upload-part-index"])] = fields["upload-file"]
+            if len(parts) < total: return self.reply(200, {"success" : True})
+            content = b"".join(parts[i] for i in range(total))
+            del site.uploads[upload]
+        if hashlib.sha1(content).hexdigest() != fields["upload-file-sha1"].decode("utf-8") or len(content) != int(fields["upload-file-size"]):
+            return self.reply(400, {"success" : False, "error" : "checksum mismatch"})
+        store[upload] = content
+        self.reply(200, {"success" : True})
+
+    def file_upload(self, site):
+        s = self.site(site)
+        self.receive_part(s, s.files)
+
+    def design_file_upload(self, site, do_file):
+        s = self.site(site)
+        self.receive_part(s, s.design_files)
+
+def populate_from_spec(standin, spec):
+    name, *sizes = spec.split(":")
+    sizes = [int(x) for x in sizes] + [0] * (6 - len(sizes))
+    return standin.populate(name, objects=sizes[0], files=sizes[1], file_size=sizes[2] or 1024, design_files=sizes[3], revisions=sizes[4] or 1, regions=sizes[5])
+
+class StandinServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients that close a download early (segmented downloads, resumes) are not errors
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)): return
+        ThreadingHTTPServer.handle_error(self, request, client_address)
+
+def serve(standin, host="127.0.0.1", port=0):
+    server = StandinServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.standin = standin
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Local Sitelink3D v2 stand-in server")
+    arg_parser.add_argument("--port", type=int, default=8080, help="port to listen on at 127.0.0.1")
+    arg_parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every request")
+    arg_parser.add_argument("--jitter-ms", type=float, default=0, help="random extra delay of up to this much per request")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of view, stats and file url requests answered with a 503")
+    arg_parser.add_argument("--site", action="append", default=[], help="populate a site, given as name:objects:files:file_size:design_files:revisions:regions (trailing fields may be left out)")
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    standin = Standin(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+    for spec in args.site:
+        populate_from_spec(standin, spec)
+    server = serve(standin, port=args.port)
+    print("serving on http://127.0.0.1:%d" % server.server_address[1])
+    while True: time.sleep(3600)
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+""" Checks of site-tool.py against the local stand-in; run with python -m unittest from this folder. """
+
+import os
+import re
+import sys
+import tempfile
+import unittest
+import urllib3
+
+from benchmark import *
+
+sys.path.insert(0, os.path.dirname(SITE_TOOL))
+from framework import HttpTransport
+from journal import CopyJournal
+from transfer import ReplicationLag
+
+# site-tool.py defaults the copy verbs run with: --post-window, --transfer-workers and --upload-window
+POST_WINDOW, TRANSFER_WORKERS, UPLOAD_WINDOW = 8, 4, 4
+
+class StandinTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.standin = Standin(latency_ms=2)
+        cls.server = serve(cls.standin)
+        cls.url = "http://127.0.0.1:%d" % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+class CopyManyTest(StandinTest):
+
+    def test_copy_many_keeps_its_connections(self):
+        destinations = ["fanout-copy-%d" % n for n in range(8)]
+        source = populate_from_spec(self.standin, "fanout:200:12:65536:4")
+        with tempfile.TemporaryDirectory(prefix="site-test-") as work_dir:
+            file_name = os.path.join(work_dir, "destinations.txt")
+            with open(file_name, "w") as f:
+                f.write("".join("%s %s test\n" % (self.url, site) for site in destinations))
+            self.standin.take_connections()
+            run_tool(self.url, "fanout", ["--journal", ""], ["copy-many", file_name], work_dir)
+            connections = self.standin.take_connections()
+            with open(os.path.join(work_dir, "output.log")) as f:
+                output = f.read()
+        self.assertEqual(output.count("Connection pool is full, discarding connection"), 0)
+        # a connection is opened per request in flight at most, and kept for the requests after it
+        self.assertLessEqual(connections, len(destinations) * (POST_WINDOW + TRANSFER_WORKERS * UPLOAD_WINDOW) + 1)
+        for site in destinations:
+            self.assertEqual(len(self.standin.site(site).files), len(source.files))
+
+    def test_copy_many_downloads_each_file_once(self):
+        destinations = ["revised-copy-%d" % n for n in range(3)]
+        # cloned design objects are revised, so several events of the log refer to the same content
+        source = populate_from_spec(self.standin, "revised:60:6:16384:3:3")
+        with tempfile.TemporaryDirectory(prefix="site-test-") as work_dir:
+            file_name = os.path.join(work_dir, "destinations.txt")
+            with open(file_name, "w") as f:
+                f.write("".join("%s %s test\n" % (self.url, site) for site in destinations))
+            run_tool(self.url, "revised", ["--journal", "", "--no-dedup"], ["copy-many", file_name], work_dir)
+            with open(os.path.join(work_dir, "output.log")) as f:
+                downloads = re.search(r"shared downloads: (\d+) file\(s\) downloaded", f.read())
+        self.assertEqual(int(downloads.group(1)), len(source.files) + len(source.design_files))
+        for site in destinations:
+            self.assertEqual(len(self.standin.site(site).design_files), len(source.design_files))
+
+class CopyJournalTest(StandinTest):
+    def test_journal_keeps_each_destination_apart(self):
+        destinations = ["journal-copy-%d" % n for n in range(2)]
+        source = populate_from_spec(self.standin, "journal:40:4:4096")
+        with tempfile.TemporaryDirectory(prefix="site-test-") as work_dir:
+            # both copies record their progress in the default journal of the folder they run in
+            for site in destinations:
+                run_tool(self.url, "journal", [], ["copy", self.url, site, "test"], work_dir)
+        for site in destinations:
+            self.assertEqual(len(self.standin.site(site).domain("file_system").events), len(source.domain("file_system").events))
+            self.assertEqual(len(self.standin.site(site).files), len(source.files))
+
+    def test_failed_event_holds_the_cursor(self):
+        events = [{"log_id" : "test", "seq" : seq, "data_b64" : ""} for seq in range(3)]
+        journal = CopyJournal(None, "http://source", "source", "http://destination", "destination")
+        try:
+            journal.start_domain("sitelink")
+            for event, landed in zip(events, [True, False, True]):
+                journal.event_handled("sitelink", event, landed)
+            self.assertEqual([journal.is_handled("sitelink", event) for event in events], [True, False, True])
+            # the event that failed is read again on the next run, and only that one is posted again
+            journal.page_handled("sitelink", 3, events[-1])
+            self.assertEqual(journal.cursor("sitelink"), 0)
+        finally:
+            journal.close()
+
+class HttpTransportTest(StandinTest):
+    def test_stats_count_the_connections_of_every_pool(self):
+        # the pools are tracked through the pool classes of urllib3's PoolManager, checked here against the installed urllib3
+        transport = HttpTransport()
+        populate_from_spec(self.standin, "transport:10")
+        self.standin.take_connections()
+        for _ in range(3):
+            transport.get("%s/rdm/v1/site/transport/domain/sitelink/stats" % self.url).raise_for_status()
+        self.assertEqual(transport.stats(), {"http://127.0.0.1:%d" % self.server.server_address[1] : {"requests" : 3, "connections" : 1, "reused" : 2}}, "urllib3 %s" % urllib3.__version__)
+        self.assertEqual(self.standin.take_connections(), 1)
+
+class ReplicationLagTest(unittest.TestCase):
+    def test_lag_follows_the_acknowledged_posts_in_log_order(self):
+        lag = ReplicationLag()
+        tickets = [lag.read() for _ in range(3)]
+        # posts are acknowledged as they finish, which need not be in log order
+        lag.landed(tickets[1])
+        self.assertEqual(lag.events(), 3)
+        lag.landed(tickets[0])
+        self.assertEqual(lag.events(), 1)
+        lag.landed(tickets[2])
+        self.assertEqual((lag.events(), lag.seconds()), (0, 0.0))
+
+if __name__ == "__main__":
+    unittest.main()
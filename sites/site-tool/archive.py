@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+""" An offline archive of a site's RDM logs and file content that a copy can be replayed from. """
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ARCHIVE_CHUNK_EVENTS = 10000
+ARCHIVE_FORMAT = 1
+
+class SiteArchiveWriter(object):
+    """ Write a site archive: a zip file holding
+
+        index.json                          what the archive holds, written last
+        events/<domain>/<n>.jsonl           log events in log order, deflated
+        blobs/<sha1>-<size>                 file and design file content, stored
+
+    Events are written in chunks that end on a log page, so every chunk has the
+    cursor of the page it ends with. Content is stored once however many files
+    share it, and the index maps each file uuid or design file uuid to its blob
+    and lists the ones whose content could not be exported.
+    The archive is written under a temporary name and only takes its own name
+    once it is complete.
+    """
+    def __init__(self, path, source_url, site, chunk_events=DEFAULT_ARCHIVE_CHUNK_EVENTS):
+        self.path = path
+        self.temporary = "%s.%d.tmp" % (path, os.getpid())
+        self.chunk_events = chunk_events
+        self.lock = threading.Lock()
+        self.archive = zipfile.ZipFile(self.temporary, "w", allowZip64=True)
+        self.index = {"format" : ARCHIVE_FORMAT, "source_url" : source_url, "site" : site, "exported" : time.time(), "domains" : {}, "files" : {}, "blobs" : {}, "missing" : []}
+        self.pending = {}
+
+    def add_page(self, domain, events, cursor):
+        """ add one page of log events, read up to cursor """
+        state = self.index["domains"].setdefault(domain, {"events" : 0, "cursor" : 0, "chunks" : []})
+        pending = self.pending.setdefault(domain, [])
+        pending.extend(events)
+        state["events"] += len(events)
+        state["cursor"] = cursor
+        if len(pending) >= self.chunk_events:
+            self.write_chunk(domain)
+
+    def write_chunk(self, domain):
+        state, pending = self.index["domains"][domain], self.pending.get(domain)
+        if not pending: return
+        name = "events/%s/%06d.jsonl" % (domain, len(state["chunks"]))
+        data = "".join(json.dumps(event, sort_keys=True) + "\n" for event in pending)
+        with self.lock:
+            self.archive.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED)
+        state["chunks"].append({"name" : name, "events" : len(pending), "cursor" : state["cursor"]})
+        self.pending[domain] = []
+
+    def has_file(self, uuid):
+        with self.lock:
+            return uuid in self.index["files"]
+
+    def add_file(self, uuid, path, sha1):
+        """ store the content at path for a file or design file uuid; path holds content with the given sha1 """
+        name = "blobs/%s-%d" % (sha1, os.path.getsize(path))
+        with self.lock:
+            if name not in self.index["blobs"]:
+                self.archive.write(path, name, compress_type=zipfile.ZIP_STORED)
+                self.index["blobs"][name] = os.path.getsize(path)
+            self.index["files"][uuid] = name
+
+    def add_missing(self, uuid):
+        """ record a file or design file uuid whose content the archive does not hold """
+        with self.lock:
+            self.index["missing"].append(uuid)
+
+    def close(self):
+        for domain in list(self.pending):
+            self.write_chunk(domain)
+        with self.lock:
+            self.archive.writestr("index.json", json.dumps(self.index, indent=1, sort_keys=True), compress_type=zipfile.ZIP_DEFLATED)
+            self.archive.close()
+        os.replace(self.temporary, self.path)
+
+    def abort(self):
+        with self.lock:
+            self.archive.close()
+        if os.path.exists(self.temporary): os.remove(self.temporary)
+
+class SiteArchive(object):
+    """ Read a site archive written by SiteArchiveWriter.
+
+    File content is handed out like SharedDownloads does: fetch extracts the blob
+    of a uuid to a private temporary folder and release removes it again, so an
+    import can use the archive wherever a copy would download from the source.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path, "r")
+        self.index = json.loads(self.archive.read("index.json").decode("utf-8"))
+        if self.index.get("format") != ARCHIVE_FORMAT:
+            raise ValueError("%s: unsupported site archive format %s" % (path, self.index.get("format")))
+        self.folder = tempfile.mkdtemp(prefix="site-archive-")
+        self.lock = threading.Lock()
+        self.extracted = {}
+
+    def domains(self):
+        return list(self.index["domains"])
+
+    def pages(self, domain, from_cursor_excl=0):
+        """ yield the chunks of a domain as log pages, leaving out the ones below from_cursor_excl """
+        for chunk in self.index["domains"].get(domain, {}).get("chunks", []):
+            if chunk["cursor"] <= from_cursor_excl: continue
+            with self.archive.open(chunk["name"]) as f:
+                events = [json.loads(line) for line in f if line.strip()]
+            yield {"events" : events, "cursor_incl" : chunk["cursor"]}
+
+    def fetch(self, uuid, download=None):
+        """ the path of the content of a file or design file uuid; download is ignored, the archive holds everything it has """
+        name = self.index["files"].get(uuid)
+        if name is None:
+            reason = ", its export failed" if uuid in self.index.get("missing", []) else ""
+            raise KeyError("%s holds no content for %s%s" % (self.path, uuid, reason))
+        path = os.path.join(self.folder, uuid)
+        with self.lock:
+            self.extracted[uuid] = path
+        with self.archive.open(name) as source, open(path, "wb") as target:
+            shutil.copyfileobj(source, target, 1048576)
+        return path
+
+    def release(self, uuid, consumer=None):
+        with self.lock:
+            path = self.extracted.pop(uuid, None)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def close(self):
+        self.archive.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
@@ -3,26 +3,467 @@
 """ This is a set of utility functions for the site-tool file. """
 
 import argparse
+import bisect
+import contextlib
+import email.utils
 import inspect
+import json
 import logging
 import os
+import random
+import re
+import threading
+import time
+import urllib.parse
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_RETRY_BUDGET = 0.2
+DEFAULT_TARGET_LATENCY = 1.0
+DEFAULT_PAGE_SIZES = {"view" : 500, "log" : 400}
+DEFAULT_BODY_SAMPLE = 100
+DEFAULT_BODY_LIMIT = 256
+
+# Outbound requests are accounted per endpoint class, the first pattern that matches the url path
+ENDPOINT_CLASSES = [
+    ("rdm_view"         , re.compile(r"/rdm/v1/.*/view/")),
+    ("rdm_stats"        , re.compile(r"/rdm/v1/.*/stats$")),
+    ("rdm_log"          , re.compile(r"/rdm_log/v1/")),
+    ("file_url"         , re.compile(r"/file/v1/.*/url$")),
+    ("file_upload"      , re.compile(r"/file/v1/.*/upload$")),
+    ("file"             , re.compile(r"/file/v1/")),
+    ("designfile_upload", re.compile(r"/designfile/v1/.*/fineupload$")),
+    ("designfile"       , re.compile(r"/designfile/v1/")),
+]
+# Upper bounds in milliseconds of the latency histogram buckets
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+
+class Metrics(object):
+    """ Counters for every outbound request and the time spent in local work.
+
+    Requests are grouped by method and endpoint class (see ENDPOINT_CLASSES) with
+    their count, status codes, bytes each way, retries and a latency histogram.
+    Local work such as decoding, disk I/O and hashing is timed per phase with
+    phase(). report() returns everything as one JSON-friendly dict.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = {}
+        self.phases = {}
+
+    @staticmethod
+    def endpoint_class(method, url):
+        path = requests.utils.urlparse(url).path
+        for name, pattern in ENDPOINT_CLASSES:
+            if pattern.search(path): return "%s %s" % (method, name)
+        return "%s other" % method
+
+    def endpoint(self, name):
+        entry = self.endpoints.get(name)
+        if entry is None:
+            entry = {"requests" : 0, "errors" : 0, "retries" : 0, "bytes_sent" : 0, "bytes_received" : 0, "seconds" : 0.0, "max_ms" : 0.0, "status" : {}, "histogram" : [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+            self.endpoints[name] = entry
+        return entry
+
+    def record_request(self, method, url, seconds, status=None, sent=0, received=0):
+        name = self.endpoint_class(method, url)
+        ms = seconds * 1000.0
+        with self.lock:
+            entry = self.endpoint(name)
+            entry["requests"] += 1
+            entry["seconds"] += seconds
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["bytes_sent"] += sent
+            entry["bytes_received"] += received
+            entry["histogram"][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+            key = str(status) if status is not None else "exception"
+            entry["status"][key] = entry["status"].get(key, 0) + 1
+            if status is None or status >= 400: entry["errors"] += 1
+
+    def record_retry(self, method, url):
+        with self.lock:
+            self.endpoint(self.endpoint_class(method, url))["retries"] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self.lock:
+                entry = self.phases.setdefault(name, {"count" : 0, "seconds" : 0.0})
+                entry["count"] += 1
+                entry["seconds"] += seconds
+
+    @staticmethod
+    def percentile_ms(histogram, fraction):
+        """ upper bound of the bucket holding the given fraction of the requests """
+        total = sum(histogram)
+        if total == 0: return 0
+        seen = 0
+        for i, count in enumerate(histogram):
+            seen += count
+            if seen >= fraction * total:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+        return None
+
+    def report(self):
+        with self.lock:
+            endpoints = {}
+            for name, entry in sorted(self.endpoints.items()):
+                endpoints[name] = dict(entry, status=dict(entry["status"]))
+                endpoints[name]["histogram"] = dict(zip(["<=%dms" % b for b in LATENCY_BUCKETS_MS] + [">%dms" % LATENCY_BUCKETS_MS[-1]], entry["histogram"]))
+                endpoints[name]["mean_ms"] = round(1000.0 * entry["seconds"] / entry["requests"], 2) if entry["requests"] else 0.0
+                endpoints[name]["p50_ms"] = self.percentile_ms(entry["histogram"], 0.50)
+                endpoints[name]["p99_ms"] = self.percentile_ms(entry["histogram"], 0.99)
+                endpoints[name]["seconds"] = round(entry["seconds"], 3)
+                endpoints[name]["max_ms"] = round(entry["max_ms"], 2)
+            phases = dict((name, {"count" : entry["count"], "seconds" : round(entry["seconds"], 3)}) for name, entry in sorted(self.phases.items()))
+        return {"wall_seconds" : round(time.time() - self.started, 3), "endpoints" : endpoints, "phases" : phases}
+
+    def write_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4, sort_keys=True)
+        logger.info("profile written to %s", path)
+
+_metrics = Metrics()
+
+def get_metrics():
+    return _metrics
+
+def request_body_size(data):
+    if data is None: return 0
+    if isinstance(data, (bytes, bytearray, str)): return len(data)
+    # streaming encoders such as MultipartEncoder announce their size in .len
+    size = getattr(data, "len", None)
+    if isinstance(size, int): return size
+    try:
+        return len(data)
+    except TypeError:
+        return 0
+
+class BodySampler(object):
+    """ Decide which response bodies get logged: one in `every` per key, failures always, each cut to `limit` characters """
+    def __init__(self, every=DEFAULT_BODY_SAMPLE, limit=DEFAULT_BODY_LIMIT):
+        self.every = max(1, every)
+        self.limit = limit
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def sample(self, key, text, failed=False):
+        """ the text to log, cut to size, or None when this one is not sampled """
+        with self.lock:
+            count = self.counts[key] = self.counts.get(key, 0) + 1
+        if not failed and (count - 1) % self.every != 0: return None
+        if len(text) <= self.limit: return text
+        return "%s... (%d more characters)" % (text[:self.limit], len(text) - self.limit)
+
+_body_sampler = BodySampler()
+
+def configure_body_sampling(every=DEFAULT_BODY_SAMPLE, limit=DEFAULT_BODY_LIMIT):
+    global _body_sampler
+    _body_sampler = BodySampler(every=every, limit=limit)
+    return _body_sampler
+
+def sampled_body(key, text, failed=False):
+    return _body_sampler.sample(key, text, failed)
+
+class _TrackingAdapter(HTTPAdapter):
+    """ HTTPAdapter that hands every connection pool it creates to the owning transport """
+    def __init__(self, transport, **kwargs):
+        self.transport = transport
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        # the pool manager creates its pools from the classes in pool_classes_by_scheme, so subclasses of them
+        # register every pool as it is created
+        transport = self.transport
+        def tracked(pool_class):
+            class TrackedPool(pool_class):
+                def __init__(self, *pool_args, **pool_kwargs):
+                    pool_class.__init__(self, *pool_args, **pool_kwargs)
+                    transport.track_pool(self)
+            return TrackedPool
+        self.poolmanager.pool_classes_by_scheme = dict((scheme, tracked(pool_class)) for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items())
+
+class AdaptiveThrottle(object):
+    """ Shared flow control for the requests that page through a site or may be answered with a 503.
+
+    Concurrency follows AIMD: the number of requests allowed in flight grows by
+    one per window of successful requests and halves when the server answers
+    503/429 or the connection fails. Those requests are retried after a jittered
+    exponential backoff, or after the delay the server gives in Retry-After, as
+    long as the retry budget allows: every success earns `retry_budget` of a
+    retry, so under sustained overload the callers fail instead of piling on.
+    Page sizes grow while pages come back well within `target_latency` seconds
+    and shrink when they are slow or fail.
+    """
+    OVERLOAD_STATUS = (429, 503)
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, retry_budget=DEFAULT_RETRY_BUDGET, target_latency=DEFAULT_TARGET_LATENCY, max_backoff=30.0, page_sizes=None, min_page=25, max_page=2000, log_interval=30.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.retry_budget = retry_budget
+        self.retry_tokens = 10.0
+        self.target_latency = target_latency
+        self.max_backoff = max_backoff
+        self.page_sizes = dict(page_sizes or DEFAULT_PAGE_SIZES)
+        self.min_page = min_page
+        self.max_page = max_page
+        self.log_interval = log_interval
+        self.logged = 0
+        self.counts = {"requests" : 0, "overloaded" : 0, "retries" : 0, "exhausted" : 0}
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, overloaded):
+        with self.condition:
+            self.in_flight -= 1
+            self.counts["requests"] += 1
+            if overloaded:
+                self.counts["overloaded"] += 1
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+                self.retry_tokens = min(100.0, self.retry_tokens + self.retry_budget)
+            self.condition.notify_all()
+        self.log_state(force=overloaded)
+
+    def take_retry(self):
+        with self.condition:
+            if self.retry_tokens < 1:
+                self.counts["exhausted"] += 1
+                return False
+            self.retry_tokens -= 1
+            self.counts["retries"] += 1
+            return True
+
+    def backoff(self, attempt, response=None):
+        """ seconds to wait before retry number attempt: Retry-After when the server sent one, else full jitter """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                when = email.utils.parsedate_to_datetime(retry_after)
+                if when is not None: return min(self.max_backoff, max(0.0, when.timestamp() - time.time()))
+        return random.uniform(0, min(self.max_backoff, 0.5 * 2 ** attempt))
+
+    def page_size(self, kind):
+        with self.condition:
+            return self.page_sizes.setdefault(kind, DEFAULT_PAGE_SIZES.get(kind, 500))
+
+    def observe_page(self, kind, seconds, ok):
+        with self.condition:
+            size = self.page_sizes.setdefault(kind, DEFAULT_PAGE_SIZES.get(kind, 500))
+            if not ok or seconds > self.target_latency: size = int(size * (0.5 if not ok else 0.75))
+            elif seconds < self.target_latency / 2: size = int(size * 1.25) + 1
+            self.page_sizes[kind] = min(self.max_page, max(self.min_page, size))
+
+    def request(self, http, method, url, page_kind=None, **kwargs):
+        """ send a request through http (an HttpTransport or HttpAccess), retrying overload within the budget """
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.time()
+            try:
+                res = http.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.release(overloaded=True)
+                if page_kind is not None: self.observe_page(page_kind, time.time() - start, ok=False)
+                if not self.take_retry(): raise
+                http.metrics.record_retry(method, url)
+                res = None
+            else:
+                overloaded = res.status_code in AdaptiveThrottle.OVERLOAD_STATUS
+                self.release(overloaded=overloaded)
+                if page_kind is not None and res.status_code != 204: self.observe_page(page_kind, time.time() - start, ok=not overloaded)
+                if not overloaded or not self.take_retry(): return res
+                http.metrics.record_retry(method, url)
+            time.sleep(self.backoff(attempt, res))
+            attempt += 1
+
+    def state(self):
+        with self.condition:
+            return {"limit" : round(self.limit, 1), "in_flight" : self.in_flight, "retry_tokens" : round(self.retry_tokens, 1), "page_sizes" : dict(self.page_sizes), "counts" : dict(self.counts)}
+
+    def log_state(self, force=False):
+        now = time.time()
+        if not force and now - self.logged < self.log_interval: return
+        self.logged = now
+        state = self.state()
+        logger.info("concurrency limit %s (%d in flight), retry tokens %s, page sizes %s, %s", state["limit"], state["in_flight"], state["retry_tokens"], state["page_sizes"], state["counts"])
+
+class HttpTransport(object):
+    """ Keep-alive connection pools (one per host) shared by every request the tools make """
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, throttle=None, metrics=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.throttle = throttle or AdaptiveThrottle()
+        self.metrics = metrics or get_metrics()
+        self.pools = []
+        self.lock = threading.Lock()
+        self.environments = {}
+        self.session = requests.Session()
+        # requests reads proxies, netrc and CA bundle settings from the environment on every request; environment()
+        # looks them up once per host instead
+        self.session.trust_env = False
+        self.mount()
+
+    def mount(self):
+        adapter = _TrackingAdapter(self, pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def reserve(self, connections, hosts=1):
+        """ keep at least `connections` keep-alive connections per host, to as many as `hosts` hosts, for a verb
+        that runs that many requests at once; a smaller pool would close every connection it has no room for """
+        with self.lock:
+            if connections <= self.pool_maxsize and hosts <= self.pool_connections: return
+            self.pool_maxsize = max(self.pool_maxsize, connections)
+            self.pool_connections = max(self.pool_connections, hosts)
+            previous = self.session.get_adapter("http://")
+            self.mount()
+        # the pools of the previous adapter stay tracked; their idle connections are closed
+        previous.close()
+        logger.info("connection pools resized to %d connection(s) for each of %d host(s)", self.pool_maxsize, self.pool_connections)
+
+    def track_pool(self, pool):
+        with self.lock:
+            self.pools.append(pool)
+
+    def environment(self, url):
+        """ the proxies, netrc credentials and CA bundle the environment gives for the host of url """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self.lock:
+            environment = self.environments.get(key)
+        if environment is None:
+            environment = {
+                "proxies" : requests.utils.get_environ_proxies(url),
+                "auth" : requests.utils.get_netrc_auth(url),
+                "verify" : os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE"),
+            }
+            with self.lock:
+                self.environments[key] = environment
+        return environment
+
+    def request(self, method, url, **kwargs):
+        environment = self.environment(url)
+        if environment["proxies"] and not kwargs.get("proxies"): kwargs["proxies"] = environment["proxies"]
+        if environment["auth"] and not kwargs.get("auth"): kwargs["auth"] = environment["auth"]
+        if environment["verify"] and kwargs.get("verify", True) is True: kwargs["verify"] = environment["verify"]
+        started = time.perf_counter()
+        sent = request_body_size(kwargs.get("data"))
+        try:
+            res = self.session.request(method, url, **kwargs)
+        except Exception:
+            self.metrics.record_request(method, url, time.perf_counter() - started, sent=sent)
+            raise
+        # a streamed body has not been read yet, so count what the server announced
+        received = int(res.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(res.content)
+        self.metrics.record_request(method, url, time.perf_counter() - started, status=res.status_code, sent=sent, received=received)
+        return res
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request("POST", url, data=data, **kwargs)
+
+    def throttled_get(self, url, page_kind=None, **kwargs):
+        return self.throttle.request(self, "GET", url, page_kind=page_kind, **kwargs)
+
+    def access(self, headers=None, verify=True):
+        return HttpAccess(self, headers, verify)
+
+    def stats(self):
+        """ requests sent, connections opened and connections reused per host """
+        hosts = {}
+        with self.lock:
+            pools = list(self.pools)
+        for pool in pools:
+            host = "%s://%s:%s" % (pool.scheme, pool.host, pool.port)
+            entry = hosts.setdefault(host, {"requests" : 0, "connections" : 0, "reused" : 0})
+            entry["requests"] += pool.num_requests
+            entry["connections"] += pool.num_connections
+            entry["reused"] = max(0, entry["requests"] - entry["connections"])
+        return hosts
+
+    def log_stats(self):
+        for host, entry in sorted(self.stats().items()):
+            ratio = 100.0 * entry["reused"] / entry["requests"] if entry["requests"] else 0.0
+            logger.info("%s: %d requests over %d connections, %d reused (%.1f%%)", host, entry["requests"], entry["connections"], entry["reused"], ratio)
+        self.throttle.log_state(force=True)
+
+class HttpAccess(object):
+    """ A view of the shared transport that carries the headers and verify setting of one accessor """
+    def __init__(self, transport, headers=None, verify=True):
+        self.transport = transport
+        self.headers = dict(headers or {})
+        self.verify = verify
+
+    @property
+    def metrics(self):
+        return self.transport.metrics
+
+    def merged_headers(self, headers=None):
+        if not headers: return dict(self.headers)
+        merged = dict(self.headers)
+        merged.update(headers)
+        return merged
+
+    def request(self, method, url, headers=None, **kwargs):
+        kwargs.setdefault("verify", self.verify)
+        return self.transport.request(method, url, headers=self.merged_headers(headers), **kwargs)
+
+    def get(self, url, headers=None, **kwargs):
+        return self.request("GET", url, headers=headers, **kwargs)
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        return self.request("POST", url, headers=headers, data=data, **kwargs)
+
+    def throttled_get(self, url, headers=None, page_kind=None, **kwargs):
+        return self.transport.throttle.request(self, "GET", url, page_kind=page_kind, headers=headers, **kwargs)
+
+_transport = None
+
+def configure_transport(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY, retry_budget=DEFAULT_RETRY_BUDGET, target_latency=DEFAULT_TARGET_LATENCY):
+    global _transport
+    throttle = AdaptiveThrottle(max_concurrency=max_concurrency, retry_budget=retry_budget, target_latency=target_latency)
+    _transport = HttpTransport(pool_connections=pool_connections, pool_maxsize=pool_maxsize, throttle=throttle)
+    return _transport
+
+def get_transport():
+    if _transport is None: return configure_transport()
+    return _transport
+
 class ApiAccess(object):
     AUTH_HEADER_KEY = "X-Topcon-Auth"
-    def __init__(self, api_url, site, token, verify=True):
+    def __init__(self, api_url, site, token, verify=True, transport=None):
         self.api_url = api_url
         self.token = token
         self.site = site
         self.verify = verify
+        self.http = (transport or get_transport()).access(headers={ApiAccess.AUTH_HEADER_KEY:token}, verify=verify)
 
     def post(self, uri, params=None, headers=None, files=None):
         url = self.api_url + uri
-        if not headers: headers = {ApiAccess.AUTH_HEADER_KEY:self.token}
-        elif not ApiAccess.AUTH_HEADER_KEY in headers: headers[ApiAccess.AUTH_HEADER_KEY] = self.token
-        res = requests.post(url, params=params, files=files, headers=headers, verify=self.verify)
+        res = self.http.post(url, params=params, files=files, headers=headers)
         res.raise_for_status()
         return res
 
@@ -31,6 +472,14 @@ def add_default_arguments(arg_parser, epilog=None):
     arg_parser.add_argument("--log-lvl", default=logging.INFO,  help="log messages at or above this level")
     arg_parser.add_argument("--token"  , help="JWT to authorize requests")
     arg_parser.add_argument("--unverified", action="store_true", default=False, help="Do not verify https requests")
+    arg_parser.add_argument("--pool-connections", type=int, default=DEFAULT_POOL_CONNECTIONS, help="number of hosts to keep connection pools for")
+    arg_parser.add_argument("--pool-maxsize", type=int, default=DEFAULT_POOL_MAXSIZE, help="keep-alive connections to keep per host")
+    arg_parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help="most throttled requests (view and log pages, stats, file urls) in flight at once")
+    arg_parser.add_argument("--retry-budget", type=float, default=DEFAULT_RETRY_BUDGET, help="retries of a 503/429 or failed connection earned per successful throttled request")
+    arg_parser.add_argument("--profile", default=None, help="write a JSON report of request and phase metrics to this file at exit")
+    arg_parser.add_argument("--log-body-sample", type=int, default=DEFAULT_BODY_SAMPLE, help="log the body of one in this many successful responses per kind")
+    arg_parser.add_argument("--log-body-limit", type=int, default=DEFAULT_BODY_LIMIT, help="characters of a response body to log")
+    arg_parser.add_argument("--target-latency", type=float, default=DEFAULT_TARGET_LATENCY, help="seconds per page that view and log page sizes adapt towards")
     if epilog is not None:
         arg_parser.epilog = epilog
         arg_parser.formatter_class = argparse.RawDescriptionHelpFormatter
@@ -68,7 +517,7 @@ def make_epilogue(settings, actions):
                     epi.append("%s%s:" % (' '*indent, verb))
                     epi = addDict(epi, actions[verb], indent+2)
                 else:
-                    argstr = inspect.formatargspec(inspect.getargspec(actions[verb]).args)
+                    argstr = format_args(inspect.getfullargspec(actions[verb]).args)
                     aDict[verb+argstr] = inspect.getdoc(actions[verb])
             epi = epi + pretty_dict_to_list(aDict)
             return epi
@@ -102,20 +551,25 @@ def print_table(data, fields):
     print(tag % tuple([s(lens[f],f) for f in fields]))
     for e in data: print(tag % tuple([str(e.get(f,"n/a")) for f in fields]))
 
+def format_args(names):
+    """ names as a parameter list (inspect.formatargspec is gone from Python 3.11) """
+    return "(%s)" % ", ".join(names)
+
 def run_action(actions, verb, args):
     verb = verb.lower()
     action = actions.get(verb)
     if action is None:
         logger.warn("unexpected verb %s", verb)
         return
-    argspec = inspect.getargspec(action)
-    param_len = len(argspec.args)
+    argspec = inspect.getfullargspec(action)
+    names, defaults = argspec.args, argspec.defaults or ()
+    param_len = len(names)
     if param_len > len(args):
-        if len(argspec.defaults or []) < param_len - len(args):
-            logger.warn("action %s: no value given for arg '%s' which has no default value", verb, argspec.args[len(args)])
+        if len(defaults) < param_len - len(args):
+            logger.warn("action %s: no value given for arg '%s' which has no default value", verb, names[len(args)])
             return
-        args = args + list(argspec.defaults[len(argspec.defaults)-len(args):])
+        args = args + list(defaults[len(defaults)-(param_len-len(args)):])
     def trnc(s): return s if len(s)<12 else s[0:10]+".."
-    logger.info("%s%s calls %s%s ..", verb, [trnc(str(a)) for a in args], action.__name__, inspect.formatargspec(argspec.args))
+    logger.info("%s%s calls %s%s ..", verb, [trnc(str(a)) for a in args], action.__name__, format_args(names))
     action(*args)
     logger.info(".. %s%s call done", verb, [trnc(str(a)) for a in args])
@@ -0,0 +1,42 @@
+#!/usr/bin/python
+
+""" Helpers for exporting the revision history of RDM objects. """
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HIST_WORKERS = 8
+# fields every revision has its own value of, carried on each diff rather than compared
+REVISION_FIELDS = ("_id", "_rev", "_at")
+
+def revision_diff(previous, current):
+    """ the top level fields current sets or changes relative to previous, and the ones it drops; the first
+    revision of an object (previous None) sets all of its fields """
+    diff = dict((k, current[k]) for k in REVISION_FIELDS if k in current)
+    previous = previous or {}
+    changed = dict((k, v) for k, v in current.items() if k not in REVISION_FIELDS and (k not in previous or previous[k] != v))
+    removed = sorted(k for k in previous if k not in current and k not in REVISION_FIELDS)
+    if changed: diff["set"] = changed
+    if removed: diff["unset"] = removed
+    return diff
+
+def history_records(revisions, diffs=False):
+    """ the output records of one object's revisions in order: the revisions themselves, or their diffs """
+    if not diffs: return list(revisions)
+    records, previous = [], None
+    for revision in revisions:
+        records.append(revision_diff(previous, revision))
+        previous = revision
+    return records
+
+def group_history(items):
+    """ yield (id, revisions) for each object of _hist view entries in key order, where an object's revisions
+    are contiguous """
+    _id, revisions = None, []
+    for item in items:
+        if item["id"] != _id:
+            if revisions: yield _id, revisions
+            _id, revisions = item["id"], []
+        revisions.append(item["value"])
+    if revisions: yield _id, revisions
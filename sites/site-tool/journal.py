@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+""" A local journal that lets an interrupted site copy resume where it stopped. """
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOURNAL = "site-copy.journal"
+
+class CopyJournal(object):
+    """ SQLite record of how far the copy of one source site to one destination site got.
+
+    Per domain it keeps the last log cursor below which every event has been
+    handled, with the key of the event at that cursor, and it keeps every event
+    posted and every file uploaded since then, so a restarted copy resumes at the
+    cursor and skips the work already done.
+    The cursor stops advancing at the first failed event of a domain so that the
+    failed event is tried again on the next run.
+    """
+    def __init__(self, path, source_url, source_site, dest_url, dest_site):
+        self.path = path or ":memory:"
+        self.copy_id = hashlib.sha1(json.dumps([source_url, source_site, dest_url, dest_site]).encode("utf-8")).hexdigest()
+        self.lock = threading.Lock()
+        self.clean = {}
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cursors (copy_id TEXT, domain TEXT, cursor INTEGER, at REAL, event TEXT, PRIMARY KEY (copy_id, domain))")
+            # journals written before the cursor event was kept
+            if "event" not in [row[1] for row in self.connection.execute("PRAGMA table_info(cursors)")]:
+                self.connection.execute("ALTER TABLE cursors ADD COLUMN event TEXT")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS events (copy_id TEXT, domain TEXT, event TEXT, at REAL, PRIMARY KEY (copy_id, domain, event))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS uploads (copy_id TEXT, url TEXT, upload_uuid TEXT, at REAL, PRIMARY KEY (copy_id, url, upload_uuid))")
+
+    def execute(self, sql, params):
+        with self.lock, self.connection:
+            return self.connection.execute(sql, params).fetchall()
+
+    def reset(self):
+        for table in ["cursors", "events", "uploads"]:
+            self.execute("DELETE FROM %s WHERE copy_id = ?" % table, (self.copy_id,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def event_key(event):
+        if "log_id" in event and "seq" in event: return "%s:%s" % (event["log_id"], event["seq"])
+        return hashlib.sha1(event["data_b64"].encode("utf-8")).hexdigest()
+
+    def cursor(self, domain):
+        rows = self.execute("SELECT cursor FROM cursors WHERE copy_id = ? AND domain = ?", (self.copy_id, domain))
+        return rows[0][0] if rows else 0
+
+    def cursor_event(self, domain):
+        """ the key of the last event below the cursor, None if it is not known """
+        rows = self.execute("SELECT event FROM cursors WHERE copy_id = ? AND domain = ?", (self.copy_id, domain))
+        return rows[0][0] if rows else None
+
+    def start_domain(self, domain):
+        self.clean[domain] = True
+
+    def is_handled(self, domain, event):
+        return len(self.execute("SELECT 1 FROM events WHERE copy_id = ? AND domain = ? AND event = ?", (self.copy_id, domain, self.event_key(event)))) > 0
+
+    def event_handled(self, domain, event, landed):
+        """ called in log order once an event has been posted or ignored, landed True, or has failed, landed False """
+        if landed:
+            self.execute("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?)", (self.copy_id, domain, self.event_key(event), time.time()))
+        else:
+            self.clean[domain] = False
+
+    def page_handled(self, domain, cursor, last_event=None):
+        """ called in log order once every event up to cursor, the last of them last_event, has been handled """
+        if not self.clean[domain]: return
+        event = self.event_key(last_event) if last_event is not None else None
+        self.execute("INSERT OR REPLACE INTO cursors VALUES (?, ?, ?, ?, ?)", (self.copy_id, domain, cursor, time.time(), event))
+        # events below a committed cursor are never read again
+        self.execute("DELETE FROM events WHERE copy_id = ? AND domain = ?", (self.copy_id, domain))
+
+    def is_uploaded(self, url, upload_uuid):
+        return len(self.execute("SELECT 1 FROM uploads WHERE copy_id = ? AND url = ? AND upload_uuid = ?", (self.copy_id, url, str(upload_uuid)))) > 0
+
+    def record_upload(self, url, upload_uuid):
+        self.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)", (self.copy_id, url, str(upload_uuid), time.time()))
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+""" Incremental parsing of large JSON and JSONL files for the site-tool load verbs. """
+
+import codecs
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOAD_CHUNK = 1048576
+DEFAULT_LOAD_MAX_VALUE = 67108864
+DEFAULT_LOAD_REPORT_SECONDS = 10
+
+def json_backend(name="auto"):
+    """ the loads function of the named backend; auto picks orjson when it is installed """
+    if name in ("auto", "orjson"):
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            if name == "orjson": raise
+    return json.loads
+
+def iter_json_lines(f, loads=json.loads):
+    """ yield (line number, object, None) for every line of a binary JSONL file, or (line number, None, (error, text))
+    for a line that does not parse; blank lines are skipped """
+    for number, line in enumerate(f, 1):
+        if not line.strip(): continue
+        try:
+            yield number, loads(line), None
+        except ValueError as e:
+            yield number, None, (str(e), line.decode("utf-8", "replace").rstrip("\r\n"))
+
+def iter_json_values(f, chunk_size=DEFAULT_LOAD_CHUNK, max_value=DEFAULT_LOAD_MAX_VALUE):
+    """ yield (position, value, None) for every element of a top level JSON array in a binary file, or for every top
+    level value when the file does not start with an array, reading the file in chunks of chunk_size bytes.
+
+    A syntax error cannot be skipped reliably, so it is yielded as (position, None, (error, text)) and ends the
+    iteration; so does a value larger than max_value characters, which would otherwise be read into memory whole.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer, pos, eof, position, in_array = "", 0, False, 0, None
+
+    def more(buffer, pos):
+        nonlocal eof
+        data = f.read(chunk_size)
+        eof = not data
+        return buffer[pos:] + utf8.decode(data, final=eof), 0
+
+    while True:
+        # skip the white space, and in an array the commas, up to the next value
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (in_array and buffer[pos] == ",")):
+                pos += 1
+            if pos < len(buffer) or eof: break
+            buffer, pos = more(buffer, pos)
+        if pos >= len(buffer):
+            if in_array: yield position + 1, None, ("the array is not closed", "")
+            return
+        if in_array is None:
+            in_array = buffer[pos] == "["
+            if in_array: pos += 1
+            continue
+        if in_array and buffer[pos] == "]": return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except ValueError as e:
+            if not eof and len(buffer) - pos < max_value:
+                buffer, pos = more(buffer, pos)
+                continue
+            yield position + 1, None, (str(e), buffer[pos:pos + 200])
+            return
+        # a number that reaches the end of the buffer may go on in the next chunk
+        if end >= len(buffer) and not eof:
+            buffer, pos = more(buffer, pos)
+            continue
+        position += 1
+        yield position, value, None
+        pos = end
+        if pos >= chunk_size:
+            buffer, pos = buffer[pos:], 0
+
+class CountingReader(object):
+    """ a binary file that counts the bytes read from it, for files such as stdin that cannot tell their position """
+    def __init__(self, f):
+        self.f = f
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bytes += len(data)
+        return data
+
+    def __iter__(self):
+        for line in self.f:
+            self.bytes += len(line)
+            yield line
+
+class LoadStats(object):
+    """ counts of a bulk load and their rates, reported every report_seconds """
+    def __init__(self, report_seconds=DEFAULT_LOAD_REPORT_SECONDS):
+        self.report_seconds = report_seconds
+        self.started = self.reported = time.time()
+        self.read = 0
+        self.posted = 0
+        self.rejected = 0
+        self.reader = None
+
+    def due(self):
+        if time.time() - self.reported < self.report_seconds: return False
+        self.reported = time.time()
+        return True
+
+    def report(self):
+        seconds = max(time.time() - self.started, 1e-6)
+        read_bytes = self.reader.bytes if self.reader is not None else 0
+        return "%d object(s) read, %d posted, %d rejected in %.1fs: %.1f objects/s, %.2f MB/s read" % (self.read, self.posted, self.rejected, seconds, self.posted / seconds, read_bytes / seconds / 1048576)
+
+class RejectsFile(object):
+    """ JSONL record of the input a load could not post: where it was, why, and the text or object itself """
+    def __init__(self, path):
+        self.file = open(path, "w") if path else None
+        self.lock = threading.Lock()
+
+    def write(self, where, error, source):
+        if self.file is None: return
+        with self.lock:
+            self.file.write(json.dumps({"at" : where, "error" : str(error), "source" : source}, sort_keys=True) + "\n")
+
+    def close(self):
+        if self.file is not None: self.file.close()
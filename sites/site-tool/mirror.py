@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+""" A local SQLite mirror of the _head and _hist views of one site domain, kept up to date from its rdm_log. """
+
+import base64
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIRROR = "site-mirror.db"
+DEFAULT_MIRROR_STALENESS = 60
+
+class SiteMirror(object):
+    """ SQLite copy of the _head and _hist views of one site domain.
+
+    The mirror is filled by replaying the domain's rdm_log from the last cursor
+    it stored, so a refresh only transfers the events logged since the previous
+    one. Rows are keyed like the RDM views: [_id] for _head and [_id, seq] for
+    _hist, where seq is the position of the revision in the log.
+    """
+    def __init__(self, path, url, site, domain):
+        self.path = path or ":memory:"
+        self.mirror_id = hashlib.sha1(json.dumps([url, site, domain]).encode("utf-8")).hexdigest()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS state (mirror_id TEXT PRIMARY KEY, cursor INTEGER, refreshed REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS head (mirror_id TEXT, id TEXT, value TEXT, PRIMARY KEY (mirror_id, id))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS hist (mirror_id TEXT, id TEXT, seq INTEGER, value TEXT, PRIMARY KEY (mirror_id, id, seq))")
+
+    def execute(self, sql, params):
+        with self.lock, self.connection:
+            return self.connection.execute(sql, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def state(self):
+        rows = self.execute("SELECT cursor, refreshed FROM state WHERE mirror_id = ?", (self.mirror_id,))
+        return rows[0] if rows else (0, None)
+
+    def cursor(self):
+        return self.state()[0]
+
+    def age(self):
+        """ seconds since the mirror last caught up with the log, None if it never did """
+        refreshed = self.state()[1]
+        return None if refreshed is None else time.time() - refreshed
+
+    def apply(self, events, cursor, caught_up=False):
+        """ store one page of log events and the cursor after it in a single transaction """
+        refreshed = time.time() if caught_up else self.state()[1]
+        with self.lock, self.connection:
+            for event in events:
+                obj = json.loads(base64.b64decode(event["data_b64"]).decode("utf-8"))
+                _id = obj.get("_id")
+                if _id is None: continue
+                seq = event.get("seq", cursor)
+                value = json.dumps(obj, sort_keys=True)
+                self.connection.execute("INSERT OR REPLACE INTO hist VALUES (?, ?, ?, ?)", (self.mirror_id, _id, seq, value))
+                if obj.get("_deleted"):
+                    self.connection.execute("DELETE FROM head WHERE mirror_id = ? AND id = ?", (self.mirror_id, _id))
+                else:
+                    self.connection.execute("INSERT OR REPLACE INTO head VALUES (?, ?, ?)", (self.mirror_id, _id, value))
+            self.connection.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)", (self.mirror_id, cursor, refreshed))
+
+    def refresh(self, http, log_url):
+        """ replay the log from the stored cursor until the server has no more events; returns the number of events applied """
+        params = {"from_cursor_excl" : self.cursor(), "timeout_ms" : 0}
+        count = 0
+        while True:
+            params["limit"] = http.transport.throttle.page_size("log")
+            res = http.throttled_get(log_url, params=params, page_kind="log")
+            res.raise_for_status()
+            if res.status_code == 204:
+                self.apply([], params["from_cursor_excl"], caught_up=True)
+                logger.info("mirror %s caught up at cursor %s after %d event(s)", self.path, params["from_cursor_excl"], count)
+                return count
+            page = res.json()
+            self.apply(page["events"], page["cursor_incl"])
+            params["from_cursor_excl"] = page["cursor_incl"]
+            count += len(page["events"])
+
+    def fetch_object(self, _id):
+        rows = self.execute("SELECT value FROM head WHERE mirror_id = ? AND id = ?", (self.mirror_id, _id))
+        return json.loads(rows[0][0]) if rows else None
+
+    def history(self, _id):
+        rows = self.execute("SELECT value FROM hist WHERE mirror_id = ? AND id = ? ORDER BY seq", (self.mirror_id, _id))
+        return [json.loads(row[0]) for row in rows]
+
+    def iter_view(self, view, page_size=500):
+        """ yield the entries of the _head or _hist view in key order, like RdmAccessor.iter_view """
+        if view == "_head":
+            sql, key = "SELECT id, value FROM head WHERE mirror_id = ? AND id > ? ORDER BY id LIMIT ?", lambda row: [row[0]]
+        elif view == "_hist":
+            sql, key = "SELECT id, value, seq FROM hist WHERE mirror_id = ? AND (id > ? OR (id = ? AND seq > ?)) ORDER BY id, seq LIMIT ?", lambda row: [row[0], row[2]]
+        else:
+            raise ValueError("the mirror only holds the _head and _hist views, not %s" % view)
+        last = ["", None]
+        while True:
+            params = (self.mirror_id, last[0], page_size) if view == "_head" else (self.mirror_id, last[0], last[0], -1 if last[1] is None else last[1], page_size)
+            rows = self.execute(sql, params)
+            for row in rows:
+                yield {"id" : row[0], "key" : key(row), "value" : json.loads(row[1])}
+            if len(rows) < page_size: return
+            last = [rows[-1][0], rows[-1][2] if view == "_hist" else None]
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+""" A columnar store of region outlines with a packed R-tree over their bounding boxes, for point queries. """
+
+import array
+import json
+import logging
+import math
+import mmap
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+REGION_STORE_FORMAT = 1
+DEFAULT_RTREE_NODE = 16
+REGION_INDEX = "regions.index"
+REGION_VERTICES = "regions.f64"
+REGION_RTREE = "regions.rtree.f64"
+
+def little_endian(values):
+    """ an array('d') in the byte order the store files use """
+    if sys.byteorder == "big": values.byteswap()
+    return values
+
+def bounding_box(vertices):
+    """ [min lat, min lon, max lat, max lon] of a list of [lat, lon, ...] points """
+    lats = [v[0] for v in vertices]
+    lons = [v[1] for v in vertices]
+    return [min(lats), min(lons), max(lats), max(lons)]
+
+def str_order(boxes, node_size):
+    """ the order Sort-Tile-Recursive packing puts boxes in: vertical slices by longitude, each sorted by latitude,
+    so that every run of node_size boxes is spatially compact """
+    centre = lambda n: ((boxes[n][0] + boxes[n][2]) / 2, (boxes[n][1] + boxes[n][3]) / 2)
+    by_lon = sorted(range(len(boxes)), key=lambda n: centre(n)[1])
+    slices = max(1, int(math.ceil(math.sqrt(len(boxes) / float(node_size)))))
+    per_slice = slices * node_size
+    order = []
+    for start in range(0, len(by_lon), per_slice):
+        order.extend(sorted(by_lon[start:start + per_slice], key=lambda n: centre(n)[0]))
+    return order
+
+def pack_levels(boxes, node_size):
+    """ the levels of a packed R-tree over boxes already in STR order, leaves first: node i of a level bounds
+    nodes i * node_size up to (i + 1) * node_size of the level below """
+    levels = [boxes]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        level = []
+        for start in range(0, len(below), node_size):
+            children = below[start:start + node_size]
+            level.append([min(b[0] for b in children), min(b[1] for b in children), max(b[2] for b in children), max(b[3] for b in children)])
+        levels.append(level)
+    return levels
+
+def point_in_polygon(lat, lon, coords, offset, count, stride=3):
+    """ whether (lat, lon) lies inside the polygon of count vertices starting at coords[offset], by ray casting """
+    inside = False
+    j = offset + (count - 1) * stride
+    for k in range(count):
+        i = offset + k * stride
+        lat_i, lon_i, lat_j, lon_j = coords[i], coords[i + 1], coords[j], coords[j + 1]
+        if (lon_i > lon) != (lon_j > lon) and lat < (lat_j - lat_i) * (lon - lon_i) / (lon_j - lon_i) + lat_i:
+            inside = not inside
+        j = i
+    return inside
+
+class RegionStoreWriter(object):
+    """ Write a region store into a folder:
+
+        regions.f64          the vertices of every region, lat, lon and height as little endian float64
+        regions.rtree.f64    the boxes of a packed R-tree, four float64 each, leaves first
+        regions.index        JSON columns: the id, name, first vertex and vertex count of each region
+
+    Regions are written as they are added, so only their index entries are
+    held in memory. The vertex file loads directly into numpy with
+    numpy.fromfile(path, "<f8").reshape(-1, 3). Files are written under
+    temporary names and the index takes its name last.
+    """
+    def __init__(self, folder, node_size=DEFAULT_RTREE_NODE):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.node_size = node_size
+        self.suffix = ".%d.tmp" % os.getpid()
+        self.vertices = open(os.path.join(folder, REGION_VERTICES + self.suffix), "wb")
+        self.regions = []
+        self.offset = 0
+
+    def add(self, _id, name, vertices):
+        """ add a region from its [lat, lon, height] vertices; a region with fewer than three is left out """
+        if len(vertices) < 3: return False
+        values = array.array("d")
+        for v in vertices:
+            values.extend((float(v[0]), float(v[1]), float(v[2]) if len(v) > 2 else 0.0))
+        little_endian(values).tofile(self.vertices)
+        self.regions.append({"_id" : _id, "name" : name, "offset" : self.offset, "count" : len(vertices), "box" : bounding_box(vertices)})
+        self.offset += len(vertices)
+        return True
+
+    def close(self):
+        self.vertices.close()
+        # the leaves of the R-tree are the regions, so the index columns follow the order of the leaves
+        order = str_order([r["box"] for r in self.regions], self.node_size)
+        regions = [self.regions[n] for n in order]
+        levels = pack_levels([r["box"] for r in regions], self.node_size) if regions else []
+        rtree = array.array("d", [x for level in levels for box in level for x in box])
+        with open(os.path.join(self.folder, REGION_RTREE + self.suffix), "wb") as f:
+            little_endian(rtree).tofile(f)
+        index = {"format" : REGION_STORE_FORMAT, "node_size" : self.node_size, "vertices" : self.offset, "levels" : [len(level) for level in levels]}
+        for column in ("_id", "name", "offset", "count"):
+            index[column] = [r[column] for r in regions]
+        with open(os.path.join(self.folder, REGION_INDEX + self.suffix), "w") as f:
+            json.dump(index, f, sort_keys=True)
+        for name in (REGION_VERTICES, REGION_RTREE, REGION_INDEX):
+            os.replace(os.path.join(self.folder, name + self.suffix), os.path.join(self.folder, name))
+
+    def abort(self):
+        self.vertices.close()
+        for name in (REGION_VERTICES, REGION_RTREE, REGION_INDEX):
+            path = os.path.join(self.folder, name + self.suffix)
+            if os.path.exists(path): os.remove(path)
+
+class RegionStore(object):
+    """ Read a region store written by RegionStoreWriter. The vertex file is memory mapped, so a query only
+    touches the vertices of the regions whose bounding boxes hold the point. """
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, REGION_INDEX)) as f:
+            self.index = json.load(f)
+        if self.index.get("format") != REGION_STORE_FORMAT:
+            raise ValueError("%s: unsupported region store format %s" % (folder, self.index.get("format")))
+        self.node_size = self.index["node_size"]
+        self.levels = self.index["levels"]
+        self.rtree = array.array("d")
+        with open(os.path.join(folder, REGION_RTREE), "rb") as f:
+            self.rtree.frombytes(f.read())
+        little_endian(self.rtree)
+        self.bases = [sum(self.levels[:n]) for n in range(len(self.levels))]
+        self.file = open(os.path.join(folder, REGION_VERTICES), "rb")
+        if self.index["vertices"] == 0:
+            self.map, self.coords = None, []
+        elif sys.byteorder == "little":
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.coords = memoryview(self.map).cast("d")
+        else:
+            self.map, self.coords = None, little_endian(array.array("d", self.file.read()))
+
+    def holds(self, level, node, lat, lon):
+        """ whether the box of a node of the R-tree holds the point """
+        at = 4 * (self.bases[level] + node)
+        return self.rtree[at] <= lat <= self.rtree[at + 2] and self.rtree[at + 1] <= lon <= self.rtree[at + 3]
+
+    def candidates(self, lat, lon):
+        """ the regions whose bounding boxes hold the point, found by descending the R-tree """
+        if not self.levels: return []
+        top = len(self.levels) - 1
+        nodes = [0] if self.holds(top, 0, lat, lon) else []
+        for level in range(top - 1, -1, -1):
+            nodes = [child for node in nodes for child in range(node * self.node_size, min((node + 1) * self.node_size, self.levels[level])) if self.holds(level, child, lat, lon)]
+        return nodes
+
+    def __len__(self):
+        return len(self.index["_id"])
+
+    def region(self, n):
+        return {"_id" : self.index["_id"][n], "name" : self.index["name"][n], "offset" : self.index["offset"][n], "count" : self.index["count"][n]}
+
+    def contains(self, n, lat, lon):
+        return point_in_polygon(lat, lon, self.coords, 3 * self.index["offset"][n], self.index["count"][n])
+
+    def containing(self, lat, lon):
+        """ the regions that contain the point """
+        return [self.region(n) for n in self.candidates(lat, lon) if self.contains(n, lat, lon)]
+
+    def close(self):
+        if isinstance(self.coords, memoryview): self.coords.release()
+        if self.map is not None: self.map.close()
+        self.file.close()
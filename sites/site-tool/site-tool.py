@@ -1,78 +1,62 @@
 #!/usr/bin/python
 import base64
+import collections
+import concurrent.futures
+import contextlib
 import json
 import logging
+import queue
 import requests
+import shlex
+import sys
+import threading
 import time
 import uuid
-import hashlib
 from framework import *
-from tqdm import tqdm
-from requests_toolbelt import MultipartEncoder
-import math
+from transfer import *
+from journal import *
+from mirror import *
+from archive import *
+from verify import *
+from loader import *
+from regions import *
+from history import *
 
 logger = logging.getLogger(__name__)
 
 SITELINK_MAX_FILE_PART_SIZE = 10485760
-
-# Yield parts of data from file pointer until EOF. This avoids reading large files completely into memory.
-# This function is used to chunk the data if its size exceeds the maximum part size accpeted by the 
-# Sitelink3D v2 file and designfile services
-def read_parts(a_file_ptr, a_part_size=SITELINK_MAX_FILE_PART_SIZE):
-    while True:
-        part = a_file_ptr.read(a_part_size)
-        if not part:
-            break
-        yield part 
-
-def upload_file_multipart(a_url, a_upload_uuid, a_file_location, a_file_name, a_media_type, a_encoding_type, a_jwt):
-    file_path = a_file_location + os.path.sep + a_file_name
-    part_index = 0
-    part_generator = read_parts(a_file_ptr=open(file_path, "rb"), a_part_size=SITELINK_MAX_FILE_PART_SIZE)
-
-    sha1 = hashlib.sha1()
-    with open(file_path, "rb") as f:
-        sha1.update(f.read())
-
-    success = True
-
-    for part in part_generator:
-        file_size = os.stat(file_path).st_size
-        part_total_count = math.ceil(file_size / SITELINK_MAX_FILE_PART_SIZE)
-
-        print("Preparing data part index {} of size {} bytes. Total parts {} ".format(part_index, len(part), part_total_count))
-
-        form_header = {
-            "upload-uuid": str(a_upload_uuid),
-            "upload-file-name": a_file_name,
-            "upload-file-sha1": sha1.hexdigest(),
-            "upload-file-size": str(file_size),
-            "upload-part-index": str(part_index),
-            "upload-total-parts": str(part_total_count),
-            "upload-part-size": str(len(part)),
-            "upload-file" : (a_file_name, part, "application/octet-stream")
-        }
-
-        multipartEncoder = MultipartEncoder(fields=form_header)
-        headers = {
-            "Content-Type": "multipart/form-data; media-type=\"%s\"; boundary=%s" % (a_media_type, multipartEncoder.boundary_value),
-            "Authorization": "Bearer " + a_jwt,
-            "Content-Encoding": a_encoding_type
-        }
-        response = requests.post(a_url, headers=headers, data=multipartEncoder)
-        print_and_assert_http_reponse(a_response=response, a_print_text_on_success=True, a_optional_text="File part upload")
-        if response.status_code != 200:
-            success = False
-            break
-        part_index = part_index + 1
-
-    return success
+RDM_TYPE_CACHE_SIZE = 1024
+RDM_POST_WINDOW = 8
+RDM_POST_RETRIES = 3
+# Split points of the key space for a parallel view scan: ids are lower case hex uuids
+RDM_VIEW_SPLIT = "0123456789abcdef"
+# Sitelink object types copy leaves out, with the reason it gives; verify leaves them out as well
+SITELINK_IGNORED_TYPES = {
+    "sl::list" : "lists are special purpose objects",
+    "sl::site" : "the source site definition is not copied to the destination site",
+    "sl::working_set" : "working sets are obsolete",
+}
+# The design object set the Sitelink3D v2 website creates with every site, which copy leaves out
+DEFAULT_DESIGN_OBJECT_SET_ID = "04585119-e2c2-4ed2-b336-5a30ca90c95f"
+
+# Files larger than the maximum part size accepted by the Sitelink3D v2 file and designfile services
+# are uploaded as several parts of the same upload-uuid. See MultipartUploader for how the parts are sent.
+def upload_file_multipart(a_url, a_upload_uuid, a_file_location, a_file_name, a_media_type, a_encoding_type, a_jwt, a_verify=True, a_window=DEFAULT_UPLOAD_WINDOW, a_retries=DEFAULT_UPLOAD_RETRIES):
+    uploader = MultipartUploader(get_transport().access(verify=a_verify), part_size=SITELINK_MAX_FILE_PART_SIZE, window=a_window, retries=a_retries)
+    return uploader.upload(url=a_url, upload_uuid=a_upload_uuid, file_path=os.path.join(a_file_location, a_file_name), file_name=a_file_name, media_type=a_media_type, encoding_type=a_encoding_type, jwt=a_jwt)
 
 class RdmItf(object):
     """ bare-bones RDM access """
-    def __init__(self, api_url, verify=True):
+    def __init__(self, api_url, verify=True, transport=None, type_cache_size=RDM_TYPE_CACHE_SIZE):
         self.api_url = api_url
         self.verify = verify
+        self.http = (transport or get_transport()).access(headers={'content-type':'application/json'}, verify=verify)
+        # (site, domain, type) -> _v of that type, or None if the site has no such type. Least recently used first.
+        self.type_versions = collections.OrderedDict()
+        self.type_cache_size = type_cache_size
+        # (site, domain, type) -> times that type has been rewritten, so a lookup that raced a rewrite is not cached
+        self.type_generations = {}
+        self.type_lock = threading.Lock()
 
     def safe_b64(self, x):
         if not x: return ""
@@ -92,51 +76,72 @@ class RdmItf(object):
             return value
         return None
 
-    def post_object(self, token, site_identifier, domain, obj):
+    def type_version(self, token, site_identifier, domain, type_id):
+        key = (site_identifier, domain, type_id)
+        with self.type_lock:
+            if key in self.type_versions:
+                self.type_versions.move_to_end(key)
+                return self.type_versions[key]
+            generation = self.type_generations.get(key, 0)
+        type = self.fetch_object(token, site_identifier, domain, type_id)
+        version = None if type is None else type.get("_v", 0)
+        with self.type_lock:
+            if self.type_generations.get(key, 0) != generation: return version
+            self.type_versions[key] = version
+            while len(self.type_versions) > self.type_cache_size:
+                self.type_versions.popitem(last=False)
+        return version
+
+    def post_object(self, token, site_identifier, domain, obj, report=print):
         if "_type" in obj and not "_v" in obj:
-            type = self.fetch_object(token, site_identifier, domain, obj["_type"])
-            if type is not None:
-                obj["_v"] = type.get("_v", 0)
+            version = self.type_version(token, site_identifier, domain, obj["_type"])
+            if version is not None:
+                obj["_v"] = version
 
         url = "%s/rdm_log/v1/site/%s/domain/%s/events" % (self.api_url, site_identifier, domain)
         data = json.dumps({ "data_b64" : base64.b64encode(json.dumps(obj).encode("utf-8")).decode("utf-8") })
-        headers = {'content-type':'application/json', "X-Topcon-Auth" : token}
-        res = requests.post(url, data, headers=headers, verify=self.verify)
-        print_and_assert_http_reponse(a_response=res, a_print_text_on_success=True, a_optional_text="Post object")
+        res = self.http.post(url, data, headers={"X-Topcon-Auth" : token})
+        print_and_assert_http_reponse(a_response=res, a_print_text_on_success=True, a_optional_text="Post object", a_report=report)
+        if obj.get("_type") == "_type":
+            # the type definition has been rewritten, so its cached _v is stale, and so is any lookup still in flight
+            key = (site_identifier, domain, obj.get("_id"))
+            with self.type_lock:
+                self.type_versions.pop(key, None)
+                self.type_generations[key] = self.type_generations.get(key, 0) + 1
 
     def get_stats(self, token, site_identifier, domain):
         url = "%s/rdm/v1/site/%s/domain/%s/stats" % (self.api_url, site_identifier, domain)
-        headers = {'content-type':'application/json', "X-Topcon-Auth" : token}
-        res = requests.get(url, verify=self.verify, headers = headers)
-        while res.status_code == 503:
-            time.sleep(1)
-            res = requests.get(url, verify=self.verify, headers = headers)
+        headers = {"X-Topcon-Auth" : token}
+        res = self.http.throttled_get(url, headers=headers)
         res.raise_for_status()
-        jj = res.json()
+        with get_metrics().phase("decode"):
+            jj = res.json()
         return jj
 
-    def fetch_view_subset(self, token, site_identifier, domain, view, start="", end="", limit=500):
+    def fetch_view_subset(self, token, site_identifier, domain, view, start="", end="", limit=None):
+        """ a page of a view; without a limit the page size adapts to the latency the server shows """
         if start and not isinstance(start, str):
             start = self.safe_b64(json.dumps(start))
+        page_kind = "view" if limit is None else None
+        if limit is None: limit = self.http.transport.throttle.page_size("view")
         url = "%s/rdm/v1/site/%s/domain/%s/view/%s?limit=%d&start=%s&end=%s" % (self.api_url, site_identifier, domain, view, limit, start, end)
-        headers = {'content-type':'application/json', "X-Topcon-Auth" : token}
-        res = requests.get(url, verify=self.verify, headers = headers)
-        while res.status_code == 503:
-            time.sleep(1)
-            res = requests.get(url, verify=self.verify, headers = headers)
+        headers = {"X-Topcon-Auth" : token}
+        res = self.http.throttled_get(url, headers=headers, page_kind=page_kind)
         res.raise_for_status()
-        jj = res.json()
+        with get_metrics().phase("decode"):
+            jj = res.json()
         return jj
 
 class RdmAccessor(object):
     """ RDM access for a specific site/domain """
 
-    def __init__(self, itf, site, domain, token):
+    def __init__(self, itf, site, domain, token, read_back=True):
         if not token: raise ValueError("you must supply a JWT!")
         self.itf = itf
         self.site = site
         self.domain = domain or "sitelink"
         self.token = token
+        self.read_back = read_back
         self.headers = {'content-type':'application/json', "X-Topcon-Auth" : token}
 
     def safe_b64(self, x): return self.itf.safe_b64(x)
@@ -147,11 +152,13 @@ class RdmAccessor(object):
         else:
             return [self.post_object(objects)]
 
-    def post_object(self,  obj):
+    def post_object(self,  obj, report=print):
+        """ post obj and return it as stored, or as posted when read_back is off; report(text) is given the response """
         if not "_id"  in obj: obj["_id"] = str(uuid.uuid1())
         if not "_rev" in obj: obj["_rev"] = str(uuid.uuid4())
         if not "_at"  in obj: obj["_at"] = int(round(time.time() * 1000))
-        self.itf.post_object(self.token, self.site, self.domain, obj)
+        self.itf.post_object(self.token, self.site, self.domain, obj, report)
+        if not self.read_back: return obj
         return self.fetch_object(obj["_id"])
 
     def get_stats(self):
@@ -160,28 +167,281 @@ class RdmAccessor(object):
     def fetch_object(self, _id):
         return self.itf.fetch_object(self.token, self.site, self.domain, _id)
 
-    def fetch_view_all(self, view):
-        result = self.fetch_view_subset(view, "")
-        last_excl = result["last_excl"]
-        while last_excl:
-            res2 = self.fetch_view_subset(view, self.safe_b64(json.dumps(last_excl)))
-            result["items"] += res2["items"]
-            last_excl = res2["last_excl"]
-        return result["items"]
+    def fetch_view_all(self, view, workers=1, ordered=True):
+        return list(self.scan_view(view, workers, ordered))
+
+    def scan_view(self, view, workers=1, ordered=True, limit=None):
+        """ yield every entry of a view, from `workers` key ranges fetched concurrently when workers > 1
+
+        The key space is split on the first character of the leading key, which
+        balances the ranges for views keyed by id such as _head and _hist; other
+        views are still scanned completely, only less evenly. Entries come out in
+        key order unless ordered is False, in which case pages are yielded from
+        whichever range has one ready. Ranges hand their pages over through
+        queues of a few pages, so a scan holds a bounded number of pages however
+        large the view is.
+        """
+        if workers <= 1:
+            yield from self.iter_view(view, limit=limit)
+            return
+        split = [x for x in RDM_VIEW_SPLIT[1:]]
+        if len(split) + 1 < workers:
+            split = [x + y for x in RDM_VIEW_SPLIT for y in RDM_VIEW_SPLIT][1:]
+        ranges = list(zip([None] + split, split + [None]))
+        stop = threading.Event()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan")
+
+        def take(a_pages):
+            page = a_pages.get()
+            if isinstance(page, BaseException): raise page
+            return page
 
-    def fetch_view_subset(self, view, start="", end="", limit=500):
+        try:
+            if not ordered:
+                pages = queue.Queue(maxsize=2 * workers)
+                for first, last in ranges:
+                    executor.submit(self.feed_view_range, pages, stop, view, first, last, limit)
+                remaining = len(ranges)
+                while remaining:
+                    page = take(pages)
+                    if page is None: remaining -= 1
+                    else: yield from page
+                return
+            # keep a bounded number of ranges ahead of the consumer, each holding at most a couple of pages
+            pending = collections.deque()
+            ranges = collections.deque(ranges)
+            while ranges or pending:
+                while ranges and len(pending) < 2 * workers:
+                    first, last = ranges.popleft()
+                    pages = queue.Queue(maxsize=2)
+                    executor.submit(self.feed_view_range, pages, stop, view, first, last, limit)
+                    pending.append(pages)
+                pages = pending.popleft()
+                while True:
+                    page = take(pages)
+                    if page is None: break
+                    yield from page
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def feed_view_range(self, pages, stop, view, first, last, limit=None):
+        """ put the pages of a key range on the queue pages, then None; an error is put in place of the next page.
+        Gives up as soon as stop is set, so a consumer that stops early leaves no thread waiting on a full queue """
+        def put(a_item):
+            while not stop.is_set():
+                try:
+                    pages.put(a_item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        try:
+            for items in self.iter_view_range(view, first, last, limit):
+                if not put(items): return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    def fetch_view_range(self, view, first, last, limit=None):
+        """ the entries whose leading key is at or after the string first and before the string last; None is unbounded """
+        return [item for items in self.iter_view_range(view, first, last, limit) for item in items]
+
+    def iter_view_range(self, view, first, last, limit=None):
+        """ yield the entries of fetch_view_range a page at a time """
+        start = self.safe_b64([first]) if first else ""
+        end = self.safe_b64([last]) if last else ""
+        while True:
+            result = self.fetch_view_subset(view, start, end, limit)
+            items = []
+            for item in result["items"]:
+                key = item["key"]
+                lead = key[0] if isinstance(key, list) and key else key
+                if last and isinstance(lead, str) and lead >= last:
+                    yield items
+                    return
+                items.append(item)
+            yield items
+            if not result["last_excl"]: return
+            start = self.safe_b64(result["last_excl"])
+
+    def iter_view(self, view, start="", end="", limit=None):
+        """ yield the entries of a view page by page, fetching the next page while the current one is consumed """
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="view")
+        try:
+            page = executor.submit(self.fetch_view_subset, view, start, end, limit)
+            while page is not None:
+                result = page.result()
+                last_excl = result["last_excl"]
+                page = executor.submit(self.fetch_view_subset, view, self.safe_b64(json.dumps(last_excl)), end, limit) if last_excl else None
+                for item in result["items"]:
+                    yield item
+        finally:
+            # a consumer that stops early leaves at most one page in flight
+            executor.shutdown(wait=False)
+
+    def fetch_view_subset(self, view, start="", end="", limit=None):
         return self.itf.fetch_view_subset(self.token, self.site, self.domain, view, start, end, limit)
 
+    def fetch_history(self, _id, limit=None):
+        """ every revision of an object in order, paging through its whole range of the _hist view """
+        start, end = self.safe_b64([_id]), self.safe_b64([_id, None])
+        history = []
+        while True:
+            result = self.fetch_view_subset("_hist", start, end, limit)
+            history.extend(item["value"] for item in result["items"] if item["id"] == _id)
+            if not result["last_excl"]: return history
+            start = self.safe_b64(result["last_excl"])
+
     def fetch_view_entry_by_key(self, view_name, key):
         items = self.fetch_view_subset(view_name, key, 1)["items"]
         if len(items) == 0: return None
         if items[0]["key"] != key: return None
         return items[0]
 
-def post_rdm_payload(a_payload, a_rdm_accessor):
+class RdmEventWriterStopped(Exception):
+    """ raised by RdmEventWriter once a post failed for good and every post in flight has finished """
+    def __init__(self, landed, failed_id, error, after):
+        self.landed = landed
+        self.failed_id = failed_id
+        self.error = error
+        self.after = after
+        after_text = ", ".join(["%s %s" % (_id, "landed" if ok else "failed") for _id, ok in after]) or "none"
+        Exception.__init__(self, "posting stopped at object %s: %s. %d object(s) posted before it landed; posts in flight after it: %s" % (failed_id, error, landed, after_text))
+
+class RdmEventWriter(object):
+    """ Pipelined posting through an RdmAccessor.
+
+    Up to `window` posts are in flight at once and post() blocks while the window
+    is full. on_ack(result, error) is called for every event in the order the
+    events were posted, on the posting thread, and then() queues a callback in
+    that same order. The responses are printed there as well, just before their
+    on_ack, so the output of concurrent posts does not interleave. Two revisions of one _id are never in flight together, and
+    a `_type` definition is posted alone: the posts before it are acknowledged
+    first and the posts after it wait for it, so none of them resolves its _v
+    against a version of the type that is being replaced.
+    Connection errors, 429 and 5xx responses are retried; any other failure is a
+    hard error, after which no more events are accepted, the posts in flight are
+    allowed to finish, and post()/flush() raise RdmEventWriterStopped. With
+    keep_going set a hard error is only reported to on_ack and posting goes on.
+    """
+    def __init__(self, accessor, window=RDM_POST_WINDOW, retries=RDM_POST_RETRIES, keep_going=False):
+        self.accessor = accessor
+        self.window = max(1, window)
+        self.retries = retries
+        self.keep_going = keep_going
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.window, thread_name_prefix="post")
+        self.pending = collections.deque()
+        self.in_flight = 0
+        self.last_by_id = {}
+        self.landed = 0
+        self.failure = None
+        self.after = []
+
+    def send(self, obj, report):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.accessor.post_object(obj, report=report)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.retries: raise
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else 0
+                if (status != 429 and status < 500) or attempt == self.retries: raise
+            get_metrics().record_retry("POST", "%s/rdm_log/v1/site/%s/domain/%s/events" % (self.accessor.itf.api_url, self.accessor.site, self.accessor.domain))
+            time.sleep(min(30, 2 ** attempt))
+
+    def post(self, obj, on_ack=None):
+        """ queue obj to be posted and return the future of its post """
+        self.check()
+        barrier = obj.get("_type") == "_type"
+        if barrier: self.flush()
+        while self.in_flight >= self.window:
+            concurrent.futures.wait([self.pending[0][1]] if self.pending[0][1] else [])
+            self.acknowledge()
+            self.check()
+        _id = obj.get("_id")
+        previous = self.last_by_id.get(_id) if _id is not None else None
+        lines = []
+        def run():
+            if previous is not None:
+                concurrent.futures.wait([previous])
+                if previous.exception() is not None: raise RuntimeError("not posted because an earlier revision of %s failed" % _id)
+            return self.send(obj, lines.append)
+        future = self.executor.submit(run)
+        if _id is not None: self.last_by_id[_id] = future
+        self.in_flight += 1
+        self.pending.append((obj, future, on_ack, lines))
+        if barrier:
+            self.flush()
+            return future
+        self.acknowledge()
+        return future
+
+    def then(self, callback):
+        """ call callback() once every event posted so far has been acknowledged """
+        if not self.pending:
+            callback()
+            return
+        self.pending.append((None, None, callback, None))
+
+    def acknowledge(self, block=False):
+        while self.pending:
+            obj, future, callback, lines = self.pending[0]
+            if future is not None and not future.done():
+                if not block: return
+                concurrent.futures.wait([future])
+            self.pending.popleft()
+            if future is None:
+                callback()
+                continue
+            self.in_flight -= 1
+            _id = obj.get("_id")
+            if self.last_by_id.get(_id) is future: del self.last_by_id[_id]
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, e
+            for line in lines: print(line)
+            if self.failure is not None: self.after.append((_id, error is None))
+            elif error is None: self.landed += 1
+            elif not self.keep_going: self.failure = (_id, error)
+            if callback is not None: callback(result, error)
+
+    def check(self):
+        if self.failure is None: return
+        self.acknowledge(block=True)
+        raise RdmEventWriterStopped(self.landed, self.failure[0], self.failure[1], list(self.after))
+
+    def flush(self):
+        self.acknowledge(block=True)
+        self.check()
+
+    def close(self):
+        """ wait for the posts in flight without raising; call flush() first to see a failure """
+        try:
+            self.acknowledge(block=True)
+        finally:
+            self.executor.shutdown(wait=True)
+
+def post_rdm_payload(a_payload, a_event_writer, a_on_ack=None):
     a_payload["_at"] = int(round(time.time() * 1000))
-    print("Posting payload to RDM {}".format(json.dumps(a_payload,indent=4)))
-    a_rdm_accessor.post_object(a_payload) 
+    text = sampled_body("Posting payload", json.dumps(a_payload))
+    if text is not None: print("Posting payload to RDM {}".format(text))
+    return a_event_writer.post(a_payload, on_ack=a_on_ack)
+
+def print_and_assert_http_reponse(a_response, a_print_text_on_success=True, a_optional_text="", a_report=print):
+    log_string = ""
+    if len(a_optional_text) > 0:
+        log_string += "{} ".format(a_optional_text)
+    log_string += "response {}".format(a_response.status_code)
+    if a_response.status_code != 200 or a_print_text_on_success:
+        # bodies can be large, so successful ones are sampled and all of them are cut to size
+        text = sampled_body(a_optional_text, a_response.text, failed=a_response.status_code != 200)
+        if text is not None: log_string += ":{}".format(text)
+
+    a_report(log_string)
+    a_response.raise_for_status()
 
 if __name__ == "__main__":
     # -- >> Available verbs ----------------------------------------------------
@@ -191,13 +451,44 @@ if __name__ == "__main__":
 
     def get_action(object_id):
         """ Get an object with the given ID """
+        if args.cached:
+            with cached_site() as mirror:
+                print(json_dumps(mirror.fetch_object(object_id)))
+            return
         print(json_dumps(rdm_accessor.fetch_object(object_id)))
 
+    def mirror_action():
+        """ Bring the local mirror used by --cached up to date with the site """
+        with cached_site(a_max_staleness=0) as mirror:
+            print("Mirror {} is at cursor {}".format(args.mirror, mirror.cursor()))
+
+    @contextlib.contextmanager
+    def cached_site(a_max_staleness=None):
+        """ the local mirror of the site domain, refreshed from the rdm_log first when it is older than the staleness bound """
+        max_staleness = args.max_staleness if a_max_staleness is None else a_max_staleness
+        mirror = SiteMirror(args.mirror, url=args.url, site=args.site, domain=rdm_accessor.domain)
+        try:
+            age = mirror.age()
+            if age is None or age > max_staleness:
+                log_url = "{}/rdm_log/v1/site/{}/domain/{}/events".format(args.url, args.site, rdm_accessor.domain)
+                try:
+                    mirror.refresh(transport.access(headers={"X-Topcon-Auth" : args.token}, verify=not args.unverified), log_url)
+                except requests.exceptions.RequestException as e:
+                    # an older answer is better than none when the server cannot be reached
+                    if age is None or a_max_staleness == 0: raise
+                    logger.warning("answering from a mirror %d seconds old, its refresh failed: %s", age, e)
+            yield mirror
+        finally:
+            mirror.close()
+
     def download_regions_action():
-        """ Download all active regions and represent them each in a vertex json file """
-        lines = rdm_accessor.fetch_view_all("v_sl_region_by_name")
+        """ Download all active regions and represent them each in a vertex json file, or with --regions-format columnar as one region store """
+        lines = rdm_accessor.scan_view("v_sl_region_by_name", args.view_workers, not args.view_unordered)
+        if args.regions_format == "columnar":
+            write_region_store(lines)
+            return
         current_dir = os.getcwd()
-        region_dir = current_dir + os.path.sep + "regions"
+        region_dir = os.path.join(current_dir, args.regions_dir)
 
         os.makedirs(region_dir, exist_ok=True)
 
@@ -222,51 +513,249 @@ if __name__ == "__main__":
                 print("FileNotFoundError")
                 pass
 
+    # Regions are added to the store as the view is scanned; only their offsets and bounding boxes are kept in memory
+    # until the store is closed and its R-tree built.
+    def write_region_store(a_lines):
+        store = RegionStoreWriter(args.regions_dir)
+        written, skipped = 0, 0
+        try:
+            for line in a_lines:
+                value = line.get("value", {})
+                if value.get("_type") != "sl::region": continue
+                vertices = value.get("vertices", {}).get("data")
+                if vertices and store.add(value["_id"], value.get("name"), vertices):
+                    written += 1
+                else:
+                    skipped += 1
+            store.close()
+        except BaseException:
+            store.abort()
+            raise
+        logger.info("wrote %d region(s) to %s, %d left out without inline vertices", written, args.regions_dir, skipped)
+
+    def region_at_action(lat, lon):
+        """ List the regions of a columnar regions store that contain a point """
+        started = time.perf_counter()
+        store = RegionStore(args.regions_dir)
+        try:
+            found = [{"_id" : r["_id"], "name" : r["name"]} for r in store.containing(float(lat), float(lon))]
+        finally:
+            store.close()
+        logger.info("%d region(s) contain %s, %s (%.1f ms)", len(found), lat, lon, 1000 * (time.perf_counter() - started))
+        print(json_dumps(found))
+
     def view_action(view_name):
         """ Fetch the entries in the given view """
-        lines = rdm_accessor.fetch_view_all(view_name)
-        print(json_dumps(lines))
+        if args.cached:
+            with cached_site() as mirror:
+                print_json_stream(mirror.iter_view(view_name))
+            return
+        print_json_stream(rdm_accessor.scan_view(view_name, args.view_workers, not args.view_unordered))
+
+    # Objects are parsed as they are read and posted through a window of --post-window posts; input that does not
+    # parse or post is written to the --rejects file and the load goes on. Exits with 1 if anything was rejected.
+    def bulk_load(a_file_name, a_lines):
+        stats = LoadStats(report_seconds=args.load_report_seconds)
+        rejects = RejectsFile(args.rejects)
+        writer = RdmEventWriter(rdm_accessor, window=args.post_window, retries=args.post_retries, keep_going=True)
+
+        def reject(a_where, a_error, a_source):
+            stats.rejected += 1
+            print("error: %s %d: %s" % ("line" if a_lines else "value", a_where, a_error))
+            rejects.write(a_where, a_error, a_source)
+
+        def acknowledged(a_where, a_obj, a_result, a_error):
+            if a_error is None:
+                stats.posted += 1
+                print(a_result)
+            else:
+                reject(a_where, a_error, a_obj)
+
+        source = sys.stdin.buffer if a_file_name == "-" else open(a_file_name, "rb")
+        try:
+            stats.reader = CountingReader(source)
+            items = iter_json_lines(stats.reader, json_backend(args.json_backend)) if a_lines else iter_json_values(stats.reader)
+            for where, obj, error in items:
+                stats.read += 1
+                if error is not None:
+                    reject(where, error[0], error[1])
+                elif not isinstance(obj, dict):
+                    reject(where, "not a JSON object", obj)
+                else:
+                    # the writer fills in _id, _rev, _at and _v, so it posts a copy and a reject keeps the input as read
+                    writer.post(dict(obj), on_ack=lambda a_result, a_error, where=where, obj=obj: acknowledged(where, obj, a_result, a_error))
+                if stats.due(): logger.info("load: %s", stats.report())
+            writer.flush()
+        finally:
+            writer.close()
+            rejects.close()
+            if source is not sys.stdin.buffer: source.close()
+        logger.info("load: %s", stats.report())
+        if stats.rejected: raise SystemExit(1)
 
     def load_action(file_name):
-        """ Load a file that contains a JSON object or an array of JSON objects """
-        with open(file_name) as f:
-            event = json.load(f)
-        if isinstance(event, list):
-            for e in event:
-                print(rdm_accessor.post_object(e))
-        else:
-            print(rdm_accessor.post_object(event))
+        """ Load a file ('-' for stdin) that contains a JSON object, an array of JSON objects or a sequence of them """
+        bulk_load(file_name, a_lines=False)
 
     def load_lines_action(file_name):
-        """ Load a file that contains JSON objects, one per line """
-        with open(file_name) as f:
-            for line in f:
-                print(rdm_accessor.post_object(args.site, args.domain, json.loads(line)))
+        """ Load a file ('-' for stdin) that contains JSON objects, one per line """
+        bulk_load(file_name, a_lines=True)
 
     def hist_action(id):
         """ get the history for an object """
-        start = rdm_accessor.itf.safe_b64([id])
-        end =  rdm_accessor.itf.safe_b64([id, None])
-        sset = rdm_accessor.fetch_view_subset("_hist", start, end, 10)
-        history = []
-        for item in sset["items"]:
-            if item["id"] == id:
-                history.append(item["value"])
-            else:
-                break
-        print(json_dumps(history))
+        if args.cached:
+            with cached_site() as mirror:
+                print(json_dumps(mirror.history(id)))
+            return
+        print(json_dumps(rdm_accessor.fetch_history(id)))
+
+    # Ids are read as they are needed and their histories fetched --hist-workers at a time, a bounded number ahead of
+    # the output, which keeps the order of the ids. A type is exported from one scan of the whole _hist view in
+    # --hist-workers key ranges, so objects deleted since are included. Exits with 1 if any history failed.
+    def hist_export_action(selection="-"):
+        """ Stream the full histories of many objects as JSONL, revisions or with --hist-diffs field diffs: ids one per line from a file ('-' for stdin), or type:<_type> for every object of a type """
+        exported = {"objects" : 0, "revisions" : 0, "missing" : 0, "failed" : 0}
+
+        def fetched_histories(a_ids):
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.hist_workers), thread_name_prefix="hist")
+            pending = collections.deque()
+            try:
+                while True:
+                    for _id in a_ids:
+                        pending.append((_id, executor.submit(rdm_accessor.fetch_history, _id)))
+                        if len(pending) >= 2 * args.hist_workers: break
+                    if not pending: return
+                    _id, future = pending.popleft()
+                    try:
+                        history = future.result()
+                    except requests.exceptions.RequestException as e:
+                        exported["failed"] += 1
+                        logger.error("history of %s: %s", _id, e)
+                        continue
+                    yield _id, history
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        with (cached_site() if args.cached else contextlib.nullcontext()) as mirror:
+            source = None
+            try:
+                if selection.startswith("type:"):
+                    type_id = selection[len("type:"):]
+                    items = mirror.iter_view("_hist") if mirror is not None else rdm_accessor.scan_view("_hist", args.hist_workers, True)
+                    histories = ((_id, revisions) for _id, revisions in group_history(items) if any(revision.get("_type") == type_id for revision in revisions))
+                else:
+                    source = sys.stdin if selection == "-" else open(selection)
+                    ids = (line.strip() for line in source if line.strip())
+                    # the mirror is local, and its connection belongs to this thread
+                    histories = ((_id, mirror.history(_id)) for _id in ids) if mirror is not None else fetched_histories(ids)
+                for _id, revisions in histories:
+                    if not revisions:
+                        exported["missing"] += 1
+                        logger.warning("no history for %s", _id)
+                        continue
+                    exported["objects"] += 1
+                    exported["revisions"] += len(revisions)
+                    sys.stdout.write("".join(json.dumps(record, sort_keys=True) + "\n" for record in history_records(revisions, args.hist_diffs)))
+            finally:
+                if source is not None and source is not sys.stdin: source.close()
+        sys.stdout.flush()
+        logger.info("exported %d revision(s) of %d object(s); %d id(s) had no history, %d failed", exported["revisions"], exported["objects"], exported["missing"], exported["failed"])
+        if exported["failed"]: raise SystemExit(1)
 
     def configure_log_projection(a_dest_url, a_verify, a_site, a_domain, a_dest_token):
         print("Projecting RDM '{}' domain log".format(a_domain))
-        dest_rdm_accessor = RdmAccessor(RdmItf(api_url=a_dest_url, verify=a_verify), site=a_site, domain=a_domain, token=a_dest_token)
-        
-        source_rdm_log_projection_url = "{}/rdm_log/v1/site/{}/domain/{}/events".format(args.url, args.site, a_domain)
-        params = {"timeout_ms": 0, "from_cursor_excl":0, "limit":400, "timeout_ms":0 }
+        dest_rdm_accessor = RdmAccessor(RdmItf(api_url=a_dest_url, verify=a_verify, transport=transport), site=a_site, domain=a_domain, token=a_dest_token, read_back=False)
         source_headers = {'content-type':'application/json', "X-Topcon-Auth" : args.token} 
 
-        return dest_rdm_accessor, source_rdm_log_projection_url, params, source_headers
+        return dest_rdm_accessor, source_headers
+
+    # Yields the pages of this site's log of a domain after a_from_cursor_excl, until the log has no more events.
+    # With a_follow set to a threading.Event the log is tailed with long polls until the event is set instead, and
+    # a_caught_up is called whenever the tail of the log has been reached: after a page shorter than the limit asked
+    # for, before polling again, and whenever a poll comes back empty. With --compact, unless following, the rest of
+    # the log is yielded as one compacted page.
+    def iter_log_pages(a_domain, a_from_cursor_excl=0, a_follow=None, a_caught_up=None, a_compact=None):
+        if a_compact is None: a_compact = args.compact and a_follow is None
+        if a_compact:
+            yield compact_log(a_domain=a_domain, a_from_cursor_excl=a_from_cursor_excl)
+            return
+        source_rdm_log_projection_url = "{}/rdm_log/v1/site/{}/domain/{}/events".format(args.url, args.site, a_domain)
+        source_headers = {'content-type':'application/json', "X-Topcon-Auth" : args.token}
+        params = {"from_cursor_excl" : a_from_cursor_excl, "timeout_ms" : args.poll_timeout_ms if a_follow is not None else 0}
+        while not (a_follow is not None and a_follow.is_set()):
+            # A long poll waits for events, so only pages read without waiting say anything about the page size.
+            params["limit"] = transport.throttle.page_size("log")
+            response = transport.throttled_get(source_rdm_log_projection_url, page_kind=None if params["timeout_ms"] else "log", verify=not args.unverified, headers=source_headers, params=params)
+            print_and_assert_http_reponse(a_response=response, a_print_text_on_success=False, a_optional_text="Fetch event page")
+
+            if response.status_code == 200:
+                with get_metrics().phase("decode"):
+                    page = response.json()
+                params["from_cursor_excl"] = page["cursor_incl"]
+                yield page
+                # the next poll may wait for new events, so what is queued is handed over first
+                if a_follow is not None and a_caught_up is not None and len(page["events"]) < params["limit"]: a_caught_up()
+
+            elif response.status_code == 204 and a_follow is not None:
+                if a_caught_up is not None: a_caught_up()
+
+            elif response.status_code == 204: # No data returned meaning the query has finalised. Treat this as distinct from an error.
+                print("Query finished.")
+                return
+            else:
+                print("An error occurred.")
+                return
+
+    # --compact: the rest of the log is read before anything is copied and only the latest revision of each object
+    # is replayed, at the position the object first appeared so objects still follow the ones they were created after.
+    # Objects deleted at the source are dropped, unless the copy resumes from a cursor and may already hold them.
+    def compact_log(a_domain, a_from_cursor_excl):
+        heads = collections.OrderedDict()
+        read, deleted = 0, 0
+        keep_deletes = a_from_cursor_excl != 0
+        cursor = a_from_cursor_excl
+        for page in iter_log_pages(a_domain, a_from_cursor_excl, a_compact=False):
+            with get_metrics().phase("decode"):
+                objects = [json.loads(base64.b64decode(event["data_b64"]).decode('utf-8')) for event in page["events"]]
+            for event, obj in zip(page["events"], objects):
+                read += 1
+                key = obj.get("_id", ("event", read))
+                if obj.get("_deleted") and not keep_deletes:
+                    if heads.pop(key, None) is not None: deleted += 1
+                else:
+                    heads[key] = event
+            cursor = page["cursor_incl"]
+        print("Compacted {} event(s) of the RDM '{}' domain log to {} object(s), {} deleted object(s) dropped".format(read, a_domain, len(heads), deleted))
+        return {"events" : list(heads.values()), "cursor_incl" : cursor}
+
+    def file_source_url(a_file_uuid, a_source_headers, a_slug):
+        """ where the content of a file at the source can be downloaded from """
+        get_file_url = "{}/file/v1/sites/{}/files/{}/url".format(args.url, args.site, a_file_uuid)
+        res = transport.throttled_get(get_file_url, verify=not args.unverified, headers=a_source_headers)
+        print_and_assert_http_reponse(a_response=res, a_print_text_on_success=True, a_optional_text="Get file location")
+        print("{}: Processing file from {}".format(a_slug, get_file_url))
+        return "{0}{1}".format(args.url, res.text)
+
+    particular_dict = {
+        "Lines" : "LN3",
+        "Points" : "PT3",
+        "Surfaces" : "TN3",
+        "Roads" : "RD3",
+        "Planes" : "PL3"
+    }
 
-    def event_callback_filesystem(a_event, a_source_headers, a_dest_url, a_dest_site, a_dest_token, a_dest_rdm_accessor, a_status_dict):
+    media_type_dict = {
+        "Lines" : "application/vnd.topcon.ln3",
+        "Points" : "application/vnd.topcon.pt3",
+        "Surfaces" : "application/vnd.topcon.tn3",
+        "Roads" : "application/vnd.topcon.rd3",
+        "Planes" : "application/vnd.topcon.pl3"
+    }
+
+    def design_file_source_url(a_design_object):
+        return "{}/designfile/v1/sites/{}/design_files/{}?design_type={}&particular={}".format(args.url, args.site, a_design_object["doFileUUID"], a_design_object["designType"], particular_dict[a_design_object["designType"]])
+
+    def event_callback_filesystem(a_event, a_source_headers, a_dest_url, a_dest_site, a_dest_token, a_dest_writer, a_status_dict, a_pipeline, a_journal, a_shared_files=None, a_outcome=None):
         slug, decoded_event, object_type = process_log_event(a_event=a_event, a_status_dict=a_status_dict)
 
         if object_type.startswith("_"):
@@ -274,62 +763,32 @@ if __name__ == "__main__":
 
         elif object_type == "fs::file":
             # Download the file. Don't ignore archived files as they may be the origin of design file content.
-            get_file_url = "{}/file/v1/sites/{}/files/{}/url".format(args.url, args.site, decoded_event["uuid"])
-            res = requests.get(get_file_url, verify=not args.unverified, headers=a_source_headers)
-            while res.status_code == 503:
-                time.sleep(1)
-                res = requests.get(get_file_url, verify=not args.unverified, headers=a_source_headers)
-            print_and_assert_http_reponse(a_response=res, a_print_text_on_success=True, a_optional_text="Get file location")
-            # get the content of the url
-            output_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), args.site)
-            print("{}: Processing file from {}".format(slug, get_file_url))
-            download_file(a_source_url="{0}{1}".format(args.url, res.text), a_source_headers=a_source_headers, a_output_file_name=decoded_event["uuid"], a_output_dir=output_dir, a_source_site=args.site)
+            # The transfer runs on the pipeline's worker pool; the RDM event is posted in log order once it has uploaded.
+            def transfer_file():
+                # The file location is only looked up when the content has to be fetched.
+                source_url = lambda: file_source_url(a_file_uuid=decoded_event["uuid"], a_source_headers=a_source_headers, a_slug=slug)
 
-            # Now upload the file under the same parent (if specified) at the dest site.
-            url = "{}/file/v1/sites/{}/upload".format(a_dest_url, a_dest_site)
-            media_type="multipart/mixed"
-            upload_success = upload_file_multipart(a_url=url, a_upload_uuid=decoded_event["uuid"], a_file_location=output_dir, a_file_name=decoded_event["uuid"], a_media_type=media_type, a_encoding_type="binary", a_jwt=a_dest_token)
+                # Copy the content of the url to the file under the same parent (if specified) at the dest site.
+                url = "{}/file/v1/sites/{}/upload".format(a_dest_url, a_dest_site)
+                media_type="multipart/mixed"
+                return copy_file_content(a_source_url=source_url, a_source_headers=a_source_headers, a_upload_url=url, a_upload_uuid=decoded_event["uuid"], a_file_name=decoded_event["uuid"], a_media_type=media_type, a_encoding_type="binary", a_dest_token=a_dest_token, a_source_object=decoded_event, a_journal=a_journal, a_dest_url=a_dest_url, a_dest_site=a_dest_site, a_shared_files=a_shared_files)
 
-            if upload_success:
-                copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="uuid={}".format(decoded_event["uuid"]), a_decoded_event=decoded_event, a_rdm_accessor=a_dest_rdm_accessor, a_status_dict=a_status_dict)
-            else:
-                a_status_dict["errors"] += 1
-                print("Upload failed.")
+            a_pipeline.transfer(key=decoded_event["uuid"], transfer_fn=transfer_file,
+                post_fn=lambda: copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="uuid={}".format(decoded_event["uuid"]), a_decoded_event=decoded_event, a_event_writer=a_dest_writer, a_status_dict=a_status_dict, a_outcome=a_outcome),
+                fail_fn=lambda error: transfer_failed(a_slug=slug, a_error=error, a_status_dict=a_status_dict, a_outcome=a_outcome))
 
         elif object_type == "fs::folder":
-            copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_rdm_accessor=a_dest_rdm_accessor, a_status_dict=a_status_dict)
-
-    def event_callback_sitelink(a_event, a_source_headers, a_dest_url, a_dest_site, a_dest_token, a_dest_rdm_accessor, a_status_dict):
-
-        particular_dict = {
-            "Lines" : "LN3",
-            "Points" : "PT3",
-            "Surfaces" : "TN3",
-            "Roads" : "RD3",
-            "Planes" : "PL3"
-        }
-
-        media_type_dict = {
-            "Lines" : "application/vnd.topcon.ln3",
-            "Points" : "application/vnd.topcon.pt3",
-            "Surfaces" : "application/vnd.topcon.tn3",
-            "Roads" : "application/vnd.topcon.rd3",
-            "Planes" : "application/vnd.topcon.pl3"
-        }
+            a_pipeline.post(lambda: copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_event_writer=a_dest_writer, a_status_dict=a_status_dict, a_outcome=a_outcome))
+
+    def event_callback_sitelink(a_event, a_source_headers, a_dest_url, a_dest_site, a_dest_token, a_dest_writer, a_status_dict, a_pipeline, a_journal, a_shared_files=None, a_outcome=None):
 
         slug, decoded_event, object_type = process_log_event(a_event=a_event, a_status_dict=a_status_dict)
 
         if object_type.startswith("_"):
             ignored = ignore_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_status_dict=a_status_dict, a_additional_text="internal RDM type")
 
-        elif object_type == "sl::list":
-            ignored = ignore_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_status_dict=a_status_dict, a_additional_text="lists are special purpose objects")
-
-        elif object_type == "sl::site":
-            ignored = ignore_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_status_dict=a_status_dict, a_additional_text="the source site definition is not copied to the destination site")
-
-        elif object_type == "sl::working_set":
-            ignored = ignore_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_status_dict=a_status_dict, a_additional_text="working sets are obsolete")
+        elif object_type in SITELINK_IGNORED_TYPES:
+            ignored = ignore_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_status_dict=a_status_dict, a_additional_text=SITELINK_IGNORED_TYPES[object_type])
 
         elif object_type == "sl::designObjectSet":
 
@@ -347,67 +806,124 @@ if __name__ == "__main__":
             # The Sitelink3D v2 website creates a default design set when a site is created. This 
             # assists with usability for web users and results in an RDM object that we don't want
             # to replicate at the destination site. Exclude it here based on the known UUID:
-            if decoded_event["_id"] == "04585119-e2c2-4ed2-b336-5a30ca90c95f": # default_design_object_set
+            if decoded_event["_id"] == DEFAULT_DESIGN_OBJECT_SET_ID:
                 return
 
-            copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_rdm_accessor=a_dest_rdm_accessor, a_status_dict=a_status_dict)
+            a_pipeline.post(lambda: copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_event_writer=a_dest_writer, a_status_dict=a_status_dict, a_outcome=a_outcome))
 
         elif object_type == "sl::designObject" or object_type == "sl::deviceDesignObject":
 
             # Each design object is actually stored as a MAXML file that we must now download and upload at the destination site. We do this via the design_file service.
-            get_file_url = "{}/designfile/v1/sites/{}/design_files/{}?design_type={}&particular={}".format(args.url, args.site, decoded_event["doFileUUID"], decoded_event["designType"], particular_dict[decoded_event["designType"]])
-            output_name = "{}.{}".format(decoded_event["name"],particular_dict[decoded_event["designType"]])
-            output_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), args.site)
-            print("{}: Processing design file from {}".format(slug, get_file_url))
-            download_file(a_source_url=get_file_url, a_source_headers=a_source_headers, a_output_file_name=decoded_event["doFileUUID"], a_output_dir=output_dir, a_source_site=args.site)
+            def transfer_design_file():
+                get_file_url = design_file_source_url(decoded_event)
+                output_name = "{}.{}".format(decoded_event["name"],particular_dict[decoded_event["designType"]])
+                print("{}: Processing design file from {}".format(slug, get_file_url))
 
-            # Now upload that MAXML to the destination site.
-            upload_uuid = decoded_event["doFileUUID"]
-            design_file_uuid = decoded_event["doFileUUID"]
-            media_type = media_type_dict[decoded_event["designType"]]
+                # Now copy that MAXML to the destination site.
+                upload_uuid = decoded_event["doFileUUID"]
+                design_file_uuid = decoded_event["doFileUUID"]
+                media_type = media_type_dict[decoded_event["designType"]]
 
-            url = "{}/designfile/v1/sites/{}/design_files/{}/fineupload".format(a_dest_url, a_dest_site, design_file_uuid)
-            upload_success = upload_file_multipart(a_url=url, a_upload_uuid=design_file_uuid, a_file_location=output_dir, a_file_name=decoded_event["doFileUUID"], a_media_type=media_type, a_encoding_type="identity", a_jwt=a_dest_token)
-            
-            if upload_success:
+                url = "{}/designfile/v1/sites/{}/design_files/{}/fineupload".format(a_dest_url, a_dest_site, design_file_uuid)
+                return copy_file_content(a_source_url=lambda: get_file_url, a_source_headers=a_source_headers, a_upload_url=url, a_upload_uuid=upload_uuid, a_file_name=decoded_event["doFileUUID"], a_media_type=media_type, a_encoding_type="identity", a_dest_token=a_dest_token, a_source_object=decoded_event, a_journal=a_journal, a_dest_url=a_dest_url, a_dest_site=a_dest_site, a_shared_files=a_shared_files)
+
+            def post_design_object():
                 # Ensure that the RDM payload contains a "createdAt" field.
                 if not "createdAt" in decoded_event:
                     decoded_event["createdAt"] = decoded_event["_at"]
-                copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_rdm_accessor=a_dest_rdm_accessor, a_status_dict=a_status_dict)
-            else:
-                a_status_dict["errors"] += 1
-                print("Upload failed.")
+                copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_event_writer=a_dest_writer, a_status_dict=a_status_dict, a_outcome=a_outcome)
+
+            a_pipeline.transfer(key=decoded_event["doFileUUID"], transfer_fn=transfer_design_file, post_fn=post_design_object,
+                fail_fn=lambda error: transfer_failed(a_slug=slug, a_error=error, a_status_dict=a_status_dict, a_outcome=a_outcome))
 
         else:
-            copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_rdm_accessor=a_dest_rdm_accessor, a_status_dict=a_status_dict)
+            a_pipeline.post(lambda: copy_object_type(a_slug=slug, a_object_type=object_type, a_object_id="_id={}".format(decoded_event["_id"]), a_decoded_event=decoded_event, a_event_writer=a_dest_writer, a_status_dict=a_status_dict, a_outcome=a_outcome))
             
 
-    def process_rdm_domain_events(a_event_callback, a_dest_url, a_verify, a_dest_site, a_domain, a_dest_token, a_status_dict):
-        dest_rdm_accessor, source_rdm_log_projection_url, params, source_headers = configure_log_projection(a_dest_url=a_dest_url, a_verify=a_verify, a_site=a_dest_site, a_domain=a_domain, a_dest_token=a_dest_token)
+    # With a_follow set to a threading.Event the log is tailed with long polls until the event is set, instead
+    # of stopping at the first empty page. a_lag, if given, tracks the events read but not yet landed.
+    # With a_pages set to a function of the start cursor, the events come from the pages it returns instead of the source log.
+    def process_rdm_domain_events(a_event_callback, a_dest_url, a_verify, a_dest_site, a_domain, a_dest_token, a_status_dict, a_pipeline, a_journal, a_follow=None, a_lag=None, a_pages=None, a_shared_files=None):
+        from_cursor_excl = a_journal.cursor(a_domain)
+        if from_cursor_excl:
+            print("Resuming RDM '{}' domain log after cursor {} recorded in {}; --fresh-copy copies everything again".format(a_domain, from_cursor_excl, a_journal.path))
+        dest_rdm_accessor, source_headers = configure_log_projection(a_dest_url=a_dest_url, a_verify=a_verify, a_site=a_dest_site, a_domain=a_domain, a_dest_token=a_dest_token)
+        a_journal.start_domain(a_domain)
+        dest_writer = RdmEventWriter(dest_rdm_accessor, window=args.post_window, retries=args.post_retries)
+
+        # Caught up with the source: let everything queued land before waiting for more.
+        def caught_up():
+            a_pipeline.flush()
+            dest_writer.flush()
+
+        # The compacted log is handled as a single page, so the journal cursor only moves once all of it has landed.
+        if a_pages is not None:
+            pages = a_pages(from_cursor_excl)
+        else:
+            pages = iter_log_pages(a_domain, from_cursor_excl, a_follow=a_follow, a_caught_up=caught_up)
+        for page in pages:
+            process_event_page(a_page=page, a_event_callback=a_event_callback, a_source_headers=source_headers, a_dest_url=a_dest_url, a_dest_site=a_dest_site, a_domain=a_domain, a_dest_token=a_dest_token, a_dest_writer=dest_writer, a_status_dict=a_status_dict, a_pipeline=a_pipeline, a_journal=a_journal, a_lag=a_lag, a_shared_files=a_shared_files)
 
-        more_data = True
-        while more_data:
-            
-            response = requests.get(source_rdm_log_projection_url, verify=a_verify, headers=source_headers, params=params)
-            print_and_assert_http_reponse(a_response=response, a_print_text_on_success=False, a_optional_text="Fetch event page")
-            
-            if response.status_code == 200:
-                res_json = response.json()
-                params["from_cursor_excl"] = res_json["cursor_incl"]
-                for event in res_json["events"]:
-                    a_event_callback(a_event=event, a_source_headers=source_headers, a_dest_url=a_dest_url, a_dest_site=a_dest_site, a_dest_token=a_dest_token, a_dest_rdm_accessor=dest_rdm_accessor, a_status_dict=a_status_dict)
+        # Every event of this domain lands at the destination before the next domain starts.
+        try:
+            a_pipeline.flush()
+            dest_writer.flush()
+        finally:
+            dest_writer.close()
+
+    def process_event_page(a_page, a_event_callback, a_source_headers, a_dest_url, a_dest_site, a_domain, a_dest_token, a_dest_writer, a_status_dict, a_pipeline, a_journal, a_lag=None, a_shared_files=None):
+        for event in a_page["events"]:
+            if a_journal.is_handled(a_domain, event):
+                a_status_dict["count"] += 1
+                a_status_dict["skipped"] += 1
+                release_shared_file(a_domain, event, a_shared_files, (a_dest_url, a_dest_site))
+                continue
+            ticket = a_lag.read() if a_lag is not None else None
+            # Whatever copies the event marks it as not landed when its post or transfer fails, and keeps its post.
+            outcome = {"landed" : True, "post" : None}
+            a_event_callback(a_event=event, a_source_headers=a_source_headers, a_dest_url=a_dest_url, a_dest_site=a_dest_site, a_dest_token=a_dest_token, a_dest_writer=a_dest_writer, a_status_dict=a_status_dict, a_pipeline=a_pipeline, a_journal=a_journal, a_shared_files=a_shared_files, a_outcome=outcome)
+            # The journal entries are written in log order, once everything before them has landed.
+            a_pipeline.post(lambda outcome=outcome, ticket=ticket: event_posted(outcome, a_lag, ticket))
+            a_pipeline.post(lambda event=event, outcome=outcome: a_dest_writer.then(lambda: event_landed(a_domain, event, outcome, a_journal)))
+        last_event = a_page["events"][-1] if a_page["events"] else None
+        a_pipeline.post(lambda cursor=a_page["cursor_incl"]: a_dest_writer.then(lambda: a_journal.page_handled(a_domain, cursor, last_event)))
+        if a_lag is not None:
+            a_lag.cursor = a_page["cursor_incl"]
+
+    def shared_file_key(a_domain, a_event):
+        """ the uuid the content of a file or design object event is shared under, None for other events """
+        decoded_event = json.loads(base64.b64decode(a_event["data_b64"]).decode('utf-8'))
+        object_type = decoded_event.get("_type", "_")
+        if a_domain == "file_system" and object_type == "fs::file":
+            return decoded_event["uuid"]
+        elif a_domain == "sitelink" and object_type in ("sl::designObject", "sl::deviceDesignObject"):
+            return decoded_event["doFileUUID"]
+        return None
 
-            elif response.status_code == 204: # No data returned meaning the query has finalised. Treat this as distinct from an error.
-                print("Query finished.")
-                more_data = False
-            else:
-                print("An error occurred.")
-                more_data = False
+    # An event whose file a destination (a_consumer, its url and site) will not copy still releases it, so shared
+    # downloads are removed once every destination is done with them.
+    def release_shared_file(a_domain, a_event, a_shared_files, a_consumer):
+        if a_shared_files is None: return
+        key = shared_file_key(a_domain, a_event)
+        if key is not None: a_shared_files.release(key, a_consumer)
+
+    # Called once the event's post, if it has one, has been queued. The lag goes down as soon as the post is
+    # acknowledged, rather than when the writer next hands out its acknowledgements.
+    def event_posted(a_outcome, a_lag, a_ticket):
+        if a_lag is None: return
+        if a_outcome["post"] is None:
+            a_lag.landed(a_ticket)
+        else:
+            a_outcome["post"].add_done_callback(lambda _: a_lag.landed(a_ticket))
+
+    def event_landed(a_domain, a_event, a_outcome, a_journal):
+        a_journal.event_handled(a_domain, a_event, a_outcome["landed"])
 
     def process_log_event(a_event, a_status_dict):
         a_status_dict["count"] += 1
         slug = "{}: log_id {}, seq {}".format(a_status_dict["count"], a_event["log_id"], a_event["seq"])
-        decoded_event = json.loads(base64.b64decode(a_event["data_b64"]).decode('utf-8'))
+        with get_metrics().phase("decode"):
+            decoded_event = json.loads(base64.b64decode(a_event["data_b64"]).decode('utf-8'))
         object_type = decoded_event.get("_type", "_")
 
         return slug, decoded_event, object_type
@@ -419,63 +935,496 @@ if __name__ == "__main__":
         print(log_string)
         a_status_dict["ignored"] +=1
 
-    def copy_object_type(a_slug, a_object_type, a_object_id, a_decoded_event, a_rdm_accessor, a_status_dict):
-        try:
-            print("%s: Copy %s object [%s]" % (a_slug, a_object_type, a_object_id))
-            post_rdm_payload(a_payload=a_decoded_event, a_rdm_accessor=a_rdm_accessor)
-            a_status_dict["copied"] += 1
+    def copy_object_type(a_slug, a_object_type, a_object_id, a_decoded_event, a_event_writer, a_status_dict, a_outcome=None):
+        # The post is pipelined; it is counted once the writer acknowledges it, in log order.
+        def acknowledged(a_result, a_error):
+            if a_error is None:
+                a_status_dict["copied"] += 1
+            else:
+                print("%s: Failed to copy %s object [%s]: error: %s" % (a_slug, a_object_type, a_object_id, a_error))
+                a_status_dict["errors"] += 1
+                if a_outcome is not None: a_outcome["landed"] = False
 
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code >= 400: raise
-            print("%s: Failed to copy %s object [%s]: error: %s" % (a_slug, a_object_type, a_object_id, e.response.content))
-            a_status_dict["errors"] += 1
+        print("%s: Copy %s object [%s]" % (a_slug, a_object_type, a_object_id))
+        post = post_rdm_payload(a_payload=a_decoded_event, a_event_writer=a_event_writer, a_on_ack=acknowledged)
+        if a_outcome is not None: a_outcome["post"] = post
 
-    def download_file(a_source_url, a_source_headers, a_output_file_name, a_output_dir, a_source_site):                        
-        response = requests.get(a_source_url, headers=a_source_headers, stream=True)
-        print_and_assert_http_reponse(a_response=response, a_print_text_on_success=False, a_optional_text="Get file")
+    def transfer_failed(a_slug, a_error, a_status_dict, a_outcome=None):
+        if a_error is None:
+            print("%s: Upload failed." % a_slug)
+        else:
+            print("%s: Transfer failed: %s" % (a_slug, a_error))
+        a_status_dict["errors"] += 1
+        if a_outcome is not None: a_outcome["landed"] = False
 
-        if not os.path.exists(a_output_dir):
-            os.mkdir(a_output_dir)
+    def download_file(a_source_url, a_source_headers, a_output_file_name, a_output_dir, a_source_site):
+        os.makedirs(a_output_dir, exist_ok=True)
 
         output_file_qualified_name = os.path.join(a_output_dir, a_output_file_name)
-        with open(output_file_qualified_name, "wb") as handle:
-            for data in tqdm(response.iter_content()):
-                handle.write(data)
+        result = download_engine.download(a_source_url, output_file_qualified_name, headers=a_source_headers)
+        rate = result["bytes"] / result["seconds"] / 1048576 if result["seconds"] > 0 else 0
+        resumed = " (resumed at byte {})".format(result["resumed_from"]) if result["resumed_from"] else ""
+        print("Get file {}: {} bytes in {:.2f}s, {:.2f} MB/s{}".format(a_output_file_name, result["bytes"], result["seconds"], rate, resumed))
         return output_file_qualified_name
 
-    def print_and_assert_http_reponse(a_response, a_print_text_on_success=True, a_optional_text=""):
-        log_string = ""
-        if len(a_optional_text) > 0:
-            log_string += "{} ".format(a_optional_text)
-        log_string += "response {}".format(a_response.status_code)
-        if a_response.status_code != 200 or a_print_text_on_success:
-            # we don't print success texts in some instances due to size
-            log_string += ":{}".format(a_response.text)
+    def stream_file(a_source_url, a_source_headers, a_upload_url, a_upload_uuid, a_file_name, a_media_type, a_encoding_type, a_dest_token, a_sha1=None, a_file_size=None):
+        uploader = MultipartUploader(transport.access(verify=not args.unverified), part_size=SITELINK_MAX_FILE_PART_SIZE, window=args.upload_window, retries=args.upload_retries)
+        open_source = lambda: download_engine.http.get(a_source_url, headers=a_source_headers, stream=True)
+        started = time.time()
+        result = uploader.upload_stream(open_source, url=a_upload_url, upload_uuid=a_upload_uuid, file_name=a_file_name, media_type=a_media_type, encoding_type=a_encoding_type, jwt=a_dest_token, sha1=a_sha1, file_size=a_file_size, memory_limit=args.stream_memory)
+        seconds = time.time() - started
+        rate = result["bytes"] / seconds / 1048576 if seconds > 0 else 0
+        print("Stream file {}: {} bytes in {:.2f}s, {:.2f} MB/s, {} source read(s)".format(a_file_name, result["bytes"], seconds, rate, result["passes"]))
+        return result["success"]
+
+    def destination_files(a_dest_url, a_dest_site, a_dest_token):
+        """ uuid -> (sha1, size) of the fs::file objects the destination already holds, read once per destination """
+        key = (a_dest_url, a_dest_site)
+        with destination_files_lock:
+            if key not in destination_file_index:
+                dest_rdm_accessor = RdmAccessor(RdmItf(api_url=a_dest_url, verify=not args.unverified, transport=transport), site=a_dest_site, domain="file_system", token=a_dest_token)
+                index = {}
+                for item in dest_rdm_accessor.iter_view("_head"):
+                    value = item.get("value") or {}
+                    if value.get("_type") == "fs::file" and "uuid" in value:
+                        index[value["uuid"]] = metadata_digest(value)
+                destination_file_index[key] = index
+            return destination_file_index[key]
+
+    def upload_blob(a_source_url, a_source_headers, a_upload_url, a_upload_uuid, a_file_name, a_media_type, a_encoding_type, a_dest_token, a_sha1, a_file_size):
+        """ upload through the local blob cache, downloading the content only when the cache does not hold it """
+        hits = blob_cache.hits
+        path = blob_cache.fetch(a_sha1, a_file_size, lambda a_path: download_engine.download(a_source_url(), a_path, headers=a_source_headers))
+        print("File {}: {} bytes {}".format(a_file_name, a_file_size, "from the blob cache" if blob_cache.hits > hits else "downloaded into the blob cache"))
+        uploader = MultipartUploader(transport.access(verify=not args.unverified), part_size=SITELINK_MAX_FILE_PART_SIZE, window=args.upload_window, retries=args.upload_retries)
+        return uploader.upload(url=a_upload_url, upload_uuid=a_upload_uuid, file_path=path, file_name=a_file_name, media_type=a_media_type, encoding_type=a_encoding_type, jwt=a_dest_token, sha1=a_sha1)
+
+    # a_source_url is a function returning the url of the content, called only when the content has to be fetched.
+    # With a_shared_files the content is downloaded once for every destination of a copy-many, or read from the
+    # archive being imported; each destination releases the file when it is done with it, whether it needed the
+    # content or not.
+    def copy_file_content(a_source_url, a_source_headers, a_upload_url, a_upload_uuid, a_file_name, a_media_type, a_encoding_type, a_dest_token, a_source_object, a_journal, a_dest_url, a_dest_site, a_shared_files=None):
+        try:
+            if a_journal.is_uploaded(a_upload_url, a_upload_uuid):
+                print("File {} was already uploaded".format(a_upload_uuid))
+                return True
+            success = transfer_file_content(a_source_url=a_source_url, a_source_headers=a_source_headers, a_upload_url=a_upload_url, a_upload_uuid=a_upload_uuid, a_file_name=a_file_name, a_media_type=a_media_type, a_encoding_type=a_encoding_type, a_dest_token=a_dest_token, a_source_object=a_source_object, a_dest_url=a_dest_url, a_dest_site=a_dest_site, a_shared_files=a_shared_files)
+        finally:
+            if a_shared_files is not None:
+                a_shared_files.release(a_upload_uuid, (a_dest_url, a_dest_site))
+
+        if success:
+            a_journal.record_upload(a_upload_url, a_upload_uuid)
+        return success
+
+    def transfer_file_content(a_source_url, a_source_headers, a_upload_url, a_upload_uuid, a_file_name, a_media_type, a_encoding_type, a_dest_token, a_source_object, a_dest_url, a_dest_site, a_shared_files):
+        sha1, file_size = metadata_digest(a_source_object)
+        if sha1 is not None and not args.no_dedup and destination_files(a_dest_url, a_dest_site, a_dest_token).get(a_upload_uuid) == (sha1, file_size):
+            print("File {} is already at the destination with the same sha1 and size".format(a_upload_uuid))
+            return True
+        elif a_shared_files is not None:
+            path = a_shared_files.fetch(a_upload_uuid, lambda a_path: download_engine.download(a_source_url(), a_path, headers=a_source_headers))
+            uploader = MultipartUploader(transport.access(verify=not args.unverified), part_size=SITELINK_MAX_FILE_PART_SIZE, window=args.upload_window, retries=args.upload_retries)
+            return uploader.upload(url=a_upload_url, upload_uuid=a_upload_uuid, file_path=path, file_name=a_file_name, media_type=a_media_type, encoding_type=a_encoding_type, jwt=a_dest_token, sha1=sha1)
+        elif sha1 is not None and blob_cache is not None:
+            return upload_blob(a_source_url=a_source_url, a_source_headers=a_source_headers, a_upload_url=a_upload_url, a_upload_uuid=a_upload_uuid, a_file_name=a_file_name, a_media_type=a_media_type, a_encoding_type=a_encoding_type, a_dest_token=a_dest_token, a_sha1=sha1, a_file_size=file_size)
+        elif args.transfer_mode == "stream":
+            return stream_file(a_source_url=a_source_url(), a_source_headers=a_source_headers, a_upload_url=a_upload_url, a_upload_uuid=a_upload_uuid, a_file_name=a_file_name, a_media_type=a_media_type, a_encoding_type=a_encoding_type, a_dest_token=a_dest_token, a_sha1=sha1, a_file_size=file_size)
+        else:
+            # Staged: download into a folder named after the source site, then upload from there.
+            output_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), args.site)
+            download_file(a_source_url=a_source_url(), a_source_headers=a_source_headers, a_output_file_name=a_file_name, a_output_dir=output_dir, a_source_site=args.site)
+            return upload_file_multipart(a_url=a_upload_url, a_upload_uuid=a_upload_uuid, a_file_location=output_dir, a_file_name=a_file_name, a_media_type=a_media_type, a_encoding_type=a_encoding_type, a_jwt=a_dest_token, a_verify=not args.unverified, a_window=args.upload_window, a_retries=args.upload_retries)
 
-        print(log_string)
-        a_response.raise_for_status()
+    # The requests a copy keeps in flight: for every destination and domain copied at once its RDM posts, and a
+    # download or the parts of an upload on every transfer worker; plus the source log read.
+    def copy_connections(a_destinations=1, a_domains=1):
+        return a_destinations * a_domains * (args.post_window + args.transfer_workers * max(args.upload_window, args.download_segments)) + 1
 
     def copy_action(a_dest_url, a_dest_site, a_dest_token):
         """ Use log projection to duplicate this RDM's log into a new site."""
 
+        transport.reserve(copy_connections(), hosts=2)
         status_dict = {"count" : 0, "ignored" : 0, "copied" : 0, "errors" : 0, "skipped" : 0 }
+        pipeline = TransferPipeline(workers=args.transfer_workers)
+        journal = CopyJournal(args.journal, source_url=args.url, source_site=args.site, dest_url=a_dest_url, dest_site=a_dest_site)
+        if args.fresh_copy:
+            journal.reset()
+
+        try:
+            process_rdm_domain_events(a_event_callback=event_callback_filesystem, a_dest_url=a_dest_url, a_verify=not args.unverified, a_dest_site=a_dest_site, a_domain="file_system", a_dest_token=a_dest_token, a_status_dict=status_dict, a_pipeline=pipeline, a_journal=journal)
+
+            process_rdm_domain_events(a_event_callback=event_callback_sitelink, a_dest_url=a_dest_url, a_verify=not args.unverified, a_dest_site=a_dest_site, a_domain="sitelink", a_dest_token=a_dest_token, a_status_dict=status_dict, a_pipeline=pipeline, a_journal=journal)
+        finally:
+            pipeline.close()
+            journal.close()
+
+        print("entries: %d objects(s) copied, %d ignored, %d skipped, %d errors." % (status_dict["copied"], status_dict["ignored"], status_dict["skipped"], status_dict["errors"]))
+
+    def sync_action(a_dest_url, a_dest_site, a_dest_token):
+        """ Keep replicating this RDM's log into another site as new events arrive (stop with Ctrl-C)."""
+
+        transport.reserve(copy_connections(a_domains=2), hosts=2)
+        journal = CopyJournal(args.journal, source_url=args.url, source_site=args.site, dest_url=a_dest_url, dest_site=a_dest_site)
+        stop = threading.Event()
+        domains = [("file_system", event_callback_filesystem), ("sitelink", event_callback_sitelink)]
+        status_dicts = dict((domain, {"count" : 0, "ignored" : 0, "copied" : 0, "errors" : 0, "skipped" : 0 }) for domain, _ in domains)
+        lags = dict((domain, ReplicationLag()) for domain, _ in domains)
+        failures = []
+
+        # Each domain is tailed on its own thread so that a long poll on one does not hold up the other.
+        def follow(a_domain, a_event_callback):
+            pipeline = TransferPipeline(workers=args.transfer_workers)
+            try:
+                process_rdm_domain_events(a_event_callback=a_event_callback, a_dest_url=a_dest_url, a_verify=not args.unverified, a_dest_site=a_dest_site, a_domain=a_domain, a_dest_token=a_dest_token, a_status_dict=status_dicts[a_domain], a_pipeline=pipeline, a_journal=journal, a_follow=stop, a_lag=lags[a_domain])
+            except Exception as e:
+                failures.append(e)
+                logger.exception("sync of '%s' domain stopped", a_domain)
+            finally:
+                pipeline.close()
+                stop.set()
+
+        threads = [threading.Thread(target=follow, args=(domain, callback), name="sync-" + domain, daemon=True) for domain, callback in domains]
+        for thread in threads: thread.start()
+        try:
+            while not stop.wait(args.sync_report_seconds):
+                print("sync: " + "; ".join(["%s cursor %s, lag %d events %.1fs, %d copied, %d errors" % (domain, lags[domain].cursor, lags[domain].events(), lags[domain].seconds(), status_dicts[domain]["copied"], status_dicts[domain]["errors"]) for domain, _ in domains]))
+        except KeyboardInterrupt:
+            print("Stopping sync after the current poll ...")
+            stop.set()
+        for thread in threads: thread.join()
+        journal.close()
+
+        totals = dict((key, sum(d[key] for d in status_dicts.values())) for key in ["copied", "ignored", "skipped", "errors"])
+        print("entries: %d objects(s) copied, %d ignored, %d skipped, %d errors." % (totals["copied"], totals["ignored"], totals["skipped"], totals["errors"]))
+        if failures: raise failures[0]
+
+
+    def copy_many_action(file_name="-"):
+        """ Copy this site to every destination listed in a file ('-' for stdin), one 'url site token' per line, reading the source once."""
+
+        source = sys.stdin if file_name == "-" else open(file_name)
+        try:
+            lines = [(number, shlex.split(line, comments=True)) for number, line in enumerate(source, 1)]
+        finally:
+            if source is not sys.stdin: source.close()
+        destinations = []
+        for number, words in lines:
+            if not words: continue
+            if len(words) != 3:
+                logger.error("copy-many line %d: expected 'url site token', got %d word(s)", number, len(words))
+                raise SystemExit(1)
+            url, site, token = words
+            if any(d["url"] == url and d["site"] == site for d in destinations):
+                logger.error("copy-many line %d: %s %s is listed more than once", number, url, site)
+                raise SystemExit(1)
+            journal = CopyJournal(args.journal, source_url=args.url, source_site=args.site, dest_url=url, dest_site=site)
+            if args.fresh_copy:
+                journal.reset()
+            destinations.append({"url" : url, "site" : site, "token" : token, "journal" : journal, "pages" : queue.Queue(maxsize=args.fanout_buffer), "failure" : None,
+                "status" : {"count" : 0, "ignored" : 0, "copied" : 0, "errors" : 0, "skipped" : 0 }})
+        if not destinations:
+            logger.warning("copy-many: no destinations in %s", file_name)
+            return
+        transport.reserve(copy_connections(a_destinations=len(destinations)), hosts=len(set(d["url"] for d in destinations)) + 1)
+
+        domains = [("file_system", event_callback_filesystem), ("sitelink", event_callback_sitelink)]
+        source_headers = {'content-type':'application/json', "X-Topcon-Auth" : args.token}
+        shared_files = SharedDownloads(consumers=len(destinations))
+        done = threading.Event()
+        read = threading.Event()
+        running = [len(destinations)]
+        running_lock = threading.Lock()
+
+        # A page is queued for every destination still running; a full queue holds up the source reader, so
+        # the destinations run at most --fanout-buffer pages apart. The files of a page a destination that has
+        # stopped will not see are released on its behalf.
+        def fan_out(a_page):
+            for destination in destinations:
+                while destination["failure"] is None:
+                    try:
+                        destination["pages"].put(a_page, timeout=1)
+                        break
+                    except queue.Full:
+                        pass
+                else:
+                    release_page(a_page, destination)
+
+        def release_page(a_page, a_destination):
+            domain, page = a_page
+            for event in page["events"] if page is not None else []:
+                release_shared_file(domain, event, shared_files, (a_destination["url"], a_destination["site"]))
+
+        def read_source():
+            try:
+                for domain, _ in domains:
+                    # The log is read from the earliest destination cursor; each destination skips what its own covers.
+                    for page in iter_log_pages(domain, min(d["journal"].cursor(domain) for d in destinations)):
+                        if all(d["failure"] is not None for d in destinations): break
+                        # every destination releases the file of each event once, so a file is kept until all of them are past its last event
+                        for event in page["events"]:
+                            key = shared_file_key(domain, event)
+                            if key is not None: shared_files.expect(key)
+                        fan_out((domain, page))
+                    fan_out((domain, None))
+            except Exception as e:
+                logger.exception("copy-many: reading the source stopped")
+                for destination in destinations:
+                    destination["failure"] = destination["failure"] or e
+            finally:
+                read.set()
+
+        # The pages up to a destination's journal cursor are skipped, and so are the events up to the one at the
+        # cursor in the page that spans it. A compacted page is not in log order, so only the journal's events are
+        # skipped in it.
+        def uncopied(a_page, a_cursor, a_cursor_event):
+            if a_page["cursor_incl"] <= a_cursor: return [], a_page["events"]
+            keys = [CopyJournal.event_key(event) for event in a_page["events"]]
+            if args.compact or a_cursor_event not in keys: return a_page["events"], []
+            at = keys.index(a_cursor_event) + 1
+            return a_page["events"][at:], a_page["events"][:at]
+
+        def copy_to(a_destination):
+            pipeline = TransferPipeline(workers=args.transfer_workers)
+            try:
+                for domain, callback in domains:
+                    dest_rdm_accessor = RdmAccessor(RdmItf(api_url=a_destination["url"], verify=not args.unverified, transport=transport), site=a_destination["site"], domain=domain, token=a_destination["token"], read_back=False)
+                    dest_writer = RdmEventWriter(dest_rdm_accessor, window=args.post_window, retries=args.post_retries)
+                    a_destination["journal"].start_domain(domain)
+                    cursor, cursor_event = a_destination["journal"].cursor(domain), a_destination["journal"].cursor_event(domain)
+                    if cursor:
+                        print("{} {}: resuming RDM '{}' domain log after cursor {} recorded in {}; --fresh-copy copies everything again".format(a_destination["url"], a_destination["site"], domain, cursor, a_destination["journal"].path))
+                    try:
+                        while a_destination["failure"] is None:
+                            try:
+                                page_domain, page = a_destination["pages"].get(timeout=1)
+                            except queue.Empty:
+                                continue
+                            if page is None: break
+                            events, covered = uncopied(page, cursor, cursor_event)
+                            for event in covered:
+                                release_shared_file(page_domain, event, shared_files, (a_destination["url"], a_destination["site"]))
+                            a_destination["status"]["count"] += len(covered)
+                            a_destination["status"]["skipped"] += len(covered)
+                            if page["cursor_incl"] <= cursor: continue
+                            page = dict(page, events=events)
+                            process_event_page(a_page=page, a_event_callback=callback, a_source_headers=source_headers, a_dest_url=a_destination["url"], a_dest_site=a_destination["site"], a_domain=page_domain, a_dest_token=a_destination["token"], a_dest_writer=dest_writer, a_status_dict=a_destination["status"], a_pipeline=pipeline, a_journal=a_destination["journal"], a_shared_files=shared_files)
+                        pipeline.flush()
+                        dest_writer.flush()
+                    finally:
+                        dest_writer.close()
+            except Exception as e:
+                a_destination["failure"] = e
+                logger.exception("copy-many to %s %s stopped", a_destination["url"], a_destination["site"])
+            finally:
+                pipeline.close()
+                # A stopped destination keeps taking its pages until the source is read, releasing their files.
+                while a_destination["failure"] is not None and not (read.is_set() and a_destination["pages"].empty()):
+                    try:
+                        release_page(a_destination["pages"].get(timeout=1), a_destination)
+                    except queue.Empty:
+                        pass
+                with running_lock:
+                    running[0] -= 1
+                    if running[0] == 0: done.set()
+
+        def report():
+            return "; ".join(["%s %d copied, %d errors, %d page(s) buffered%s" % (d["site"], d["status"]["copied"], d["status"]["errors"], d["pages"].qsize(), ", failed" if d["failure"] is not None else "") for d in destinations])
+
+        reader = threading.Thread(target=read_source, name="copy-many-source", daemon=True)
+        threads = [threading.Thread(target=copy_to, args=(d,), name="copy-many-" + d["site"], daemon=True) for d in destinations]
+        for thread in [reader] + threads: thread.start()
+        try:
+            while not done.wait(args.sync_report_seconds):
+                print("copy-many: " + report())
+        except KeyboardInterrupt:
+            print("Stopping copy-many once the transfers in flight are done ...")
+            for destination in destinations:
+                destination["failure"] = destination["failure"] or "interrupted"
+        finally:
+            for thread in [reader] + threads: thread.join()
+            shared_files.close()
+            for destination in destinations: destination["journal"].close()
+
+        for d in destinations:
+            print("%s %s entries: %d objects(s) copied, %d ignored, %d skipped, %d errors%s." % (d["url"], d["site"], d["status"]["copied"], d["status"]["ignored"], d["status"]["skipped"], d["status"]["errors"], "" if d["failure"] is None else ", stopped: {}".format(d["failure"])))
+        if any(d["failure"] is not None for d in destinations): raise SystemExit(1)
+
+    def export_action(file_name):
+        """ Write this site's file_system and sitelink logs and the content of their files to an archive that import can replay."""
+        writer = SiteArchiveWriter(file_name, source_url=args.url, site=args.site, chunk_events=args.archive_chunk_events)
+        source_headers = {'content-type':'application/json', "X-Topcon-Auth" : args.token}
+        downloads = SharedDownloads(consumers=1)
+        workers = concurrent.futures.ThreadPoolExecutor(max_workers=args.transfer_workers, thread_name_prefix="export")
+        transfers = {}
+
+        def export_file(a_uuid, a_source_url):
+            try:
+                path = downloads.fetch(a_uuid, lambda a_path: download_engine.download(a_source_url(), a_path, headers=source_headers))
+                writer.add_file(a_uuid, path, file_sha1(path))
+            finally:
+                downloads.release(a_uuid)
+
+        try:
+            for domain in ["file_system", "sitelink"]:
+                for page in iter_log_pages(domain):
+                    for event in page["events"]:
+                        with get_metrics().phase("decode"):
+                            obj = json.loads(base64.b64decode(event["data_b64"]).decode('utf-8'))
+                        if obj.get("_deleted"): continue
+                        # Content is fetched while the log is still being read; each file is fetched once for all its revisions.
+                        if obj.get("_type") == "fs::file" and obj.get("uuid") not in transfers:
+                            transfers[obj["uuid"]] = workers.submit(export_file, obj["uuid"], lambda obj=obj: file_source_url(a_file_uuid=obj["uuid"], a_source_headers=source_headers, a_slug="export"))
+                        elif obj.get("_type") in ("sl::designObject", "sl::deviceDesignObject") and obj.get("doFileUUID") not in transfers:
+                            transfers[obj["doFileUUID"]] = workers.submit(export_file, obj["doFileUUID"], lambda obj=obj: design_file_source_url(obj))
+                    writer.add_page(domain, page["events"], page["cursor_incl"])
+            errors = 0
+            for uuid, transfer in transfers.items():
+                try:
+                    transfer.result()
+                except Exception as e:
+                    print("Export of the content of {} failed: {}".format(uuid, e))
+                    writer.add_missing(uuid)
+                    errors += 1
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            workers.shutdown(wait=True, cancel_futures=True)
+            downloads.close()
+
+        print("export: {} event(s) and {} blob(s), {} bytes, of {} file(s) written to {}, {} error(s).".format(sum(d["events"] for d in writer.index["domains"].values()), len(writer.index["blobs"]), sum(writer.index["blobs"].values()), len(writer.index["files"]), file_name, errors))
+        # The archive still holds everything that was exported; the files it misses are listed in its index.
+        if errors: raise SystemExit(1)
+
+    def import_action(file_name):
+        """ Replay an archive written by export into this site; the source of the archive is not contacted."""
+        archive = SiteArchive(file_name)
+        if archive.index.get("missing"):
+            logger.warning("%s does not hold the content of %d file(s) whose export failed", file_name, len(archive.index["missing"]))
+        transport.reserve(copy_connections())
+        status_dict = {"count" : 0, "ignored" : 0, "copied" : 0, "errors" : 0, "skipped" : 0 }
+        pipeline = TransferPipeline(workers=args.transfer_workers)
+        journal = CopyJournal(args.journal, source_url=os.path.abspath(file_name), source_site=archive.index["site"], dest_url=args.url, dest_site=args.site)
+        if args.fresh_copy:
+            journal.reset()
+
+        try:
+            for domain, callback in [("file_system", event_callback_filesystem), ("sitelink", event_callback_sitelink)]:
+                process_rdm_domain_events(a_event_callback=callback, a_dest_url=args.url, a_verify=not args.unverified, a_dest_site=args.site, a_domain=domain, a_dest_token=args.token, a_status_dict=status_dict, a_pipeline=pipeline, a_journal=journal,
+                    a_pages=lambda a_from_cursor_excl, domain=domain: archive.pages(domain, a_from_cursor_excl), a_shared_files=archive)
+        finally:
+            pipeline.close()
+            journal.close()
+            archive.close()
 
-        process_rdm_domain_events(a_event_callback=event_callback_filesystem, a_dest_url=a_dest_url, a_verify=not args.unverified, a_dest_site=a_dest_site, a_domain="file_system", a_dest_token=a_dest_token, a_status_dict=status_dict)
-        
-        process_rdm_domain_events(a_event_callback=event_callback_sitelink, a_dest_url=a_dest_url, a_verify=not args.unverified, a_dest_site=a_dest_site, a_domain="sitelink", a_dest_token=a_dest_token, a_status_dict=status_dict)
-        
         print("entries: %d objects(s) copied, %d ignored, %d skipped, %d errors." % (status_dict["copied"], status_dict["ignored"], status_dict["skipped"], status_dict["errors"]))
 
+    def verify_action(a_dest_url, a_dest_site, a_dest_token):
+        """ Compare the _head views of this site and a copy of it; prints every object missing, unexpected or different at the copy."""
+        ignore = [field for field in args.verify_ignore.split(",") if field]
+        dest_itf = RdmItf(api_url=a_dest_url, verify=not args.unverified, transport=transport)
+        domains = [args.domain] if args.domain else ["file_system", "sitelink"]
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(2, args.view_workers), thread_name_prefix="verify")
+        found = [0]
+
+        # The objects copy leaves out are left out of the comparison as well.
+        def copied(a_value):
+            object_type = a_value.get("_type", "_")
+            if object_type == "sl::designObjectSet": return a_value.get("_id") != DEFAULT_DESIGN_OBJECT_SET_ID
+            return not (object_type.startswith("_") or object_type in SITELINK_IGNORED_TYPES)
+
+        # Source objects are compared as copy posts them: design objects get a createdAt if they have none.
+        def as_copied(a_value):
+            if a_value.get("_type") in ("sl::designObject", "sl::deviceDesignObject") and "createdAt" not in a_value and "_at" in a_value:
+                return dict(a_value, createdAt=a_value["_at"])
+            return a_value
+
+        def digest(a_accessor, a_normalize):
+            view_digest = ViewDigest(depth=args.verify_depth, ignore=ignore)
+            for item in a_accessor.scan_view("_head", args.view_workers, ordered=False):
+                if copied(item["value"]): view_digest.add(item["id"], a_normalize(item["value"]))
+            return view_digest
+
+        def leaf_entries(a_accessor, a_view_digest, a_leaf, a_normalize):
+            items = a_accessor.fetch_view_range("_head", a_leaf, successor(a_leaf)) if a_leaf else a_accessor.fetch_view_all("_head")
+            return [(item["id"], a_normalize(item["value"])) for item in items if copied(item["value"]) and a_view_digest.leaf(item["id"]) == a_leaf]
+
+        def differences():
+            for domain in domains:
+                source = RdmAccessor(rdm_accessor.itf, site=args.site, domain=domain, token=args.token)
+                dest = RdmAccessor(dest_itf, site=a_dest_site, domain=domain, token=a_dest_token)
+                source_digest, dest_digest = executor.map(digest, [source, dest], [as_copied, lambda a_value: a_value])
+                leaves, counts = differing_leaves(source_digest, dest_digest)
+                logger.info("verify %s: %d object(s) at the source, %d at the destination, %s range(s) differ from the root down", domain, source_digest.count, dest_digest.count, "/".join(str(c) for c in counts))
+                # Only the leaf ranges whose digests differ are fetched again, from both sites.
+                fetched = executor.map(lambda a_leaf: (leaf_entries(source, source_digest, a_leaf, as_copied), leaf_entries(dest, dest_digest, a_leaf, lambda a_value: a_value)), leaves)
+                for source_items, dest_items in fetched:
+                    for _id, difference in compare_entries(source_items, dest_items, ignore):
+                        found[0] += 1
+                        yield {"domain" : domain, "_id" : _id, "difference" : difference}
+
+        try:
+            print_json_stream(differences())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("verify: %d difference(s)", found[0])
+        if found[0]: raise SystemExit(1)
+
+    def batch_action(file_name="-"):
+        """ Run one verb per line of a file ('-' for stdin), each line being: site verb [args ...] """
+        global rdm_accessor
+        # one RdmItf for every line, so connections and the type cache carry over
+        itf = rdm_accessor.itf
+        source = sys.stdin if file_name == "-" else open(file_name)
+        lines, failures = 0, 0
+        try:
+            for number, line in enumerate(source, 1):
+                words = shlex.split(line, comments=True)
+                if not words: continue
+                lines += 1
+                if len(words) < 2 or words[1].lower() not in actions or words[1].lower() == "batch":
+                    logger.error("batch line %d: expected 'site verb [args ...]' with a verb other than batch, got %r", number, line.strip())
+                    failures += 1
+                    continue
+                args.site = words[0]
+                rdm_accessor = RdmAccessor(itf, site=args.site, domain=args.domain, token=args.token, read_back=not args.no_read_back)
+                try:
+                    run_action(actions, words[1], words[2:])
+                except SystemExit as e:
+                    # verbs exit nonzero once they have reported what failed; that ends the line, not the batch
+                    if e.code:
+                        logger.error("batch line %d failed with exit status %s", number, e.code)
+                        failures += 1
+                except Exception as e:
+                    logger.error("batch line %d failed: %s", number, e)
+                    failures += 1
+                # a driver reading our output can act on each verb as soon as it is done
+                sys.stdout.flush()
+        finally:
+            if source is not sys.stdin: source.close()
+        logger.info("batch: %d line(s), %d failed", lines, failures)
+        if failures: raise SystemExit(1)
 
     actions = {
+        "batch"   : batch_action,
         "copy"    : copy_action,
+        "sync"    : sync_action,
+        "copy-many" : copy_many_action,
+        "export"  : export_action,
+        "import"  : import_action,
+        "verify"  : verify_action,
         "get"     : get_action,
         "stats"   : stats_action,
         "view"    : view_action,
         "load"    : load_action,
         "lines"   : load_lines_action,
         "hist"    : hist_action,
-        "regions" : download_regions_action
+        "hist-export" : hist_export_action,
+        "mirror"  : mirror_action,
+        "regions" : download_regions_action,
+        "region-at" : region_at_action
     }
 
     # -- >> Argument parsing ---------------------------------------------------
@@ -485,6 +1434,41 @@ if __name__ == "__main__":
     arg_parser.add_argument("--url"    , help="RDM URL (dflt: $RDM_SCHEME://$RDM_HOST:$RDM_PORT)")
     arg_parser.add_argument("--domain" , help="RDM domain")
     arg_parser.add_argument("--jsonl", action="store_true", default=False, help="Output results in json-lines format")
+    arg_parser.add_argument("--no-read-back", action="store_true", default=False, help="load and lines print objects as posted instead of fetching them back")
+    arg_parser.add_argument("--rejects", default="", help="JSONL file load and lines write the input they could not post to, with the reason")
+    arg_parser.add_argument("--json-backend", choices=["auto", "json", "orjson"], default="auto", help="JSON parser lines uses; auto takes orjson when it is installed")
+    arg_parser.add_argument("--load-report-seconds", type=float, default=DEFAULT_LOAD_REPORT_SECONDS, help="how often load and lines report their throughput")
+    arg_parser.add_argument("--view-workers", type=int, default=1, help="key ranges of a view fetched concurrently by view and regions")
+    arg_parser.add_argument("--view-unordered", action="store_true", default=False, help="with --view-workers, print each key range as soon as it arrives instead of in key order")
+    arg_parser.add_argument("--post-window", type=int, default=RDM_POST_WINDOW, help="RDM posts kept in flight by copy, sync, load and lines")
+    arg_parser.add_argument("--post-retries", type=int, default=RDM_POST_RETRIES, help="times a post that failed with a connection error, 429 or 5xx is retried")
+    arg_parser.add_argument("--transfer-workers", type=int, default=DEFAULT_TRANSFER_WORKERS, help="files downloaded and uploaded concurrently by copy")
+    arg_parser.add_argument("--download-buffer", type=int, default=DEFAULT_DOWNLOAD_BUFFER, help="bytes read per write when downloading files")
+    arg_parser.add_argument("--download-segments", type=int, default=DEFAULT_DOWNLOAD_SEGMENTS, help="parallel byte ranges used to fetch large files")
+    arg_parser.add_argument("--segment-threshold", type=int, default=DEFAULT_SEGMENT_THRESHOLD, help="smallest file size in bytes fetched as parallel ranges")
+    arg_parser.add_argument("--upload-window", type=int, default=DEFAULT_UPLOAD_WINDOW, help="parts of one file uploaded concurrently")
+    arg_parser.add_argument("--upload-retries", type=int, default=DEFAULT_UPLOAD_RETRIES, help="times a failed file part is sent again")
+    arg_parser.add_argument("--transfer-mode", choices=["stream", "staged"], default="stream", help="copy files straight from source to destination, or through a local folder")
+    arg_parser.add_argument("--cached", action="store_true", default=False, help="answer get, hist and view from the local mirror of the site")
+    arg_parser.add_argument("--mirror", default=DEFAULT_MIRROR, help="SQLite file holding the local mirror of the site")
+    arg_parser.add_argument("--max-staleness", type=float, default=DEFAULT_MIRROR_STALENESS, help="seconds a --cached answer may lag the site before the mirror is refreshed from the rdm_log")
+    arg_parser.add_argument("--blob-cache", default="", help="directory of a content-addressed cache of copied files, consulted before downloading (empty to disable)")
+    arg_parser.add_argument("--blob-cache-size", type=int, default=DEFAULT_BLOB_CACHE_SIZE, help="bytes the blob cache may hold before the least recently used files are evicted")
+    arg_parser.add_argument("--no-dedup", action="store_true", default=False, help="upload files even when the destination already holds them with the same sha1 and size")
+    arg_parser.add_argument("--compact", action="store_true", default=False, help="copy, copy-many and export take only the latest revision of each object, leaving out objects deleted at the source")
+    arg_parser.add_argument("--archive-chunk-events", type=int, default=DEFAULT_ARCHIVE_CHUNK_EVENTS, help="log events export writes to one compressed chunk of the archive")
+    arg_parser.add_argument("--verify-ignore", default=DEFAULT_VERIFY_IGNORE, help="comma separated fields verify leaves out when comparing objects")
+    arg_parser.add_argument("--verify-depth", type=int, default=DEFAULT_DIGEST_DEPTH, help="id characters that select the leaf range of an object in the digests verify compares")
+    arg_parser.add_argument("--hist-workers", type=int, default=DEFAULT_HIST_WORKERS, help="histories, or key ranges of the _hist view, hist-export fetches concurrently; a type export holds at most a few pages per range")
+    arg_parser.add_argument("--hist-diffs", action="store_true", default=False, help="hist-export writes each revision as the fields it sets and unsets instead of in full")
+    arg_parser.add_argument("--regions-format", choices=["json", "columnar"], default="json", help="regions writes a vertex json file per region, or one columnar store with an R-tree that region-at queries")
+    arg_parser.add_argument("--regions-dir", default="regions", help="folder regions writes to and region-at reads")
+    arg_parser.add_argument("--journal", default=DEFAULT_JOURNAL, help="SQLite file recording copy progress so an interrupted copy resumes (empty to disable)")
+    arg_parser.add_argument("--fresh-copy", action="store_true", default=False, help="ignore the progress recorded in the journal and copy everything again")
+    arg_parser.add_argument("--poll-timeout-ms", type=int, default=20000, help="how long sync waits on the source log for new events")
+    arg_parser.add_argument("--sync-report-seconds", type=float, default=10, help="how often sync reports its replication lag and copy-many the progress of each destination")
+    arg_parser.add_argument("--fanout-buffer", type=int, default=16, help="source log pages copy-many holds for a destination before a slow one holds up the others")
+    arg_parser.add_argument("--stream-memory", type=int, default=DEFAULT_STREAM_MEMORY, help="largest file in bytes held in memory to hash when streaming without source metadata")
     arg_parser.add_argument("site", help="Site identifier")
     arg_parser.add_argument("verb", help="Action, one of " + json.dumps(sorted([a for a in actions])))
     arg_parser.add_argument("args", nargs="*", help="Arguments for verb (see below)")
@@ -501,9 +1485,31 @@ if __name__ == "__main__":
         json_dumps = lambda x: "\n".join([json.dumps(y, sort_keys=True) for y in (x if isinstance(x, list) else [x])])
     else:
         json_dumps = lambda x: json.dumps(x, sort_keys=True, indent=4)
+
+    def print_json_stream(a_items):
+        """ print items as they arrive, with the same output json_dumps would give for the whole list """
+        if args.jsonl:
+            for item in a_items:
+                print(json.dumps(item, sort_keys=True))
+            return
+        separator = "["
+        for item in a_items:
+            print(separator)
+            sys.stdout.write("    " + json.dumps(item, sort_keys=True, indent=4).replace("\n", "\n    "))
+            separator = ","
+        print("[]" if separator == "[" else "\n]")
     # -- << Set up json dumping ------------------------------------------------
 
-    rdm_accessor = RdmAccessor(RdmItf(api_url=args.url, verify=not args.unverified), site=args.site, domain=args.domain, token=args.token)
+    transport = configure_transport(pool_connections=args.pool_connections, pool_maxsize=args.pool_maxsize, max_concurrency=args.max_concurrency, retry_budget=args.retry_budget, target_latency=args.target_latency)
+    download_engine = DownloadEngine(transport.access(verify=not args.unverified), buffer_size=args.download_buffer, segments=args.download_segments, segment_threshold=args.segment_threshold)
+    blob_cache = BlobCache(args.blob_cache, args.blob_cache_size) if args.blob_cache else None
+    destination_file_index, destination_files_lock = {}, threading.Lock()
+    rdm_accessor = RdmAccessor(RdmItf(api_url=args.url, verify=not args.unverified, transport=transport), site=args.site, domain=args.domain, token=args.token, read_back=not args.no_read_back)
     verb = args.verb.lower()
-    run_action(actions, verb, args.args)
+    configure_body_sampling(every=args.log_body_sample, limit=args.log_body_limit)
+    try:
+        run_action(actions, verb, args.args)
+    finally:
+        transport.log_stats()
+        if args.profile: get_metrics().write_report(args.profile)
 """ done """
@@ -0,0 +1,572 @@
+#!/usr/bin/python
+
+""" File transfer support for the site-tool copy verbs. """
+
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import requests
+from requests_toolbelt import MultipartEncoder
+from framework import get_metrics, sampled_body
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRANSFER_WORKERS = 4
+DEFAULT_DOWNLOAD_BUFFER = 1048576
+DEFAULT_DOWNLOAD_SEGMENTS = 1
+DEFAULT_SEGMENT_THRESHOLD = 67108864
+DEFAULT_UPLOAD_WINDOW = 4
+DEFAULT_UPLOAD_RETRIES = 3
+DEFAULT_STREAM_MEMORY = 67108864
+DEFAULT_BLOB_CACHE_SIZE = 10737418240
+
+class TransferPipeline(object):
+    """ Run file transfers on a worker pool while keeping RDM posts in log order.
+
+    Every event is queued in the order it was read from the source log. An event
+    that depends on a file is only posted once that file finished uploading, and
+    the events queued behind it wait for it, so the destination log keeps the
+    source order. Transfers of the same file are run one after the other.
+    """
+    def __init__(self, workers=DEFAULT_TRANSFER_WORKERS, max_pending=None):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending or self.workers * 4
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transfer")
+        self.pending = collections.deque()
+        self.last_by_key = {}
+
+    def transfer(self, key, transfer_fn, post_fn, fail_fn):
+        """ run transfer_fn in the pool, then post_fn in log order if it returned True, else fail_fn(error) """
+        previous = self.last_by_key.get(key)
+        def run():
+            if previous is not None: concurrent.futures.wait([previous])
+            return transfer_fn()
+        future = self.executor.submit(run)
+        self.last_by_key[key] = future
+        self.pending.append((key, future, post_fn, fail_fn))
+        self.drain()
+
+    def post(self, post_fn):
+        """ run post_fn once every event queued before it has been posted """
+        if not self.pending:
+            post_fn()
+            return
+        self.pending.append((None, None, post_fn, None))
+        self.drain()
+
+    def drain(self, block=False):
+        """ post every event at the head of the queue whose transfer is complete """
+        while self.pending:
+            key, future, post_fn, fail_fn = self.pending[0]
+            if future is not None and not future.done():
+                if not block and len(self.pending) < self.max_pending: return
+                concurrent.futures.wait([future])
+            self.pending.popleft()
+            if future is None:
+                post_fn()
+                continue
+            if self.last_by_key.get(key) is future: del self.last_by_key[key]
+            try:
+                success, error = future.result(), None
+            except Exception as e:
+                success, error = False, e
+            if success: post_fn()
+            else: fail_fn(error)
+
+    def flush(self):
+        self.drain(block=True)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+class ReplicationLag(object):
+    """ How far a destination trails its source.
+
+    read() is called as each source event is read and returns a ticket for it;
+    landed(ticket) is called from any thread once the event's post has been
+    acknowledged, or once the event has been handled if it posts nothing. The
+    lag is the number of events from the oldest one that has not landed, and
+    how long ago that event was read from the source log.
+    """
+    def __init__(self):
+        self.unlanded = collections.deque()
+        self.done = set()
+        self.tickets = 0
+        self.cursor = None
+        self.lock = threading.Lock()
+
+    def read(self):
+        with self.lock:
+            self.tickets += 1
+            self.unlanded.append((self.tickets, time.time()))
+            return self.tickets
+
+    def landed(self, ticket):
+        with self.lock:
+            self.done.add(ticket)
+            while self.unlanded and self.unlanded[0][0] in self.done:
+                self.done.remove(self.unlanded.popleft()[0])
+
+    def events(self):
+        with self.lock:
+            return len(self.unlanded)
+
+    def seconds(self):
+        with self.lock:
+            if not self.unlanded: return 0.0
+            return max(0.0, time.time() - self.unlanded[0][1])
+
+def content_range_total(response):
+    """ the complete size of the resource from a Content-Range header such as 'bytes 0-99/1234' or 'bytes */1234' """
+    match = re.match(r"bytes [^/]*/(\d+)", response.headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+class DownloadEngine(object):
+    """ Stream downloads to disk with large reads.
+
+    The body is written to '<output>.part' and renamed once complete. An existing
+    '.part' file is resumed with an HTTP Range request. Files of at least
+    segment_threshold bytes are fetched as that many parallel byte ranges written
+    straight into their place in the output file when the server accepts ranges.
+    """
+    def __init__(self, http, buffer_size=DEFAULT_DOWNLOAD_BUFFER, segments=DEFAULT_DOWNLOAD_SEGMENTS, segment_threshold=DEFAULT_SEGMENT_THRESHOLD):
+        self.http = http
+        self.buffer_size = buffer_size
+        self.segments = max(1, segments)
+        self.segment_threshold = segment_threshold
+
+    def download(self, url, output_path, headers=None):
+        """ download url to output_path, returning a dict with the bytes transferred, elapsed seconds and resume offset """
+        started = time.time()
+        part_path = output_path + ".part"
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers or {})
+        if offset: request_headers["Range"] = "bytes=%d-" % offset
+
+        res = self.http.get(url, headers=request_headers, stream=True)
+        try:
+            if res.status_code == 416 and offset:
+                if content_range_total(res) != offset:
+                    # the partial file does not belong to this resource, start over
+                    os.remove(part_path)
+                    return self.download(url, output_path, headers)
+                transferred = 0
+            else:
+                res.raise_for_status()
+                if res.status_code != 206: offset = 0
+                size = int(res.headers.get("Content-Length") or 0)
+                if offset == 0 and self.segments > 1 and size >= self.segment_threshold and res.headers.get("Accept-Ranges") == "bytes":
+                    res.close()
+                    transferred = self.download_segments(url, part_path, size, headers)
+                else:
+                    transferred = self.write_stream(res, part_path, "ab" if offset else "wb")
+        finally:
+            res.close()
+        os.replace(part_path, output_path)
+        return {"path" : output_path, "bytes" : transferred, "seconds" : time.time() - started, "resumed_from" : offset}
+
+    def write_stream(self, response, path, mode):
+        transferred = 0
+        with open(path, mode) as handle:
+            for data in response.iter_content(chunk_size=self.buffer_size):
+                with get_metrics().phase("disk_write"):
+                    handle.write(data)
+                transferred += len(data)
+        return transferred
+
+    def download_segments(self, url, part_path, size, headers):
+        step = -(-size // self.segments)
+        ranges = [(first, min(first + step, size) - 1) for first in range(0, size, step)]
+        with open(part_path, "wb") as handle:
+            handle.truncate(size)
+
+        def fetch(first, last):
+            range_headers = dict(headers or {})
+            range_headers["Range"] = "bytes=%d-%d" % (first, last)
+            range_headers["Accept-Encoding"] = "identity"
+            res = self.http.get(url, headers=range_headers, stream=True)
+            try:
+                res.raise_for_status()
+                if res.status_code != 206: raise IOError("range request for %s was not honoured" % url)
+                position = first
+                with open(part_path, "r+b") as handle:
+                    handle.seek(first)
+                    for data in res.iter_content(chunk_size=self.buffer_size):
+                        with get_metrics().phase("disk_write"):
+                            handle.write(data)
+                        position += len(data)
+                if position != last + 1: raise IOError("range %d-%d of %s ended at %d" % (first, last, url, position))
+            finally:
+                res.close()
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                for future in [executor.submit(fetch, first, last) for first, last in ranges]:
+                    future.result()
+        except Exception:
+            # a preallocated file with holes cannot be resumed from its size
+            os.remove(part_path)
+            raise
+        return size
+
+class BufferPart(object):
+    """ file-like view of bytes [first, last) of a buffer or memory map, read lazily by MultipartEncoder """
+    def __init__(self, buffer, first, last):
+        self.buffer = buffer
+        self.position = first
+        self.last = last
+
+    def __len__(self):
+        return self.last - self.position
+
+    def read(self, size=-1):
+        end = self.last if size is None or size < 0 else min(self.last, self.position + size)
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+def read_stream_parts(response, part_size):
+    """ yield the body of a streamed response as consecutive part_size byte strings """
+    response.raw.decode_content = True
+    while True:
+        chunks, length = [], 0
+        while length < part_size:
+            data = response.raw.read(part_size - length)
+            if not data: break
+            chunks.append(data)
+            length += len(data)
+        if chunks: yield b"".join(chunks)
+        if length < part_size: return
+
+SHA1_PATTERN = re.compile(r"^[0-9a-fA-F]{40}$")
+
+def metadata_digest(obj):
+    """ the (sha1, size) a source object declares for its content, or (None, None) """
+    sha1 = obj.get("sha1") or obj.get("hash")
+    size = obj.get("size")
+    if isinstance(sha1, str) and SHA1_PATTERN.match(sha1) and isinstance(size, int):
+        return sha1.lower(), size
+    return None, None
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as handle, get_metrics().phase("hash"):
+        for data in iter(lambda: handle.read(DEFAULT_DOWNLOAD_BUFFER), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+class BlobCache(object):
+    """ Local content-addressed store of file bodies keyed by SHA-1 and size.
+
+    Blobs live under <path>/<sha1[:2]>/<sha1>-<size>. Every hit refreshes the
+    blob's modification time, and once the store holds more than max_bytes the
+    least recently used blobs are removed, the order surviving restarts through
+    those times. Content is verified against its key before it is admitted.
+    """
+    def __init__(self, path, max_bytes=DEFAULT_BLOB_CACHE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.pending = {}
+        found = []
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.endswith(".tmp") or name.endswith(".part"): continue
+                stat = os.stat(os.path.join(root, name))
+                found.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self.entries[name] = size
+            self.total += size
+
+    def blob_path(self, sha1, size):
+        return os.path.join(self.path, sha1[:2], "%s-%d" % (sha1, size))
+
+    def get(self, sha1, size):
+        """ the path of the cached blob, or None """
+        name = os.path.basename(self.blob_path(sha1, size))
+        with self.lock:
+            if name not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+        path = self.blob_path(sha1, size)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.entries.pop(name, 0)
+            return None
+        return path
+
+    def fetch(self, sha1, size, download):
+        """ the path of the blob, first calling download(path) to fetch it into a temporary path on a miss
+
+        Concurrent misses of the same blob wait for the first one's download instead of starting their own.
+        """
+        path = self.get(sha1, size)
+        if path is not None: return path
+        path = self.blob_path(sha1, size)
+        name = os.path.basename(path)
+        with self.lock:
+            pending = self.pending.get(name)
+            if pending is None:
+                self.pending[name] = concurrent.futures.Future()
+        if pending is not None:
+            return pending.result()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        try:
+            download(temporary)
+            if os.path.getsize(temporary) != size or file_sha1(temporary) != sha1:
+                raise IOError("downloaded content does not match sha1 %s and size %d" % (sha1, size))
+            os.replace(temporary, path)
+            self.admit(name, size)
+        except Exception as e:
+            with self.lock: self.pending.pop(name).set_exception(e)
+            raise
+        finally:
+            if os.path.exists(temporary): os.remove(temporary)
+        with self.lock: self.pending.pop(name).set_result(path)
+        return path
+
+    def admit(self, name, size):
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+                return
+            self.entries[name] = size
+            self.total += size
+            evicted = []
+            # the newest blob stays even when it is larger than the whole cache
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old, old_size = self.entries.popitem(last=False)
+                self.total -= old_size
+                evicted.append(old)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.path, old[:2], old))
+            except FileNotFoundError:
+                pass
+        if evicted: logger.info("blob cache %s: evicted %d blob(s), %d bytes in %d blob(s) remain", self.path, len(evicted), self.total, len(self.entries))
+
+class SharedDownloads(object):
+    """ Files downloaded once for several consumers, such as the destinations of one fan-out copy.
+
+    The first fetch of a key downloads the file into a private temporary folder
+    and concurrent fetches of the key wait for that download. The producer calls
+    expect once for every event that refers to a key, before the consumers see
+    it, and every consumer calls release once per such event, whether it fetched
+    the file or not. The file is removed once every consumer has released it as
+    often as it was expected, so the folder only holds files still being
+    uploaded somewhere. A failed download is raised to the consumers waiting for
+    it and tried again by the next fetch.
+    """
+    def __init__(self, consumers, path=None):
+        self.consumers = consumers
+        self.path = tempfile.mkdtemp(prefix="site-copy-", dir=path)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.expected = collections.Counter()
+        self.released = {}
+        self.downloads = 0
+        self.shared = 0
+
+    def fetch(self, key, download):
+        """ the path of the file, calling download(path) to fetch it unless another consumer already has """
+        owner = False
+        with self.lock:
+            future = self.files.get(key)
+            if future is not None:
+                self.shared += 1
+            else:
+                future = self.files[key] = concurrent.futures.Future()
+                self.downloads += 1
+                owner = True
+        if not owner:
+            return future.result()
+        path = os.path.join(self.path, hashlib.sha1(str(key).encode("utf-8")).hexdigest())
+        try:
+            download(path)
+        except Exception as e:
+            if os.path.exists(path): os.remove(path)
+            with self.lock:
+                if self.files.get(key) is future: del self.files[key]
+            future.set_exception(e)
+            raise
+        future.set_result(path)
+        return path
+
+    def expect(self, key):
+        with self.lock:
+            self.expected[key] += 1
+
+    def release(self, key, consumer=None):
+        with self.lock:
+            released = self.released.setdefault(key, collections.Counter())
+            released[consumer] += 1
+            uses = max(1, self.expected[key])
+            if len(released) < self.consumers or min(released.values()) < uses: return
+            del self.released[key]
+            del self.expected[key]
+            future = self.files.pop(key, None)
+        if future is not None and future.done() and future.exception() is None and os.path.exists(future.result()):
+            os.remove(future.result())
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        logger.info("shared downloads: %d file(s) downloaded, %d fetch(es) served by another consumer's download", self.downloads, self.shared)
+
+class MultipartUploader(object):
+    """ Upload a file to the file or designfile service as numbered parts of one upload-uuid.
+
+    Up to `window` parts are in flight at once, the final part is sent once all
+    the others have landed, and a part that fails with a retryable error is sent
+    again on its own.
+
+    upload() memory maps a local file once, hashes it in place and reads each part
+    from the mapping while it is sent. upload_stream() feeds parts straight from a
+    streamed source response so the content never touches disk.
+    """
+    def __init__(self, http, part_size, window=DEFAULT_UPLOAD_WINDOW, retries=DEFAULT_UPLOAD_RETRIES):
+        self.http = http
+        self.part_size = part_size
+        self.window = max(1, window)
+        self.retries = retries
+
+    def upload(self, url, upload_uuid, file_path, file_name, media_type, encoding_type, jwt, sha1=None):
+        file_size = os.path.getsize(file_path)
+        if file_size == 0:
+            print("Nothing to upload for empty file {}".format(file_name))
+            return True
+
+        with open(file_path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            parts = (BufferPart(mapped, first, min(first + self.part_size, file_size)) for first in range(0, file_size, self.part_size))
+            # reading the mapped file from disk is part of the hash time here
+            if sha1 is None:
+                with get_metrics().phase("hash"):
+                    sha1 = hashlib.sha1(mapped).hexdigest()
+            return self.send_parts(url, upload_uuid, file_name, sha1, file_size, media_type, encoding_type, jwt, parts)
+
+    def upload_stream(self, open_source, url, upload_uuid, file_name, media_type, encoding_type, jwt, sha1=None, file_size=None, memory_limit=None):
+        """ copy the body of open_source() (a streamed response) to the upload url.
+
+        The SHA-1 and size go into every part, so they have to be known before the
+        first part is sent. They are taken from the arguments when the source
+        metadata provides them; otherwise a body of at most memory_limit bytes is
+        held in memory and hashed, and a larger body is read twice, once to hash it
+        and once to upload it. Returns a dict with success, bytes and passes.
+        """
+        memory_limit = DEFAULT_STREAM_MEMORY if memory_limit is None else memory_limit
+        passes = 1
+        source = open_source()
+        try:
+            source.raise_for_status()
+            if sha1 is None or file_size is None:
+                length = source.headers.get("Content-Length")
+                if length is not None and int(length) <= memory_limit and not source.headers.get("Content-Encoding"):
+                    held = list(read_stream_parts(source, self.part_size))
+                    digest = hashlib.sha1()
+                    with get_metrics().phase("hash"):
+                        for part in held: digest.update(part)
+                    sha1, file_size = digest.hexdigest(), sum(len(part) for part in held)
+                    source.close()
+                    source = None
+                    parts = iter(held)
+                else:
+                    digest, file_size = hashlib.sha1(), 0
+                    for part in read_stream_parts(source, self.part_size):
+                        with get_metrics().phase("hash"):
+                            digest.update(part)
+                        file_size += len(part)
+                    sha1 = digest.hexdigest()
+                    source.close()
+                    source = open_source()
+                    source.raise_for_status()
+                    passes = 2
+            if source is not None:
+                parts = read_stream_parts(source, self.part_size)
+            if file_size == 0:
+                print("Nothing to upload for empty file {}".format(file_name))
+                return {"success" : True, "bytes" : 0, "passes" : passes}
+            parts = (BufferPart(part, 0, len(part)) for part in parts)
+            success = self.send_parts(url, upload_uuid, file_name, sha1, file_size, media_type, encoding_type, jwt, parts)
+            return {"success" : success, "bytes" : file_size, "passes" : passes}
+        finally:
+            if source is not None: source.close()
+
+    def send_parts(self, url, upload_uuid, file_name, sha1, file_size, media_type, encoding_type, jwt, parts):
+        """ send the parts yielded in order by parts, pulling the next one only when the window has room """
+        part_total_count = -(-file_size // self.part_size)
+        fields = {
+            "upload-uuid": str(upload_uuid),
+            "upload-file-name": file_name,
+            "upload-file-sha1": sha1,
+            "upload-file-size": str(file_size),
+            "upload-total-parts": str(part_total_count)
+        }
+        headers = {
+            "Authorization": "Bearer " + jwt,
+            "Content-Encoding": encoding_type
+        }
+        final = None
+        in_flight = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.window) as executor:
+            try:
+                for part_index, part in enumerate(parts):
+                    if part_index == part_total_count - 1:
+                        final = part
+                        break
+                    while len(in_flight) >= self.window:
+                        done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                        if not all(f.result() for f in done): return False
+                    in_flight.add(executor.submit(self.upload_part, url, fields, headers, media_type, part_index, part))
+                done, in_flight = concurrent.futures.wait(in_flight)
+                if not all(f.result() for f in done): return False
+            finally:
+                for f in in_flight: f.cancel()
+        if final is None:
+            print("File {} ended before its last part".format(file_name))
+            return False
+        return self.upload_part(url, fields, headers, media_type, part_total_count - 1, final)
+
+    def upload_part(self, url, fields, headers, media_type, part_index, part):
+        part_fields = dict(fields)
+        part_fields["upload-part-index"] = str(part_index)
+        part_fields["upload-part-size"] = str(len(part))
+        start = part.position
+        for attempt in range(self.retries + 1):
+            print("Preparing data part index {} of size {} bytes. Total parts {} ".format(part_index, len(part), fields["upload-total-parts"]))
+            part.position = start
+            part_fields["upload-file"] = (fields["upload-file-name"], part, "application/octet-stream")
+            encoder = MultipartEncoder(fields=part_fields)
+            part_headers = dict(headers)
+            part_headers["Content-Type"] = "multipart/form-data; media-type=\"%s\"; boundary=%s" % (media_type, encoder.boundary_value)
+            try:
+                response = self.http.post(url, headers=part_headers, data=encoder)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                print("File part {} upload error: {}".format(part_index, e))
+            else:
+                text = sampled_body("File part upload", response.text, failed=response.status_code != 200)
+                print("File part upload response {}{}".format(response.status_code, "" if text is None else ":" + text))
+                if response.status_code == 200: return True
+                if response.status_code != 429 and response.status_code < 500: return False
+            if attempt < self.retries:
+                get_metrics().record_retry("POST", url)
+                time.sleep(min(30, 2 ** attempt))
+        return False
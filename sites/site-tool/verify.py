@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+""" Merkle digests of RDM views keyed by id, for comparing a copied site with its source. """
+
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VERIFY_IGNORE = "_at,_rev"
+DEFAULT_DIGEST_DEPTH = 3
+
+def entry_digest(_id, value, ignore=()):
+    """ sha1 of the canonical json of an entry without the fields in ignore """
+    kept = dict((k, v) for k, v in value.items() if k not in ignore) if isinstance(value, dict) else value
+    return hashlib.sha1(json.dumps([_id, kept], sort_keys=True, separators=(",", ":")).encode("utf-8")).digest()
+
+def successor(prefix):
+    """ the smallest string after every string starting with prefix """
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+class ViewDigest(object):
+    """ Merkle tree over the entries of a view keyed by id.
+
+    The leaves are the ids sharing their first `depth` characters. A leaf's
+    digest combines the digests of its entries with XOR, so entries may be added
+    in any order, and each node above it hashes its children in key order, so
+    two views with equal digests at a node hold the same entries below it. Only
+    the leaves are stored: memory depends on the depth, not on the view size.
+    """
+    def __init__(self, depth=DEFAULT_DIGEST_DEPTH, ignore=()):
+        self.depth = depth
+        self.ignore = set(ignore)
+        self.leaves = {}
+        self.count = 0
+
+    def leaf(self, _id):
+        return _id[:self.depth]
+
+    def add(self, _id, value):
+        leaf = self.leaves.setdefault(self.leaf(_id), [0, 0])
+        leaf[0] ^= int.from_bytes(entry_digest(_id, value, self.ignore), "big")
+        leaf[1] += 1
+        self.count += 1
+
+    def levels(self):
+        """ for every prefix length from 0 to depth, the digest of each node of that length """
+        level = dict((prefix, hashlib.sha1(("%s:%040x:%d" % (prefix, xor, count)).encode("utf-8")).hexdigest()) for prefix, (xor, count) in self.leaves.items())
+        levels = [level]
+        for length in range(self.depth - 1, -1, -1):
+            children = {}
+            for prefix in sorted(level):
+                children.setdefault(prefix[:length], []).append("%s=%s" % (prefix, level[prefix]))
+            level = dict((prefix, hashlib.sha1(";".join(nodes).encode("utf-8")).hexdigest()) for prefix, nodes in children.items())
+            levels.append(level)
+        return levels[::-1]
+
+def differing_leaves(source, dest):
+    """ the leaf prefixes whose digests differ, found by descending only into nodes that differ; also returns
+    how many nodes differ at each level """
+    source_levels, dest_levels = source.levels(), dest.levels()
+    frontier = set([""]) if source_levels[0].get("") != dest_levels[0].get("") else set()
+    counts = [len(frontier)]
+    for length in range(1, source.depth + 1):
+        candidates = [p for p in set(source_levels[length]) | set(dest_levels[length]) if p[:length - 1] in frontier]
+        frontier = set(p for p in candidates if source_levels[length].get(p) != dest_levels[length].get(p))
+        counts.append(len(frontier))
+    return sorted(frontier), counts
+
+def compare_entries(source_items, dest_items, ignore=()):
+    """ (id, difference) for every id missing at the destination, only at the destination, or different """
+    source = dict((_id, entry_digest(_id, value, ignore)) for _id, value in source_items)
+    dest = dict((_id, entry_digest(_id, value, ignore)) for _id, value in dest_items)
+    for _id in sorted(set(source) | set(dest)):
+        if _id not in dest: yield _id, "missing"
+        elif _id not in source: yield _id, "unexpected"
+        elif source[_id] != dest[_id]: yield _id, "different"